@@ -0,0 +1,798 @@
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import pypdf
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from project import PdfEdit, ResultCache, TextIndex
+
+### Benchmarks for the hot paths of PdfEdit. These aren't tests (they take a while),
+### run them by hand with `python benchmark.py suite` before and after touching PdfEdit,
+### and compare against a stored baseline with `--baseline`.
+
+# Operations the suite knows how to run, in the order they are run
+SUITE_OPERATIONS = ("merge", "split", "add_watermark", "encrypt_pdf", "decrypt_pdf")
+# Standard PDF fonts, no embedding needed, cycled through when a corpus asks for several fonts
+STANDARD_FONTS = ("Helvetica", "Times-Roman", "Courier", "Helvetica-Bold", "Times-Italic", "Courier-Oblique")
+# Password used for encrypted corpora and the encrypt/decrypt benchmarks
+CORPUS_PASSWORD = "benchmark"
+
+
+def create_benchmark_pdf(filename, pages):
+    """
+    Creates a PDF with the given number of letter sized pages, each with a line of text.
+
+    :param filename: The name of the file to create.
+    :param pages: Number of pages to put in the file.
+    """
+    c = canvas.Canvas(filename, pagesize=letter)
+    for page_number in range(pages):
+        c.drawString(100, 750, f"Benchmark page {page_number + 1}")
+        c.showPage() # Finish the current page and start a new one
+    c.save()
+
+
+def legacy_add_watermark(file_path, watermark_text, output_path):
+    """
+    The add_watermark implementation from before the overlay cache, kept as the "before" measurement.
+    Renders and re-parses a brand new overlay for every single page.
+
+    :param file_path: Path to the PDF file to be watermarked.
+    :param watermark_text: Text to use as the watermark.
+    :param output_path: Path where the watermarked PDF will be saved.
+    """
+    pdf_reader = PdfReader(file_path)
+    pdf_writer = PdfWriter()
+
+    for page in pdf_reader.pages:
+        packet = BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+        can.drawString(100, 100, watermark_text)
+        can.save()
+        packet.seek(0)
+        new_pdf = PdfReader(packet)
+        new_page = pdf_writer.add_page(page)
+        new_page.merge_page(new_pdf.pages[0])
+
+    with open(output_path, "wb") as out:
+        pdf_writer.write(out)
+
+
+def bench_add_watermark(pages=5000):
+    """
+    Measures pages/sec of watermarking a document, before and after the overlay cache.
+
+    :param pages: Number of pages in the generated input document.
+    :return: A dict mapping "before"/"after" to pages per second.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.pdf")
+        output_path = os.path.join(tmp, "output.pdf")
+        create_benchmark_pdf(input_path, pages)
+
+        start = time.perf_counter()
+        legacy_add_watermark(input_path, "Benchmark", output_path)
+        results["before"] = pages / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        PdfEdit().add_watermark(input_path, "Benchmark", output_path)
+        results["after"] = pages / (time.perf_counter() - start)
+    return results
+
+
+def bench_watermark_scaling(pages=20000, max_workers=None):
+    """
+    Measures pages/sec of watermarking a long document with 1, 2, 4, ... worker processes,
+    and the CPU time spent in the calling process, which is the part that doesn't scale.
+
+    :param pages: Number of pages in the generated input document.
+    :param max_workers: Largest number of workers to try, defaults to the number of CPUs.
+    :return: A dict mapping the number of workers to a dict with "pages_per_sec" and
+             "parent_seconds" (CPU seconds of the calling process).
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.pdf")
+        output_path = os.path.join(tmp, "output.pdf")
+        create_benchmark_pdf(input_path, pages)
+        for workers in counts:
+            start = time.perf_counter()
+            cpu_start = time.process_time()
+            PdfEdit().add_watermark(input_path, "Benchmark", output_path, workers=workers)
+            results[workers] = {"pages_per_sec": pages / (time.perf_counter() - start),
+                                "parent_seconds": time.process_time() - cpu_start}
+    return results
+
+
+def bench_incremental_save(pages=500, images_per_page=4):
+    """
+    Measures bytes written and wall time of watermarking a document with a full rewrite,
+    with an incremental update on a copy of the original, and with an incremental update
+    appended to the original in place.
+
+    :param pages: Number of pages in the generated input document.
+    :param images_per_page: Number of images drawn on each page.
+    :return: A dict with the input "size" in bytes, and for each of "full", "incremental"
+             and "in_place" a dict with "bytes_written" and "seconds".
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every image distinct, so most of the file is image data the update doesn't touch
+        input_path = generate_corpus(tmp, files=1, pages=pages, images_per_page=images_per_page,
+                                     image_pool=pages * images_per_page)[0]
+        results["size"] = os.path.getsize(input_path)
+        for mode in ("full", "incremental", "in_place"):
+            events = []
+            pdf_edit = PdfEdit(metrics_sink=events.append)
+            output_path = os.path.join(tmp, f"{mode}.pdf")
+            if mode == "in_place":
+                shutil.copyfile(input_path, output_path)
+                source_path = output_path
+            else:
+                source_path = input_path
+            start = time.perf_counter()
+            pdf_edit.add_watermark(source_path, "Benchmark", output_path, incremental=mode != "full")
+            seconds = time.perf_counter() - start
+            bytes_written = sum(event.get("bytes_written", 0) for event in events if event["phase"] == "write")
+            if mode == "incremental":
+                bytes_written += results["size"] # The copy of the original, done by the OS
+            results[mode] = {"bytes_written": bytes_written, "seconds": seconds}
+    return results
+
+
+def bench_probe(files=500, pages=20, workers=8):
+    """
+    Measures files/sec of triaging a corpus (encryption, page count and page sizes) by fully
+    parsing every file with PdfReader, against PdfEdit.probe_directory without and with its cache.
+
+    :param files: Number of files in the generated corpus.
+    :param pages: Number of pages per file.
+    :param workers: Number of threads for probe_directory.
+    :return: A dict mapping "full_parse", "probe" and "probe_cached" to files per second.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        file_paths = generate_corpus(tmp, files=files, pages=pages, images_per_page=1)
+        cache_path = os.path.join(tmp, "probe_cache.json")
+
+        start = time.perf_counter()
+        for file_path in file_paths:
+            pdf_reader = PdfReader(file_path)
+            page_sizes = [(page.mediabox.width, page.mediabox.height) for page in pdf_reader.pages]
+        results["full_parse"] = files / (time.perf_counter() - start)
+
+        pdf_edit = PdfEdit()
+        results["probe"] = pdf_edit.probe_directory(tmp, workers=workers, cache_path=cache_path)["files_per_sec"]
+        results["probe_cached"] = pdf_edit.probe_directory(tmp, workers=workers, cache_path=cache_path)["files_per_sec"]
+    return results
+
+
+def bench_text_index(files=20, pages=200, workers=None):
+    """
+    Measures pages/sec of building a TextIndex over a corpus with one worker and with
+    several, and the time of an update when nothing changed.
+
+    :param files: Number of files in the generated corpus.
+    :param pages: Number of pages per file.
+    :param workers: Number of worker processes, defaults to the number of CPUs.
+    :return: A dict with "serial" and "parallel" pages per second and "unchanged" seconds.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = os.path.join(tmp, "corpus")
+        generate_corpus(corpus_dir, files=files, pages=pages, fonts=2)
+        for mode, mode_workers in (("serial", 1), ("parallel", workers)):
+            with TextIndex(os.path.join(tmp, f"{mode}.db"), workers=mode_workers) as text_index:
+                results[mode] = text_index.update([corpus_dir])["pages_per_sec"]
+                if mode == "parallel":
+                    results["unchanged"] = text_index.update([corpus_dir])["wall_time"]
+    return results
+
+
+def bench_result_cache(pages=2000):
+    """
+    Measures add_watermark on a long document without a result cache, on a cache miss and on a hit.
+
+    :param pages: Number of pages in the generated input document.
+    :return: A dict mapping "uncached", "miss" and "hit" to seconds.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.pdf")
+        create_benchmark_pdf(input_path, pages)
+        pdf_edit = PdfEdit(result_cache=ResultCache(os.path.join(tmp, "cache")))
+        for mode in ("uncached", "miss", "hit"):
+            start = time.perf_counter()
+            if mode == "uncached":
+                PdfEdit().add_watermark(input_path, "Benchmark", os.path.join(tmp, f"{mode}.pdf"))
+            else:
+                pdf_edit.add_watermark(input_path, "Benchmark", os.path.join(tmp, f"{mode}.pdf"))
+            results[mode] = time.perf_counter() - start
+    return results
+
+
+def legacy_stamp_pages(file_path, start, pages):
+    """
+    Bates numbering the way add_watermark stamps text, kept as the "before" measurement
+    for stamp_pages: a new overlay is drawn, parsed and merged for every page.
+
+    :param file_path: Path to the PDF file to be stamped.
+    :param start: Number stamped on the first page.
+    :param pages: Number of pages to stamp, from the start of the file.
+    :return: The PdfWriter holding the stamped pages.
+    """
+    pdf_reader = PdfReader(file_path)
+    pdf_writer = PdfWriter()
+    for number, page in enumerate(pdf_reader.pages[:pages], start=start):
+        packet = BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+        can.drawString(36, 24, f"CONFIDENTIAL ABC{number:07d}")
+        can.save()
+        packet.seek(0)
+        pdf_writer.add_page(page).merge_page(PdfReader(packet).pages[0])
+    return pdf_writer
+
+
+def bench_stamp_pages(pages=100000, files=10, sample=1000):
+    """
+    Measures pages/sec of Bates numbering a production set split over several files with
+    stamp_pages, against drawing and merging an overlay per page (on the first pages only).
+
+    :param pages: Number of pages in the whole set.
+    :param files: Number of files the set is split over.
+    :param sample: Number of pages stamped with an overlay per page.
+    :return: A dict with "before" and "after" in pages per second, and "peak_rss" in bytes
+             (None where it can't be measured).
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.pdf")
+        create_benchmark_pdf(input_path, pages // files)
+
+        start = time.perf_counter()
+        legacy_stamp_pages(input_path, 1, sample)
+        results["before"] = sample / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        report = PdfEdit().stamp_pages([input_path] * files, "ABC{number:07d}", os.path.join(tmp, "output.pdf"),
+                                       label="CONFIDENTIAL")
+        results["after"] = report["pages"] / (time.perf_counter() - start)
+        results["peak_rss"] = _peak_rss()
+    return results
+
+
+def bench_startup(runs=10):
+    """
+    Measures the cold start of the command line interface: the median wall time of
+    `python project.py split` on a one page file, in a fresh interpreter each run, and
+    the import time of project and of pypdf alone as reported by `python -X importtime`.
+
+    :param runs: Number of runs to take the median of.
+    :return: A dict with "split", "import_project" and "import_pypdf" in milliseconds.
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.pdf")
+        create_benchmark_pdf(input_path, 1)
+        command = [sys.executable, os.path.join(project_dir, "project.py"), "split", input_path, "1", "-o", os.path.join(tmp, "output.pdf")]
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, capture_output=True)
+            times.append(time.perf_counter() - start)
+        results["split"] = statistics.median(times) * 1000
+
+    for module in ("project", "pypdf"):
+        times = []
+        for _ in range(runs):
+            # The last line of -X importtime is the module itself: "import time: self | cumulative | name"
+            stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=project_dir,
+                                    check=True, capture_output=True, text=True).stderr
+            times.append(int(stderr.strip().splitlines()[-1].split("|")[1]) / 1000)
+        results[f"import_{module}"] = statistics.median(times)
+    return results
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Stand-in for a web server serving PDFs: answers Range requests (one range per request)
+    and sends at a limited bandwidth after a fixed round trip, like a slow connection.
+    """
+    bandwidth = 2 * 2**20 # Bytes per second
+    latency = 0.05 # Seconds before the response starts
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        with open(path, "rb") as source:
+            data = source.read()
+        start, end = 0, len(data) - 1
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            first, last = byte_range.split("=")[1].split("-")
+            start, end = int(first), min(int(last), end) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        time.sleep(self.latency)
+        return BytesIO(data[start:end + 1])
+
+    def copyfile(self, source, outputfile):
+        # 64 KiB at a time, each taking as long as it would at the given bandwidth
+        while chunk := source.read(65536):
+            outputfile.write(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_linearize(pages=200, images_per_page=1, bandwidth=2 * 2**20, latency=0.05):
+    """
+    Measures the time to first page of a PDF served over HTTP, from a local server stand-in
+    with limited bandwidth. A plain PDF has its cross-reference table at the end, so a
+    viewer needs the whole file before it can draw anything; a linearized one (written with
+    PdfEdit(linearize=True)) is drawn from the bytes up to /E in its linearization dictionary,
+    fetched with two range requests.
+
+    :param pages: Number of pages in the generated document.
+    :param images_per_page: Number of images drawn on each page, to give the file some weight.
+    :param bandwidth: Bytes per second the server sends at.
+    :param latency: Seconds the server waits before each response.
+    :return: A dict with "plain" and "linearized", each a dict with "seconds" and "bytes"
+             fetched before the first page can be drawn, and "size" of the whole file.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        [corpus_file] = generate_corpus(tmp, files=1, pages=pages, images_per_page=images_per_page, image_pool=pages)
+        PdfEdit().split(corpus_file, f"1-{pages}", os.path.join(tmp, "plain.pdf"))
+        PdfEdit(linearize=True).split(corpus_file, f"1-{pages}", os.path.join(tmp, "linearized.pdf"))
+
+        handler = functools.partial(_RangeHandler, directory=tmp)
+        _RangeHandler.bandwidth, _RangeHandler.latency = bandwidth, latency
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            start = time.perf_counter()
+            with urllib.request.urlopen(f"{url}/plain.pdf") as response:
+                fetched = len(response.read())
+            results["plain"] = {"seconds": time.perf_counter() - start, "bytes": fetched,
+                                "size": os.path.getsize(os.path.join(tmp, "plain.pdf"))}
+
+            start = time.perf_counter()
+            request = urllib.request.Request(f"{url}/linearized.pdf", headers={"Range": "bytes=0-1023"})
+            with urllib.request.urlopen(request) as response:
+                head = response.read()
+            first_page_end = int(re.search(rb"/E (\d+)", head).group(1))
+            request = urllib.request.Request(f"{url}/linearized.pdf", headers={"Range": f"bytes={len(head)}-{first_page_end - 1}"})
+            with urllib.request.urlopen(request) as response:
+                fetched = len(head) + len(response.read())
+            results["linearized"] = {"seconds": time.perf_counter() - start, "bytes": fetched,
+                                     "size": os.path.getsize(os.path.join(tmp, "linearized.pdf"))}
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def generate_corpus(directory, files=4, pages=20, images_per_page=0, fonts=1, encrypted=False, seed=0, image_pool=3):
+    """
+    Generates a synthetic corpus of PDF files to benchmark against.
+
+    Every page gets a few lines of text in each font, and the given number of images.
+    The images are random noise (so they don't compress away) and each file reuses a
+    small set of them across its pages, like logos in real documents.
+
+    :param directory: Directory where the files are created.
+    :param files: Number of files in the corpus.
+    :param pages: Number of pages per file.
+    :param images_per_page: Number of images drawn on each page.
+    :param fonts: Number of different standard fonts used on each page.
+    :param encrypted: Whether the files are encrypted with CORPUS_PASSWORD.
+    :param seed: Seed for the random image data, so corpora are reproducible.
+    :param image_pool: Number of distinct images per file; raise it to get image heavy
+                       files like scanned archives.
+    :return: The list of generated file paths.
+    """
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    file_paths = []
+    for file_number in range(files):
+        images = [ImageReader(Image.frombytes("RGB", (96, 96), rng.randbytes(96 * 96 * 3)))
+                  for _ in range(min(images_per_page * pages, image_pool))]
+        packet = BytesIO()
+        c = canvas.Canvas(packet, pagesize=letter)
+        for page_number in range(pages):
+            for font_number in range(fonts):
+                c.setFont(STANDARD_FONTS[font_number % len(STANDARD_FONTS)], 12)
+                for line in range(3):
+                    y = 750 - (font_number * 3 + line) * 16
+                    c.drawString(72, y, f"File {file_number} page {page_number + 1} line {line} of synthetic corpus text")
+            for image_number in range(images_per_page):
+                x = 72 + (image_number % 4) * 120
+                y = 72 + (image_number // 4) * 120
+                c.drawImage(images[(page_number * images_per_page + image_number) % len(images)], x, y, 96, 96)
+            c.showPage() # Finish the current page and start a new one
+        c.save()
+
+        file_path = os.path.join(directory, f"corpus_{file_number:04d}.pdf")
+        packet.seek(0)
+        if encrypted:
+            pdf_writer = PdfWriter(clone_from=PdfReader(packet))
+            pdf_writer.encrypt(CORPUS_PASSWORD)
+            pdf_writer.write(file_path)
+        else:
+            with open(file_path, "wb") as out:
+                out.write(packet.getvalue())
+        file_paths.append(file_path)
+    return file_paths
+
+
+def percentile(values, fraction):
+    """
+    Returns the given percentile of a list of numbers, interpolating between the closest values.
+
+    :param values: The numbers, in any order.
+    :param fraction: Which percentile, between 0 and 1 (e.g. 0.95 for p95).
+    :return: The percentile value, 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None where it can't be measured.
+    """
+    try:
+        import resource
+    except ImportError: # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_operation(operation, file_paths, encrypted, output_dir, repeat):
+    """
+    Runs one operation over the corpus and measures it. Called in a fresh worker process,
+    so that its peak RSS belongs to this operation alone.
+
+    :param operation: One of SUITE_OPERATIONS.
+    :param file_paths: The corpus files.
+    :param encrypted: Whether the corpus files are encrypted.
+    :param output_dir: Directory for the outputs.
+    :param repeat: How many times to run over the corpus.
+    :return: A dict with calls, pages, seconds, pages_per_sec, latency percentiles and peak_rss.
+    """
+    pdf_edit = PdfEdit()
+    page_counts = {}
+    for file_path in file_paths:
+        pdf_reader = PdfReader(file_path)
+        if pdf_reader.is_encrypted:
+            pdf_reader.decrypt(CORPUS_PASSWORD)
+        page_counts[file_path] = len(pdf_reader.pages)
+
+    # Decrypting needs encrypted inputs and everything else needs plain ones, prepare them outside the timing
+    sources = file_paths
+    if operation == "decrypt_pdf" and not encrypted:
+        sources = [os.path.join(output_dir, f"encrypted_{os.path.basename(path)}") for path in file_paths]
+        for file_path, source in zip(file_paths, sources):
+            pdf_edit.encrypt_pdf(file_path, CORPUS_PASSWORD, source)
+    elif operation != "decrypt_pdf" and encrypted:
+        sources = [os.path.join(output_dir, f"plain_{os.path.basename(path)}") for path in file_paths]
+        for file_path, source in zip(file_paths, sources):
+            pdf_edit.decrypt_pdf(file_path, CORPUS_PASSWORD, source)
+    pages_of = dict(zip(sources, (page_counts[path] for path in file_paths)))
+
+    latencies = []
+    pages = 0
+    output_path = os.path.join(output_dir, f"{operation}_output.pdf")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if operation == "merge":
+            call_start = time.perf_counter()
+            pdf_edit.merge(sources, output_path, overwrite_confirm=True)
+            latencies.append(time.perf_counter() - call_start)
+            pages += sum(pages_of.values())
+            continue
+        for source in sources:
+            call_start = time.perf_counter()
+            if operation == "split":
+                half = max(1, pages_of[source] // 2)
+                pdf_edit.split(source, f"1-{half}", output_path)
+                pages += half
+            elif operation == "add_watermark":
+                pdf_edit.add_watermark(source, "Benchmark", output_path)
+                pages += pages_of[source]
+            elif operation == "encrypt_pdf":
+                pdf_edit.encrypt_pdf(source, CORPUS_PASSWORD, output_path)
+                pages += pages_of[source]
+            elif operation == "decrypt_pdf":
+                pdf_edit.decrypt_pdf(source, CORPUS_PASSWORD, output_path)
+                pages += pages_of[source]
+            latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+
+    return {
+        "calls": len(latencies),
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_sec": pages / seconds if seconds > 0 else 0.0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+        "peak_rss": _peak_rss(),
+    }
+
+
+def run_suite(files=4, pages=20, images_per_page=0, fonts=1, encrypted=False, repeat=3, operations=SUITE_OPERATIONS):
+    """
+    Generates a corpus and benchmarks each operation on it, each in its own fresh process.
+
+    :param files: Number of files in the corpus.
+    :param pages: Number of pages per file.
+    :param images_per_page: Number of images drawn on each page.
+    :param fonts: Number of different fonts used on each page.
+    :param encrypted: Whether the corpus files are encrypted.
+    :param repeat: How many times each operation runs over the corpus.
+    :param operations: Which operations to benchmark.
+    :return: A results dict with "meta" (environment and corpus settings) and per-operation "operations".
+    :raises ValueError: If merge is benchmarked on fewer than two files.
+    """
+    if "merge" in operations and files < 2:
+        raise ValueError("The merge benchmark needs at least two files")
+    corpus = {"files": files, "pages": pages, "images_per_page": images_per_page,
+              "fonts": fonts, "encrypted": encrypted, "repeat": repeat}
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pypdf": pypdf.__version__,
+            "platform": platform.platform(),
+            "corpus": corpus,
+        },
+        "operations": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        file_paths = generate_corpus(os.path.join(tmp, "corpus"), files, pages, images_per_page, fonts, encrypted)
+        for operation in operations:
+            output_dir = os.path.join(tmp, operation)
+            os.makedirs(output_dir)
+            # A new single worker process per operation, so peak RSS isn't carried over between them
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results["operations"][operation] = pool.submit(
+                    _run_operation, operation, file_paths, encrypted, output_dir, repeat).result()
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.10):
+    """
+    Compares benchmark results against a stored baseline.
+
+    An operation regressed when its throughput dropped, or its p95 latency or peak RSS
+    grew, by more than the tolerance.
+
+    :param results: Results dict from run_suite.
+    :param baseline: Results dict loaded from an earlier run.
+    :param tolerance: Allowed relative change, e.g. 0.10 for 10%.
+    :return: A list of messages, one per regression (empty if there are none).
+    """
+    regressions = []
+    for operation, current in results["operations"].items():
+        before = baseline.get("operations", {}).get(operation)
+        if before is None:
+            continue # New operation, nothing to compare with
+        if current["pages_per_sec"] < before["pages_per_sec"] * (1 - tolerance):
+            regressions.append(f"{operation}: throughput {current['pages_per_sec']:.1f} pages/sec, "
+                               f"baseline {before['pages_per_sec']:.1f}")
+        if current["latency"]["p95"] > before["latency"]["p95"] * (1 + tolerance):
+            regressions.append(f"{operation}: p95 latency {current['latency']['p95'] * 1000:.1f} ms, "
+                               f"baseline {before['latency']['p95'] * 1000:.1f} ms")
+        if current["peak_rss"] and before.get("peak_rss") and current["peak_rss"] > before["peak_rss"] * (1 + tolerance):
+            regressions.append(f"{operation}: peak RSS {current['peak_rss'] / 2**20:.1f} MiB, "
+                               f"baseline {before['peak_rss'] / 2**20:.1f} MiB")
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmarks and prints the results.
+    Exits with status 1 if the suite finds a regression against the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark PdfEdit operations")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    suite = commands.add_parser("suite", help="benchmark every operation on a synthetic corpus")
+    suite.add_argument("--files", type=int, default=4, help="number of files in the corpus")
+    suite.add_argument("--pages", type=int, default=20, help="pages per file")
+    suite.add_argument("--images", type=int, default=0, help="images per page")
+    suite.add_argument("--fonts", type=int, default=1, help="fonts per page")
+    suite.add_argument("--encrypted", action="store_true", help="encrypt the corpus files")
+    suite.add_argument("--repeat", type=int, default=3, help="runs of each operation over the corpus")
+    suite.add_argument("--operations", nargs="+", choices=SUITE_OPERATIONS, default=list(SUITE_OPERATIONS))
+    suite.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+    suite.add_argument("--baseline", help="results file to compare against")
+    suite.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change before it counts as a regression")
+
+    watermark = commands.add_parser("watermark-cache", help="add_watermark before and after the overlay cache")
+    watermark.add_argument("--pages", type=int, default=5000, help="pages in the generated input document")
+
+    scaling = commands.add_parser("watermark-scaling", help="add_watermark with an increasing number of workers")
+    scaling.add_argument("--pages", type=int, default=20000, help="pages in the generated input document")
+    scaling.add_argument("--max-workers", type=int, help="largest number of workers, defaults to the number of CPUs")
+
+    text_index = commands.add_parser("text-index", help="building a TextIndex with one and with several workers")
+    text_index.add_argument("--files", type=int, default=20, help="number of files in the corpus")
+    text_index.add_argument("--pages", type=int, default=200, help="pages per file")
+    text_index.add_argument("--workers", type=int, help="worker processes, defaults to the number of CPUs")
+
+    cache = commands.add_parser("result-cache", help="add_watermark without a result cache, on a miss and on a hit")
+    cache.add_argument("--pages", type=int, default=2000, help="pages in the generated input document")
+
+    stamp = commands.add_parser("stamp-pages", help="Bates numbering with stamp_pages against an overlay per page")
+    stamp.add_argument("--pages", type=int, default=100000, help="pages in the whole production set")
+    stamp.add_argument("--files", type=int, default=10, help="files the set is split over")
+    stamp.add_argument("--sample", type=int, default=1000, help="pages stamped with an overlay per page")
+
+    startup = commands.add_parser("startup", help="cold start time of the command line interface")
+    startup.add_argument("--runs", type=int, default=10, help="runs to take the median of")
+    startup.add_argument("--target", type=float, default=100, help="import time of project to aim for, in ms")
+
+    probe = commands.add_parser("probe", help="triaging a corpus by full parse against probe_directory")
+    probe.add_argument("--files", type=int, default=500, help="number of files in the corpus")
+    probe.add_argument("--pages", type=int, default=20, help="pages per file")
+    probe.add_argument("--workers", type=int, default=8, help="threads for probe_directory")
+
+    linearize = commands.add_parser("linearize", help="time to first page of a plain and a linearized PDF over HTTP")
+    linearize.add_argument("--pages", type=int, default=200, help="pages in the generated document")
+    linearize.add_argument("--images", type=int, default=1, help="images per page")
+    linearize.add_argument("--bandwidth", type=float, default=2, help="server bandwidth in MiB/s")
+    linearize.add_argument("--latency", type=float, default=50, help="server round trip in ms")
+
+    incremental = commands.add_parser("incremental-save", help="add_watermark as a full rewrite against an incremental update")
+    incremental.add_argument("--pages", type=int, default=500, help="pages in the generated input document")
+    incremental.add_argument("--images", type=int, default=4, help="images per page")
+    args = parser.parse_args()
+    if args.command == "suite" and "merge" in args.operations and args.files < 2:
+        parser.error("--files must be at least 2 to benchmark merge")
+
+    if args.command == "watermark-cache":
+        results = bench_add_watermark(args.pages)
+        print(f"add_watermark, {args.pages} pages")
+        print(f"  before (overlay per page): {results['before']:.0f} pages/sec")
+        print(f"  after (cached overlay):    {results['after']:.0f} pages/sec")
+        print(f"  speedup: {results['after'] / results['before']:.2f}x")
+        return
+
+    if args.command == "watermark-scaling":
+        results = bench_watermark_scaling(args.pages, args.max_workers)
+        print(f"add_watermark, {args.pages} pages, {os.cpu_count()} CPUs")
+        for workers, result in results.items():
+            speedup = result["pages_per_sec"] / results[1]["pages_per_sec"]
+            print(f"  {workers:>3} workers: {result['pages_per_sec']:>8.0f} pages/sec  speedup {speedup:.2f}x"
+                  f"  parent CPU {result['parent_seconds']:.2f} s")
+        return
+
+    if args.command == "text-index":
+        results = bench_text_index(args.files, args.pages, args.workers)
+        print(f"text index, {args.files} files of {args.pages} pages")
+        print(f"  1 worker:         {results['serial']:>8.0f} pages/sec")
+        print(f"  {args.workers or os.cpu_count()} workers:        {results['parallel']:>8.0f} pages/sec")
+        print(f"  update, no changes: {results['unchanged'] * 1000:>6.1f} ms")
+        return
+
+    if args.command == "result-cache":
+        results = bench_result_cache(args.pages)
+        print(f"add_watermark, {args.pages} pages")
+        for mode in ("uncached", "miss", "hit"):
+            print(f"  {mode:<9} {results[mode] * 1000:>9.1f} ms")
+        return
+
+    if args.command == "stamp-pages":
+        results = bench_stamp_pages(args.pages, args.files, args.sample)
+        print(f"Bates numbering, {args.pages} pages in {args.files} files")
+        print(f"  before (overlay per page): {results['before']:>7.0f} pages/sec (first {args.sample} pages)")
+        print(f"  after (stamp_pages):       {results['after']:>7.0f} pages/sec")
+        print(f"  speedup: {results['after'] / results['before']:.2f}x")
+        if results["peak_rss"]:
+            print(f"  peak RSS: {results['peak_rss'] / 2**20:.0f} MiB")
+        return
+
+    if args.command == "startup":
+        results = bench_startup(args.runs)
+        print(f"cold start, median of {args.runs} runs")
+        print(f"  project.py split, 1 page: {results['split']:>7.1f} ms")
+        print(f"  import project:           {results['import_project']:>7.1f} ms (target {args.target:.0f} ms)")
+        print(f"  import pypdf alone:       {results['import_pypdf']:>7.1f} ms")
+        if results["import_project"] > args.target:
+            sys.exit(1)
+        return
+
+    if args.command == "probe":
+        results = bench_probe(args.files, args.pages, args.workers)
+        print(f"triage, {args.files} files of {args.pages} pages")
+        print(f"  full parse:            {results['full_parse']:>9.0f} files/sec")
+        print(f"  probe_directory:       {results['probe']:>9.0f} files/sec")
+        print(f"  probe_directory again: {results['probe_cached']:>9.0f} files/sec (cached)")
+        return
+
+    if args.command == "linearize":
+        results = bench_linearize(args.pages, args.images, args.bandwidth * 2**20, args.latency / 1000)
+        print(f"time to first page, {args.pages} pages at {args.bandwidth:g} MiB/s and {args.latency:g} ms round trip")
+        for mode in ("plain", "linearized"):
+            print(f"  {mode:<11} {results[mode]['seconds'] * 1000:>8.0f} ms  {results[mode]['bytes'] / 2**10:>8.0f} KiB fetched"
+                  f"  of {results[mode]['size'] / 2**10:.0f} KiB")
+        print(f"  speedup: {results['plain']['seconds'] / results['linearized']['seconds']:.2f}x")
+        return
+
+    if args.command == "incremental-save":
+        results = bench_incremental_save(args.pages, args.images)
+        print(f"add_watermark, {args.pages} pages, input {results['size'] / 2**20:.1f} MiB")
+        for mode, label in (("full", "full rewrite"), ("incremental", "incremental (copy)"), ("in_place", "incremental (in place)")):
+            print(f"  {label:<23} {results[mode]['bytes_written'] / 2**20:>8.2f} MiB written  {results[mode]['seconds']:>7.2f} s")
+        return
+
+    results = run_suite(args.files, args.pages, args.images, args.fonts, args.encrypted, args.repeat, args.operations)
+    with open(args.output, "w", encoding="utf-8") as out:
+        json.dump(results, out, indent=2)
+    for operation, result in results["operations"].items():
+        peak_rss = f"{result['peak_rss'] / 2**20:.1f} MiB" if result["peak_rss"] else "n/a"
+        print(f"{operation:<14} {result['pages_per_sec']:>9.1f} pages/sec  "
+              f"p50 {result['latency']['p50'] * 1000:>8.1f} ms  p95 {result['latency']['p95'] * 1000:>8.1f} ms  "
+              f"p99 {result['latency']['p99'] * 1000:>8.1f} ms  peak RSS {peak_rss}")
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
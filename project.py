@@ -1,194 +1,4480 @@
-from pypdf import PdfReader, PdfWriter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import array
+import contextvars
+import csv
+import functools
+import glob
+import hashlib
+import hmac
+import io
+import json
+import math
+import mmap
 import os
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import messagebox
-from tkinter import simpledialog
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+import re
+import secrets
+import shutil
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+import queue
 from io import BytesIO
 
+### Modules only some commands need (tkinter, reportlab, asyncio, sqlite3, process pools,
+### profilers) are imported where they are used, so that scripted calls on headless
+### machines start fast and don't need tkinter installed. See main and _import_tkinter.
+### pypdf (which loads its crypto backend and Pillow) is imported by the first PdfEdit,
+### so that `python project.py --help` and importing this module don't pay for it either.
+
+# tkinter modules used by PdfGui, bound by _import_tkinter
+tk = filedialog = messagebox = simpledialog = ttk = None
+
+# pypdf classes and version, bound by _import_pypdf
+PdfReader = PdfWriter = pypdf_version = UserAccessPermissions = None
+ArrayObject = ByteStringObject = DictionaryObject = FloatObject = IndirectObject = NameObject = NumberObject = StreamObject = None
+
+
+def _import_pypdf():
+    """
+    Imports pypdf, binding the classes used in this module (and its version) to the module
+    level names above. Called by everything that reads or writes a PDF before it does, and
+    does nothing once they're bound.
+    """
+    global PdfReader, PdfWriter, pypdf_version, UserAccessPermissions
+    global ArrayObject, ByteStringObject, DictionaryObject, FloatObject, IndirectObject, NameObject, NumberObject, StreamObject
+    if PdfWriter is not None:
+        return
+    from pypdf import PdfReader, PdfWriter
+    from pypdf import __version__ as pypdf_version
+    from pypdf.constants import UserAccessPermissions
+    from pypdf.generic import ArrayObject, ByteStringObject, DictionaryObject, FloatObject, IndirectObject, NameObject, NumberObject, StreamObject
+
+class OperationCancelled(Exception):
+    """
+    Raised by a PdfEdit operation that stopped early because its cancel event was set.
+    """
+
+
+# Name of the PdfEdit operation running in the current thread (or asyncio task), added to its phase events
+_current_operation = contextvars.ContextVar("current_operation", default=None)
+
+
+class _Phase:
+    """
+    Times one phase of a PdfEdit operation (parse, pages, encrypt, write...) and sends
+    it to the metrics sink as an event dict when the phase ends.
+    """
+    def __init__(self, metrics_sink, phase, file):
+        """
+        :param metrics_sink: Callable receiving the event dict.
+        :param phase: Name of the phase.
+        :param file: Path of the file the phase works on, if any.
+        """
+        self.metrics_sink = metrics_sink
+        self.event = {"operation": _current_operation.get(), "phase": phase, "file": _source_name(file)}
+
+    def update(self, **fields):
+        """
+        Adds fields to the event, e.g. pages=12.
+        """
+        self.event.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.event["duration"] = time.perf_counter() - self.start
+        file = self.event["file"]
+        if self.event["phase"] == "parse" and isinstance(file, str) and os.path.isfile(file):
+            self.event.setdefault("bytes_read", os.path.getsize(file))
+        if exc is not None:
+            self.event["error"] = f"{type(exc).__name__}: {exc}"
+        self.metrics_sink(self.event)
+        return False # Never swallow the exception
+
+
+class _NoPhase:
+    """
+    Stand-in for _Phase when no metrics sink is attached. Does nothing, so instrumented
+    code costs next to nothing when nobody is listening.
+    """
+    def update(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def _instrumented(method):
+    """
+    Decorator for public PdfEdit operations. When a metrics sink is attached, sends an
+    "operation" event covering the whole call (and its profile, if profiling is on),
+    and labels the phase events sent during the call with the operation's name.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics_sink is None:
+            return method(self, *args, **kwargs) # Nobody listening, don't measure anything
+        token = _current_operation.set(method.__name__)
+        try:
+            # The first argument is the input file (or list of input files for merge)
+            file = args[0] if args else None
+            with _Phase(self.metrics_sink, "operation", file) as phase:
+                if self.profile is None:
+                    return method(self, *args, **kwargs)
+                return self._profiled(method, args, kwargs, phase)
+        finally:
+            _current_operation.reset(token)
+    return wrapper
+
+
+def _result_cached(method):
+    """
+    Decorator for PdfEdit operations that write a single output. When the PdfEdit has a
+    ResultCache, a call repeating an earlier one (same input content, parameters and
+    settings) gets the earlier output from the cache instead of running, see PdfEdit._cached_call.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.result_cache is None:
+            return method(self, *args, **kwargs)
+        return self._cached_call(method, args, kwargs)
+    return wrapper
+
+
+def _is_path(source):
+    """
+    Tells whether a PdfEdit input or output is a file path, rather than bytes or a stream.
+    """
+    return isinstance(source, (str, os.PathLike))
+
+
+def _source_name(source):
+    """
+    Name of a PdfEdit input or output for error messages and metrics events: the path for
+    paths, the file name for open files, and a short description for bytes and other streams.
+    Lists (the inputs of merge) are named item by item.
+    """
+    if source is None or isinstance(source, str):
+        return source
+    if isinstance(source, os.PathLike):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<{memoryview(source).nbytes} bytes>"
+    if isinstance(source, (list, tuple)):
+        return [_source_name(item) for item in source]
+    name = getattr(source, "name", None)
+    return name if isinstance(name, str) else "<stream>"
+
+
+def _renamed_inputs(result, names):
+    """
+    Copy of an operation's report with every {"input": number, "file": name} entry in it
+    (e.g. merge's duplicates) renamed after the given inputs. The result cache keys reports
+    by the inputs' content, so a stored one may name other files with the same content.
+
+    :param result: The report, or any part of it.
+    :param names: Names of the current call's inputs, see _source_name.
+    :return: The renamed copy.
+    """
+    if isinstance(result, list):
+        return [_renamed_inputs(item, names) for item in result]
+    if not isinstance(result, dict):
+        return result
+    renamed = {key: _renamed_inputs(value, names) for key, value in result.items()}
+    number = renamed.get("input")
+    if "file" in renamed and isinstance(number, int) and 0 < number <= len(names):
+        renamed["file"] = names[number - 1]
+    return renamed
+
+
+def _source_size(source):
+    """
+    Size in bytes of a PdfEdit input, be it a path, bytes or a (seekable) stream.
+    """
+    if _is_path(source):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def _read_pdf(source):
+    """
+    Parses a PDF from a path, bytes, bytearray, memoryview or binary file-like object.
+
+    Paths are memory-mapped instead of read, so the file is paged in by the OS as pypdf
+    needs it and never copied into the Python heap. The mapping belongs to the reader
+    and is closed when the reader is garbage collected.
+
+    :param source: The PDF to parse.
+    :return: A PdfReader for the PDF.
+    """
+    _import_pypdf()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PdfReader(BytesIO(source))
+    if not _is_path(source):
+        return PdfReader(source) # Already a stream, pypdf reads it as it goes
+    with open(source, "rb") as pdf_file:
+        if os.fstat(pdf_file.fileno()).st_size == 0:
+            return PdfReader(source) # Empty files can't be mapped, let pypdf report them
+        # The mapping keeps its own handle on the file, so closing pdf_file here is fine
+        return PdfReader(mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _pdf_header(source):
+    """
+    Reads the version header a PDF starts with (e.g. "%PDF-1.7"), without parsing the rest.
+
+    :param source: The PDF, as a path, bytes, bytearray, memoryview or seekable binary stream.
+    :return: The header as a str, or None if it can't be read or isn't a PDF header
+             (reading the PDF itself reports why).
+    """
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            start = bytes(source[:8])
+        elif _is_path(source):
+            with open(source, "rb") as pdf_file:
+                start = pdf_file.read(8)
+        else:
+            position = source.tell()
+            source.seek(0)
+            start = source.read(8)
+            source.seek(position)
+    except (OSError, ValueError):
+        return None
+    return start.decode("latin-1") if re.fullmatch(rb"%PDF-\d\.\d", start) else None
+
+
+def _last_xref(source):
+    """
+    Finds the last xref section of a PDF from its "startxref" line, for an incremental update
+    written by hand to point back at (see PdfEdit._stamp_chunks).
+
+    :param source: The PDF, as a path or bytes.
+    :return: A tuple (offset of the section, whether it's a cross-reference stream), or None
+             if the offset doesn't point at an xref section (pypdf may still read such a file
+             by searching for its objects, but an update can't be chained to it).
+    """
+    if _is_path(source):
+        with open(source, "rb") as pdf_file:
+            size = pdf_file.seek(0, os.SEEK_END)
+            pdf_file.seek(max(0, size - 1024))
+            tail = pdf_file.read()
+            found = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", tail)
+            if found is None:
+                return None
+            offset = int(found.group(1))
+            pdf_file.seek(offset)
+            section = pdf_file.read(32)
+    else:
+        found = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", bytes(source[-1024:]))
+        if found is None:
+            return None
+        offset = int(found.group(1))
+        section = bytes(source[offset:offset + 32])
+    if section.startswith(b"xref"):
+        return offset, False
+    if re.match(rb"\d+\s+\d+\s+obj", section):
+        return offset, True
+    return None
+
+
+# Tokens of a PDF object, as far as _scan_dictionary needs to tell them apart
+_DICTIONARY_TOKENS = re.compile(rb"<<|>>|\[|\]|/[^\s/<>\[\]()%{}]*|\d+\s+\d+\s+R|[-+]?(?:\d+\.?\d*|\.\d+)|[A-Za-z]+|[()%{}<>]")
+
+
+def _scan_dictionary(data):
+    """
+    Reads the top level entries of the dictionary at the start of 'data', the raw bytes
+    of a PDF object, without parsing anything nested deeper than one array.
+
+    Values are kept as raw tokens (b"612", b"4 0 R", b"/Page"), arrays as lists of tokens
+    and nested dictionaries as None. Returns None if the object holds anything this doesn't
+    handle (strings, comments...) or doesn't end within 'data', so the caller can fall back
+    on pypdf.
+
+    :param data: Raw bytes starting at the object's dictionary, after "N 0 obj".
+    :return: A dict of key token -> value, or None.
+    """
+    end = data.find(b"endobj")
+    if end < 0:
+        return None
+    tokens = _DICTIONARY_TOKENS.findall(data, 0, end)
+    if not tokens or tokens[0] != b"<<":
+        return None
+    entries = {}
+    depth = 0
+    key = None
+    value = None
+    for token in tokens:
+        if token in (b"(", b")", b"%", b"{", b"}", b"<", b">"):
+            return None # A string or something else that could hide brackets
+        if token in (b"<<", b"["):
+            depth += 1
+            if depth == 2:
+                value = [] if token == b"[" else None # Start of a top level value
+            continue
+        if token in (b">>", b"]"):
+            depth -= 1
+            if depth == 0:
+                return entries
+            if depth == 1:
+                entries[key] = value
+                key = None
+            continue
+        if depth == 1:
+            if key is None:
+                key = token
+            else:
+                entries[key] = token
+                key = None
+        elif depth == 2 and value is not None:
+            value.append(token)
+    return None # Ran out of data before the dictionary ended
+
+
+class DocumentCache:
+    """
+    Keeps parsed PDFs (PdfReader objects) around, so that files used over and over, like
+    templates and cover pages, aren't parsed again on every PdfEdit call.
+
+    Entries are keyed by the file's absolute path and checked against its size and
+    modification time on every lookup, so a file changed on disk is parsed again.
+    The cache holds at most 'max_bytes' worth of files (by file size) and evicts the
+    least recently used ones first.
+
+    A reader is checked out while an operation uses it and checked back in afterwards,
+    so two threads never use the same reader at once (the second one gets a fresh parse).
+    Encrypted documents are never kept, so a decrypted reader can't be handed to a caller
+    who doesn't know the password.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        :param max_bytes: Most bytes of PDF files to keep parsed.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0 # Entries dropped because their file changed on disk
+        self.evictions = 0 # Entries dropped to stay under max_bytes
+        self._entries = OrderedDict() # path -> (size, mtime, PdfReader), least recently used first
+        self._checked_out = weakref.WeakKeyDictionary() # PdfReader -> (path, size, mtime)
+        self._lock = threading.Lock()
+
+    def check_out(self, file_path):
+        """
+        Returns a parsed PdfReader for the file, from the cache if it holds an up to date one.
+        Hand it back with check_in once done with it.
+
+        :param file_path: Path to the PDF file.
+        :return: A tuple (PdfReader, whether it came from the cache).
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                size, mtime, pdf_reader = entry
+                self.current_bytes -= size
+                if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+                    self.hits += 1
+                    self._checked_out[pdf_reader] = (path, size, mtime)
+                    return pdf_reader, True
+                self.invalidations += 1 # The file changed since it was parsed
+            self.misses += 1
+
+        pdf_reader = _read_pdf(path) # Parse outside the lock, so other lookups aren't held up
+        with self._lock:
+            self._checked_out[pdf_reader] = (path, stat.st_size, stat.st_mtime_ns)
+        return pdf_reader, False
+
+    def check_in(self, pdf_reader):
+        """
+        Hands a reader from check_out back to the cache, evicting old entries if it's now too big.
+
+        :param pdf_reader: The PdfReader returned by check_out.
+        """
+        with self._lock:
+            checked_out = self._checked_out.pop(pdf_reader, None)
+            if checked_out is None or pdf_reader.is_encrypted:
+                return
+            path, size, mtime = checked_out
+            if size > self.max_bytes or path in self._entries:
+                return # Too big to ever fit, or another thread already put a reader back
+            self._entries[path] = (size, mtime, pdf_reader)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted_size, _, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every cached reader.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        :return: A dict with hits, misses, hit_rate, invalidations, evictions, entries and bytes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+            }
+
+
+class PageIndex:
+    """
+    Remembers the page fingerprints of PDF files (see PdfEdit._page_fingerprint), so that
+    finding duplicate pages in a corpus that is merged over and over doesn't have to
+    fingerprint every page of every file again.
+
+    Entries are keyed by the file's absolute path and checked against its size and
+    modification time, like DocumentCache. The index can be saved to and loaded from JSON.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {} # path -> {"size": ..., "mtime": ..., "pages": [fingerprint, ...]}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Loads an index saved with save. A missing file gives an empty index.
+
+        :param index_path: Path to the JSON file.
+        :return: A PageIndex.
+        """
+        page_index = cls()
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as index_file:
+                page_index._entries = json.load(index_file)["files"]
+        return page_index
+
+    def save(self, index_path):
+        """
+        Saves the index as JSON. The file is written next to its final place and renamed
+        into place once complete, so a crash never leaves half an index behind.
+
+        :param index_path: Path to the JSON file.
+        """
+        with self._lock:
+            entries = dict(self._entries)
+        part_path = f"{index_path}.part"
+        with open(part_path, "w", encoding="utf-8") as index_file:
+            json.dump({"version": 1, "files": entries}, index_file)
+        os.replace(part_path, index_path)
+
+    def lookup(self, file_path):
+        """
+        :param file_path: Path to the PDF file.
+        :return: The file's page fingerprints, or None if it isn't indexed or changed since.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+                self.hits += 1
+                return entry["pages"]
+            self.misses += 1
+            return None
+
+    def store(self, file_path, fingerprints):
+        """
+        :param file_path: Path to the PDF file.
+        :param fingerprints: The fingerprints of its pages, in order.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            self._entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "pages": list(fingerprints)}
+
+
+class ResultCache:
+    """
+    Remembers the outputs of PdfEdit operations, so that running the same operation on the
+    same inputs with the same parameters again (e.g. re-running a nightly job after a partial
+    failure) copies the earlier output instead of parsing and writing anything.
+
+    Results are keyed by the SHA-256 of every input's content, the operation's name, its
+    parameters and the PdfEdit settings that change outputs (see key). Passwords only go
+    into the key as an HMAC under a secret kept in the cache directory, so neither they nor
+    a plain hash of them is ever stored. Input hashes are remembered by path, size and
+    modification time, so an unchanged input file isn't read again either.
+
+    The outputs are kept as files in the cache directory, at most 'max_bytes' worth of them;
+    the least recently used ones are evicted first. With link=True, outputs are hard linked
+    from the cache (falling back to a copy across file systems) instead of copied; the
+    cached files are then made read-only, since the output and the cache share one file.
+
+    The index is saved whenever an output is stored. Hits only move their entry up in
+    memory; call flush once done to keep that order (and any new input hashes) for the
+    next run. A cache directory is meant for one process at a time: there's no locking
+    between processes, so two sharing one would overwrite each other's index and evict
+    each other's outputs. Threads of one process can share a ResultCache.
+    """
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, link=False):
+        """
+        Opens the cache, creating the directory, its index and its secret if needed.
+
+        :param cache_dir: Directory holding the cached outputs and the index.
+        :param max_bytes: Most bytes of outputs to keep.
+        :param link: Whether to hard link cached outputs into place instead of copying them.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+
+        secret_path = os.path.join(cache_dir, "secret")
+        try:
+            # Only readable by its owner, and never overwritten once made
+            descriptor = os.open(secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, "w") as secret_file:
+                secret_file.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+        with open(secret_path, "r") as secret_file:
+            self._secret = bytes.fromhex(secret_file.read().strip())
+
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._entries = OrderedDict() # key -> {"size", "result"}, least recently used first
+        self._hashes = {} # path -> {"size", "mtime", "sha256"} of input files
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            self._entries.update(index["entries"])
+            self._hashes = index["hashes"]
+        self.current_bytes = sum(entry["size"] for entry in self._entries.values())
+        self._dirty = False # Whether the index changed since it was last saved
+
+    def stats(self):
+        """
+        :return: A dict with hits, misses, hit_rate, stores, evictions, entries and current_bytes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "stores": self.stores, "evictions": self.evictions, "entries": len(self._entries),
+                    "current_bytes": self.current_bytes}
+
+    def key(self, operation, inputs, params, settings=None):
+        """
+        Works out the cache key of an operation.
+
+        :param operation: Name of the PdfEdit operation.
+        :param inputs: List of inputs, as paths or bytes.
+        :param params: Dict of the operation's other parameters. Those whose name contains
+                       "password" are replaced by an HMAC of their value.
+        :param settings: Dict of PdfEdit settings that change outputs.
+        :return: A hex digest.
+        """
+        params = {name: self._password_hash(value) if "password" in name and value is not None else value
+                  for name, value in params.items()}
+        _import_pypdf()
+        payload = {"version": 1, "pypdf": pypdf_version, "operation": operation, "params": params,
+                   "settings": settings or {}, "inputs": [self._input_hash(source) for source in inputs]}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def lookup(self, key, output_path):
+        """
+        Puts a cached output in place, if there is one.
+
+        :param key: Cache key from key.
+        :param output_path: Path or writable binary stream for the output, None to get it back as bytes.
+        :return: None on a miss; on a hit a tuple (stored result, the output as bytes if
+                 output_path is None).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(self._object_path(key)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._dirty = True # Saved with the next store or flush, not on every hit
+        object_path = self._object_path(key)
+        data = None
+        if output_path is None or not _is_path(output_path):
+            with open(object_path, "rb") as cached:
+                data = cached.read()
+            if output_path is not None:
+                output_path.write(data)
+                data = None
+        elif self.link:
+            part_path = f"{output_path}.part"
+            try:
+                os.link(object_path, part_path)
+            except OSError:
+                shutil.copyfile(object_path, part_path) # Another file system, or links not supported
+            os.replace(part_path, output_path)
+        else:
+            part_path = f"{output_path}.part"
+            shutil.copyfile(object_path, part_path)
+            os.replace(part_path, output_path)
+        return entry["result"], data
+
+    def store(self, key, output, result=None):
+        """
+        Keeps an output in the cache, evicting the least recently used ones if needed.
+        Outputs larger than max_bytes aren't kept.
+
+        :param key: Cache key from key.
+        :param output: Path of the output file, or the output as bytes.
+        :param result: What the operation returned besides the output, if it's JSON serializable.
+        """
+        size = len(output) if isinstance(output, (bytes, bytearray)) else os.path.getsize(output)
+        if size > self.max_bytes:
+            return
+        object_path = self._object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        part_path = f"{object_path}.{threading.get_ident()}.part"
+        if isinstance(output, (bytes, bytearray)):
+            with open(part_path, "wb") as cached:
+                cached.write(output)
+        else:
+            shutil.copyfile(output, part_path)
+        if self.link:
+            os.chmod(part_path, 0o444)
+        os.replace(part_path, object_path)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous["size"]
+            self._entries[key] = {"size": size, "result": result}
+            self.current_bytes += size
+            self.stores += 1
+            while self.current_bytes > self.max_bytes:
+                evicted, entry = self._entries.popitem(last=False)
+                self.current_bytes -= entry["size"]
+                self.evictions += 1
+                if os.path.exists(self._object_path(evicted)):
+                    os.remove(self._object_path(evicted))
+            self._save()
+
+    def _object_path(self, key):
+        return os.path.join(self.cache_dir, "objects", key[:2], key + ".pdf")
+
+    def _password_hash(self, password):
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+        return hmac.new(self._secret, password, hashlib.sha256).hexdigest()
+
+    def _input_hash(self, source):
+        """
+        Helper function hashing an input's content, remembering the hashes of files by path,
+        size and modification time.
+
+        :param source: Path to the input file, or the input as bytes.
+        :return: A hex digest.
+        """
+        if not _is_path(source):
+            return hashlib.sha256(source).hexdigest()
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is not None and (known["size"], known["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+            return known["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._hashes[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+            self._dirty = True
+        return digest.hexdigest()
+
+    def flush(self):
+        """
+        Saves the index if hits or newly hashed inputs changed it since it was last saved.
+        """
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        """
+        Helper function saving the index, called with the lock held. The file is written
+        next to its final place and renamed into place once complete.
+        """
+        self._dirty = False
+        part_path = f"{self._index_path}.{threading.get_ident()}.part"
+        with open(part_path, "w", encoding="utf-8") as index_file:
+            json.dump({"version": 1, "entries": self._entries, "hashes": self._hashes}, index_file)
+        os.replace(part_path, self._index_path)
+
+
+class TextIndex:
+    """
+    A full text index of the pages of PDF files, kept in an SQLite database (FTS5), to find
+    which files and pages contain a phrase before choosing what to split out.
+
+    Files are kept by their absolute path. update only extracts the text of files that are
+    new or changed since they were last indexed: a file whose size and modification time
+    are unchanged is skipped without being opened, and one whose contents still hash the
+    same (e.g. it was only touched or copied back) just has its size and time refreshed.
+    """
+    # Pages of one file extracted by one task, so a long file is spread over every worker
+    CHUNK_PAGES = 32
+
+    def __init__(self, index_path, workers=1):
+        """
+        Opens the index, creating it if needed.
+
+        :param index_path: Path to the SQLite database file.
+        :param workers: Number of processes extracting text in update.
+        """
+        self.index_path = index_path
+        self.workers = workers
+        import sqlite3
+        self.connection = sqlite3.connect(index_path)
+        with self.connection: # Commits, or rolls back if anything fails
+            self.connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                    "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, sha256 TEXT, pages INTEGER)")
+            # Only the text is searched, path and page (1-indexed) say where a hit is
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(text, path UNINDEXED, page UNINDEXED)")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, file_paths):
+        """
+        Brings the index up to date with the given PDF files, and the PDF files found under
+        any directory given. The pages of new and changed files are extracted in chunks,
+        spread over the worker processes, and each file's pages are swapped in at once, as
+        soon as its last chunk is done, so memory doesn't grow with the size of the corpus.
+        Files that were indexed but no longer exist are dropped. A file that can't be read
+        is reported and its old pages are dropped, so they can't give stale hits.
+
+        :param file_paths: List of paths to PDF files or directories.
+        :return: A dict with files (seen), indexed, unchanged, removed, pages (extracted),
+                 errors (a list of file and error), wall_time in seconds and pages_per_sec.
+        """
+        start = time.perf_counter()
+        paths = set()
+        for file_path in file_paths:
+            if os.path.isdir(file_path):
+                paths.update(os.path.abspath(path) for path in glob.glob(os.path.join(file_path, "**", "*.pdf"), recursive=True))
+            else:
+                paths.add(os.path.abspath(file_path))
+        known = {path: (size, mtime, sha256)
+                 for path, size, mtime, sha256 in self.connection.execute("SELECT path, size, mtime, sha256 FROM files")}
+        report = {"files": len(paths), "indexed": 0, "unchanged": 0, "removed": 0, "pages": 0, "errors": []}
+
+        with self.connection:
+            for path in set(known) - paths:
+                if not os.path.exists(path):
+                    self._drop(path)
+                    report["removed"] += 1
+
+            # Work out which files need their text extracted, cheapest check first
+            changed = {} # path -> (size, mtime, sha256, pages)
+            for path in sorted(paths):
+                try:
+                    stat = os.stat(path)
+                    entry = known.get(path)
+                    if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                        report["unchanged"] += 1
+                        continue
+                    sha256 = self._file_hash(path)
+                    if entry is not None and entry[2] == sha256:
+                        self.connection.execute("UPDATE files SET size = ?, mtime = ? WHERE path = ?",
+                                                (stat.st_size, stat.st_mtime_ns, path))
+                        report["unchanged"] += 1
+                        continue
+                    # The page count comes from the page tree root, without parsing every page here
+                    probe = PdfEdit().probe(path, page_sizes=False)
+                    if probe["needs_password"]:
+                        raise IOError("The file is encrypted")
+                    changed[path] = (stat.st_size, stat.st_mtime_ns, sha256, probe["pages"])
+                except IOError as e:
+                    report["errors"].append({"file": path, "error": str(e)})
+                    self._drop(path)
+
+        tasks = [(path, first, min(first + self.CHUNK_PAGES, pages))
+                 for path, (_, _, _, pages) in changed.items() for first in range(0, max(pages, 1), self.CHUNK_PAGES)]
+        # Only one file's text is held at a time: it's written as soon as its last chunk is in
+        texts = []
+        error = None
+        for (path, _, stop), (page_texts, chunk_error) in self._extract(tasks):
+            texts.extend(page_texts)
+            error = error or chunk_error
+            size, mtime, sha256, pages = changed[path]
+            if stop < pages:
+                continue # More chunks of this file to come
+            with self.connection:
+                self._drop(path)
+                if error is not None:
+                    report["errors"].append({"file": path, "error": error})
+                else:
+                    self.connection.executemany("INSERT INTO pages (text, path, page) VALUES (?, ?, ?)",
+                                                ((text, path, page) for page, text in enumerate(texts, start=1)))
+                    self.connection.execute("INSERT INTO files (path, size, mtime, sha256, pages) VALUES (?, ?, ?, ?, ?)",
+                                            (path, size, mtime, sha256, pages))
+                    report["indexed"] += 1
+                    report["pages"] += pages
+            texts = []
+            error = None
+        report["wall_time"] = time.perf_counter() - start
+        report["pages_per_sec"] = report["pages"] / report["wall_time"] if report["wall_time"] > 0 else 0.0
+        return report
+
+    def _extract(self, tasks):
+        """
+        Helper function running _text_worker over the tasks, in the worker processes if there
+        are several, and yielding the results in task order. Only a few tasks per worker are
+        handed out ahead of the one being waited for, so finished text doesn't pile up.
+
+        :param tasks: List of _text_worker tasks.
+        :return: A generator of (task, (list of page texts, error message or None)).
+        """
+        if self.workers <= 1 or len(tasks) <= 1:
+            try:
+                for task in tasks:
+                    yield task, _text_worker(task)
+            finally:
+                _release_text_source() # Don't keep the last file open
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            waiting = [] # (task, future), oldest first
+            remaining = iter(tasks)
+            for task in remaining:
+                waiting.append((task, pool.submit(_text_worker, task)))
+                if len(waiting) >= self.workers * 4:
+                    break
+            while waiting:
+                task, future = waiting.pop(0)
+                for next_task in remaining:
+                    waiting.append((next_task, pool.submit(_text_worker, next_task)))
+                    break
+                yield task, future.result()
+
+    def search(self, phrase, raw=False):
+        """
+        Finds the pages containing a phrase. Matching follows SQLite's FTS5 tokenizer:
+        case-insensitive, whole words, punctuation ignored.
+
+        :param phrase: The words to look for, next to each other and in order.
+        :param raw: Whether the phrase is an FTS5 query of its own (e.g. "invoice AND paid",
+                    "budget*"), rather than a plain phrase.
+        :return: A list of (absolute file path, page) hits, pages starting at 1, sorted by file and page.
+        :raises ValueError: If a raw query is malformed.
+        """
+        import sqlite3
+        query = phrase if raw else '"' + phrase.replace('"', '""') + '"' # Quoted, so it's taken as one phrase
+        try:
+            rows = self.connection.execute("SELECT path, page FROM pages WHERE pages MATCH ? ORDER BY path, page",
+                                           (query,)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {e}")
+        return [(path, page) for path, page in rows]
+
+    def search_ranges(self, phrase, raw=False):
+        """
+        Finds the pages containing a phrase, grouped by file, ready to be passed to split.
+
+        :param phrase: The words to look for, see search.
+        :param raw: Whether the phrase is an FTS5 query of its own, see search.
+        :return: A dict mapping each matching file's absolute path to a PageRange of its hits.
+        """
+        pages = {}
+        for path, page in self.search(phrase, raw):
+            pages.setdefault(path, []).append(page - 1) # -1 to account for 0-indexing
+        return {path: PageRange.from_page_numbers(page_numbers) for path, page_numbers in pages.items()}
+
+    def _drop(self, path):
+        """
+        Helper function removing a file and its pages from the index.
+
+        :param path: Absolute path of the file.
+        """
+        self.connection.execute("DELETE FROM pages WHERE path = ?", (path,))
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _file_hash(self, path):
+        """
+        :param path: Path to the file.
+        :return: SHA-256 hex digest of its contents.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as pdf_file:
+            for block in iter(lambda: pdf_file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+class _AppendOnly:
+    """
+    Output stream for saving an incremental PdfWriter onto a file that already holds the
+    original document. pypdf writes the original bytes first and then the update; the
+    original bytes are dropped here (they are already in the file) and only the update
+    is appended, while tell() keeps counting from the start of the document so the
+    offsets in the new xref section come out right.
+    """
+    def __init__(self, out, original_size):
+        """
+        :param out: Binary file positioned at its end, which is original_size bytes long.
+        :param original_size: Size of the original document.
+        """
+        self.out = out
+        self.original_size = original_size
+        self.position = 0
+
+    def write(self, data):
+        skip = max(0, min(len(data), self.original_size - self.position)) # Bytes already in the file
+        if skip < len(data):
+            self.out.write(data[skip:])
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self.out.flush()
+
+
+class _ByteCounter:
+    """
+    Output stream that only counts what is written to it, used to size PDF objects.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.count
+
+
+def _object_bytes(pdf_writer, objects=None):
+    """
+    Size in bytes of every object a PdfWriter would write, before encryption and without
+    the header and xref table. Used to compare a document before and after a change.
+
+    :param pdf_writer: The PdfWriter.
+    :param objects: Only size these objects, None for all of the writer's objects.
+    """
+    counter = _ByteCounter()
+    for obj in pdf_writer._objects if objects is None else objects:
+        if obj is not None:
+            obj.write_to_stream(counter)
+    return counter.count
+
+
+class _StreamedPdf:
+    """
+    Writes a PdfWriter's objects out as its pages are added, instead of all at once when it's
+    done, so that a long document is never held in memory whole. Used by stamp_pages.
+
+    Once a page is added, every object new in the writer is written to the output and swapped
+    for its own reference, so pages added later can still point at what they share with it
+    (a font copied for the first page is only referenced by the others).
+    The catalog and the root of the page tree change with every page and are written last,
+    by finish. Links to a page that hasn't been added yet hold the writing back until it has,
+    then are pointed at it the way PdfWriter.write does.
+
+    This leans on how pypdf's PdfWriter keeps its objects, pages and links, so only adding
+    pages is supported in between: nothing written out can be changed afterwards. Those are
+    pypdf internals that any release may change, so callers check supported first and write
+    the whole document at once with any pypdf release this hasn't been checked against.
+    """
+    PYPDF_VERSIONS = ((6, 20),) # pypdf (major, minor) releases whose PdfWriter internals this was checked against
+    WRITER_INTERNALS = ("_objects", "_info", "_unresolved_links", "_merged_in_pages", "flattened_pages")
+
+    @classmethod
+    def supported(cls, pdf_writer):
+        """
+        Tells whether the installed pypdf is a release this was checked against, and its
+        PdfWriter still has the internals used here.
+
+        :param pdf_writer: The PdfWriter that would be streamed.
+        :return: True if pdf_writer can be streamed, False to write it the usual way.
+        """
+        version = tuple(int(part) for part in re.findall(r"\d+", pypdf_version)[:2])
+        return version in cls.PYPDF_VERSIONS and all(hasattr(pdf_writer, name) for name in cls.WRITER_INTERNALS)
+
+    def __init__(self, pdf_writer, out):
+        """
+        :param pdf_writer: An empty PdfWriter, apart from shared objects added up front, for which
+                           supported is True. Its pdf_header is written first, so it must be settled already.
+        :param out: Writable binary stream to write the PDF to.
+        """
+        self.pdf_writer = pdf_writer
+        self.out = out
+        self.offsets = array.array("q") # Offset of each object in the output by object number - 1, -1 if not written
+        self.written = 0 # Objects up to this number have been written out (or are kept for finish)
+        self.released = 0 # Objects up to this number have been let go of entirely, see file_done
+        self.dropped_pages = 0 # Pages of the writer's page list that have been let go of
+        self.pending_links = [] # (new link, old link) pairs whose target page isn't there yet
+        info = pdf_writer._info
+        self.info = None if info is None else info.indirect_reference
+        # Written by finish, once all the pages have been added
+        self.kept = {pdf_writer.root_object.indirect_reference.idnum, pdf_writer.root_object.raw_get("/Pages").idnum}
+        if self.info is not None:
+            self.kept.add(self.info.idnum)
+        # The file identifier is a hash of everything written, the way pypdf's is of the whole document
+        self.digest = hashlib.md5()
+        self._write(pdf_writer.pdf_header.encode() + b"\n%\xe2\xe3\xcf\xd3\n")
+
+    def page_added(self):
+        """
+        Writes out everything new since the last page, unless a link is waiting for its page.
+        """
+        pdf_writer = self.pdf_writer
+        self.pending_links.extend(pdf_writer._unresolved_links)
+        pdf_writer._unresolved_links.clear()
+        pending = []
+        for new_link, old_link in self.pending_links:
+            new_page = pdf_writer._merged_in_pages.get(old_link.find_referenced_page())
+            if new_page is None:
+                pending.append((new_link, old_link))
+            else:
+                new_link.patch_reference(pdf_writer, new_page)
+        self.pending_links = pending
+        if not pending:
+            self._write_objects()
+
+    def release_page(self, pdf_reader, index):
+        """
+        Lets go of an input's copy of a page once it has been added, and of everything the
+        reader parsed for it, or they'd pile up for as long as the input is open.
+
+        :param pdf_reader: The PdfReader of the input, not shared with anything else.
+        :param index: Index of the page in the input.
+        """
+        pdf_reader.flattened_pages[index] = None
+        pdf_reader.resolved_objects.clear()
+
+    def file_done(self):
+        """
+        Writes out everything left from an input once all its pages have been added and the
+        writer's translation of the input has been reset. Links still waiting point outside
+        the input's pages, and are left as they were copied.
+        """
+        self.pending_links = []
+        self.pdf_writer._merged_in_pages.clear()
+        self._write_objects()
+        # Once the writer has forgotten the input (see PdfWriter.reset_translation), nothing
+        # looks up what was copied from it any more, not even by reference
+        objects = self.pdf_writer._objects
+        for idnum in range(self.released + 1, self.written + 1):
+            if idnum not in self.kept:
+                objects[idnum - 1] = None
+        self.released = self.written
+
+    def finish(self):
+        """
+        Writes the catalog, the page tree root, the xref table and the trailer, with the
+        file identifier both of whose halves are the hash of everything before the xref.
+        """
+        self._write_objects()
+        objects = self.pdf_writer._objects
+        for idnum in sorted(self.kept):
+            self._write_object(idnum, objects[idnum - 1])
+        xref_location = self.out.tell()
+        file_id = ByteStringObject(self.digest.digest())
+        self.out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for idnum in range(1, len(objects) + 1):
+            offset = self.offsets[idnum - 1] if idnum <= len(self.offsets) else -1
+            self.out.write(f"{offset:010d} 00000 n \n".encode() if offset >= 0 else b"0000000000 65535 f \n")
+        trailer = DictionaryObject({NameObject("/Size"): NumberObject(len(objects) + 1),
+                                    NameObject("/Root"): self.pdf_writer.root_object.indirect_reference,
+                                    NameObject("/ID"): ArrayObject([file_id, file_id])})
+        if self.info is not None:
+            trailer[NameObject("/Info")] = self.info
+        self.out.write(b"trailer\n")
+        trailer.write_to_stream(self.out)
+        self.out.write(f"\nstartxref\n{xref_location}\n%%EOF\n".encode())
+
+    def _write_objects(self):
+        objects = self.pdf_writer._objects
+        for idnum in range(self.written + 1, len(objects) + 1):
+            obj = objects[idnum - 1]
+            if obj is None or idnum in self.kept:
+                continue
+            self._write_object(idnum, obj)
+            # All pypdf needs of an object it copied before is its indirect_reference, which
+            # for an IndirectObject is itself
+            objects[idnum - 1] = obj.indirect_reference
+        self.written = len(objects)
+        # The writer's own list of its pages would keep every page alive
+        pages = self.pdf_writer.flattened_pages
+        for index in range(self.dropped_pages, len(pages)):
+            pages[index] = None
+        self.dropped_pages = len(pages)
+
+    def _write_object(self, idnum, obj):
+        self.offsets.extend([-1] * (idnum - len(self.offsets)))
+        self.offsets[idnum - 1] = self.out.tell()
+        # Serialized on its own first, so it's hashed in one go rather than write by write
+        data = BytesIO()
+        obj.write_to_stream(data)
+        self._write(f"{idnum} 0 obj\n".encode() + data.getbuffer() + b"\nendobj\n")
+
+    def _write(self, data):
+        self.digest.update(data)
+        self.out.write(data)
+
+
 class PdfEdit:
     """
-    Handles PDF operations such as merging, splitting, watermarking, and encrypting/decrypting PDF files.
+    Handles PDF operations such as merging, splitting, watermarking, and encrypting/decrypting PDF files.
+
+    Besides file paths, inputs can be given as bytes, bytearray, memoryview or a binary
+    file-like object, and outputs as a writable binary stream, or None to get the resulting
+    PDF back as bytes. Path inputs are memory-mapped rather than read (see _read_pdf).
+    """
+    # Profiling modes accepted by __init__
+    PROFILE_MODES = ("cprofile", "tracemalloc")
+    # Most watermark overlays kept per instance, least recently used ones are dropped first
+    OVERLAY_CACHE_SIZE = 64
+
+    def __init__(self, metrics_sink=None, profile=None, progress_callback=None, cancel_event=None, document_cache=None,
+                 optimize_output=False, max_image_dpi=None, result_cache=None, linearize=False):
+        """
+        Initializes the PdfEdit class.
+
+        Keeps a cache of rendered watermark overlays, so that the same overlay is
+        only drawn and parsed once no matter how many pages it is stamped on.
+
+        If a metrics sink is given, every operation sends it event dicts as it goes: one per
+        phase ("parse", "pages", "encrypt", "decrypt", "write") and one for the whole
+        "operation". Each event has the operation, phase, file and duration (in seconds),
+        plus pages, bytes_read or bytes_written where they apply, and error if the phase failed.
+
+        :param metrics_sink: Callable receiving each event dict, e.g. a list's append method.
+        :param profile: "cprofile" or "tracemalloc" to add a profile of each operation
+                        to its "operation" event, None for no profiling.
+        :param progress_callback: Callable receiving (pages done, total pages) after each page,
+                                  total is None when it isn't known up front.
+        :param cancel_event: A threading.Event (or anything with is_set()); once set, the running
+                             operation stops at the next page with OperationCancelled and
+                             doesn't write its output.
+        :param document_cache: A DocumentCache to get parsed input files from, shared between
+                               PdfEdit objects as needed. None parses every input on every call.
+        :param optimize_output: Whether to run every output through the optimize stage (see
+                                _optimize) before it's written. Its report is sent to the
+                                metrics sink as an "optimize" phase event.
+        :param max_image_dpi: With optimize_output, downsample images shown above this resolution.
+        :param result_cache: A ResultCache that merge, split, add_watermark, stamp_pages, edit_metadata,
+                             encrypt_pdf, decrypt_pdf and optimize take repeated results from
+                             and store new ones in. None runs every call.
+        :param linearize: Whether to write every output linearized ("fast web view"), so a
+                          viewer fetching it over byte-range HTTP can show the first page
+                          before the rest has arrived. Needs pikepdf, see _write_document.
+        :raises ValueError: If the profile mode is unknown, or set without a metrics sink,
+                            or linearize is set without pikepdf installed.
+        """
+        if profile is not None and profile not in self.PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {profile}")
+        if profile is not None and metrics_sink is None:
+            raise ValueError("Profiling needs a metrics sink to send the profile to")
+        if linearize:
+            try:
+                import pikepdf # Only needed for linearized output, so pikepdf stays optional
+            except ImportError:
+                raise ValueError("Linearized output needs pikepdf, pip install pikepdf")
+        _import_pypdf()
+        self.metrics_sink = metrics_sink
+        self.profile = profile
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.document_cache = document_cache
+        self.optimize_output = optimize_output
+        self.max_image_dpi = max_image_dpi
+        self.result_cache = result_cache
+        self.linearize = linearize
+        # Maps (text, font, size, position, page box) -> overlay page, least recently used first, see _watermark_overlay
+        self._overlay_cache = OrderedDict()
+
+    def _phase(self, phase, file=None):
+        """
+        Helper function returning a context manager that times a phase of the current operation.
+
+        :param phase: Name of the phase, e.g. "parse" or "write".
+        :param file: Path of the file the phase works on, if any.
+        :return: A _Phase, or a do-nothing stand-in when no metrics sink is attached.
+        """
+        if self.metrics_sink is None:
+            return _NO_PHASE
+        return _Phase(self.metrics_sink, phase, file)
+
+    def _open_reader(self, file_path):
+        """
+        Helper function parsing an input PDF file, or getting it from the document cache.
+        Pass the reader to _release_reader once its pages have been copied.
+        Only path inputs go through the cache, bytes and streams are parsed every time.
+
+        :param file_path: Path to the PDF file, or the PDF as bytes or a stream.
+        :return: A PdfReader for the file.
+        """
+        with self._phase("parse", file_path) as phase:
+            if self.document_cache is None or not _is_path(file_path):
+                return _read_pdf(file_path)
+            pdf_reader, cache_hit = self.document_cache.check_out(file_path)
+            phase.update(cache_hit=cache_hit)
+            return pdf_reader
+
+    def _release_reader(self, pdf_reader):
+        """
+        Helper function handing a reader from _open_reader back to the document cache, if any.
+        Readers of operations that failed half way are simply not released.
+
+        :param pdf_reader: The PdfReader from _open_reader.
+        """
+        if self.document_cache is not None:
+            self.document_cache.check_in(pdf_reader)
+
+    # Parameters that don't change an operation's output, left out of result cache keys
+    UNCACHED_PARAMS = ("overwrite_confirm", "page_index", "workers")
+
+    def _cached_call(self, method, args, kwargs):
+        """
+        Helper function running an operation through the result cache: the output is taken
+        from the cache if the same call was made before, otherwise the operation runs and
+        its output is stored. Stream inputs are read into bytes first, so they can be hashed.
+
+        :param method: The (undecorated) PdfEdit method.
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :return: Whatever the method returns.
+        """
+        import inspect
+        call = inspect.signature(method).bind(self, *args, **kwargs)
+        call.apply_defaults()
+        arguments = call.arguments
+        inputs_name = "file_paths" if "file_paths" in arguments else "file_path"
+        inputs = arguments[inputs_name] if inputs_name == "file_paths" else [arguments[inputs_name]]
+        names = [_source_name(source) for source in inputs] # Before streams are read into bytes
+        inputs = [source if _is_path(source) or isinstance(source, bytes)
+                  else bytes(source) if isinstance(source, (bytearray, memoryview)) else source.read()
+                  for source in inputs]
+        arguments[inputs_name] = inputs if inputs_name == "file_paths" else inputs[0]
+        output_path = arguments["output_path"]
+        if "overwrite_confirm" in arguments:
+            # Asked here, so a cache hit asks too, and only once on a miss
+            if (_is_path(output_path) and os.path.exists(output_path)
+                    and not self._confirm_overwrite(output_path, arguments["overwrite_confirm"])):
+                raise FileExistsError(f"Merge cancelled: {output_path} already exists")
+            arguments["overwrite_confirm"] = True
+
+        params = {name: value.text if isinstance(value, PageRange) else value for name, value in arguments.items()
+                  if name not in ("self", inputs_name, "output_path") + self.UNCACHED_PARAMS}
+        settings = {"optimize_output": self.optimize_output, "max_image_dpi": self.max_image_dpi,
+                    "linearize": self.linearize}
+        key = self.result_cache.key(method.__name__, inputs, params, settings)
+        with self._phase("cache", output_path) as phase:
+            cached = self.result_cache.lookup(key, output_path)
+            phase.update(cache_hit=cached is not None)
+        if cached is not None:
+            result, data = cached
+            if result is None:
+                return data
+            result = _renamed_inputs(result, names)
+            return dict(result, output=data) if data is not None else dict(result)
+
+        # Streams get the output as bytes, so it can be kept before it's written to them
+        stream = output_path if output_path is not None and not _is_path(output_path) else None
+        if stream is not None:
+            arguments["output_path"] = None
+        returned = method(*call.args, **call.kwargs)
+        result = {name: value for name, value in returned.items() if name != "output"} if isinstance(returned, dict) else None
+        data = returned.get("output") if isinstance(returned, dict) else returned
+        try:
+            json.dumps(result)
+        except TypeError:
+            return returned # Can't be stored, so not cached
+        self.result_cache.store(key, output_path if _is_path(output_path) else data, result)
+        if stream is None:
+            return returned
+        stream.write(data)
+        return result
+
+    def _page_done(self, done, total):
+        """
+        Helper function called after each page: stops the operation if it was cancelled,
+        otherwise reports progress.
+
+        :param done: Number of pages done so far.
+        :param total: Total number of pages, or None if not known.
+        :raises OperationCancelled: If the cancel event is set.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise OperationCancelled("Operation cancelled")
+        if self.progress_callback is not None:
+            self.progress_callback(done, total)
+
+    def _profiled(self, method, args, kwargs, phase):
+        """
+        Helper function running an operation under the configured profiler and adding
+        the profile to the operation's event.
+
+        :param method: The (undecorated) PdfEdit method to run.
+        :param args: Positional arguments for the method.
+        :param kwargs: Keyword arguments for the method.
+        :param phase: The _Phase of the whole operation.
+        :return: Whatever the method returns.
+        """
+        if self.profile == "cprofile":
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(method, self, *args, **kwargs)
+            finally:
+                text = io.StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(25)
+                phase.update(profile=text.getvalue())
+
+        # tracemalloc: only start tracing if nobody else is, otherwise just reset their peak
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:25]
+            phase.update(peak_memory=peak_memory, profile="\n".join(str(stat) for stat in top))
+        
+    @_instrumented
+    @_result_cached
+    def merge(self, file_paths, output_path, overwrite_confirm, duplicates=None, page_index=None):
+        """
+        Merges multiple PDF files into a single PDF file.
+
+        This method combines the contents of multiple PDF files specified in 'file_paths'
+        into a single PDF file saved at 'output_path'. If the output file already exists,
+        it prompts the user for confirmation before overwriting, depending on the
+        'overwrite_confirm' parameter.
+
+        With 'duplicates' set, every page is fingerprinted by its content stream and resources
+        (see _page_fingerprint) and pages seen before, in the same file or an earlier one, are
+        either left out ("skip") or only reported ("report"). Give a PageIndex to reuse the
+        fingerprints of files that haven't changed since they were last indexed.
+
+        :param file_paths: A list of file paths (or bytes, or streams) for the PDFs to be merged.
+        :param output_path: The file path (or stream) where the merged PDF will be saved, None to return it.
+        :param overwrite_confirm: A callback function to confirm file overwrite.
+        :param duplicates: None to copy every page as it is, "skip" or "report" for duplicate pages.
+        :param page_index: A PageIndex to get and store page fingerprints (of path inputs) with.
+        :return: A dict with the pages written, pages_skipped and the list of duplicates (each
+                 a dict of input, file, page, and the input, file and page it duplicates,
+                 inputs and pages numbered from 1; both empty without 'duplicates'), plus
+                 "output" holding the merged
+                 PDF as bytes if output_path is None.
+        :raises ValueError: If less than two files are provided, or 'duplicates' is unknown.
+        :raises FileExistsError: If the output file exists and overwrite is not confirmed.
+        :raises IOError: For issues in reading source files or writing the output file.
+        """
+        if len(file_paths) < 2:
+            # Ensure atleast 2 files are provided
+            raise ValueError("Need at least two files to perform merging")
+        if duplicates not in (None, "skip", "report"):
+            raise ValueError(f"Unknown duplicates mode: {duplicates}")
+
+        if _is_path(output_path) and os.path.exists(output_path) and not self._confirm_overwrite(output_path, overwrite_confirm):
+            # Check if output file exists and confirm overwrite if necessary (and if No)
+            raise FileExistsError(f"Merge cancelled: {output_path} already exists")
+
+        pdf_readers = [] # Read every file first, so the total number of pages is known for progress
+        for file_path in file_paths: # Loop through each file chosen
+            try:
+                pdf_reader = self._open_reader(file_path) # Read each file to access contents like pages
+                pdf_readers.append((file_path, pdf_reader, len(pdf_reader.pages)))
+            except Exception as e:
+                # Raise an error if any of the files cannot be read
+                raise IOError(f"Failed to process {_source_name(file_path)}. Error: {e}")
+
+        pdf_writer = PdfWriter() # Used to create a new PDF file
+        total = sum(page_count for _, _, page_count in pdf_readers)
+        done = 0
+        report = {"pages": 0, "pages_skipped": 0, "duplicates": []}
+        seen = {} # Page fingerprint -> (input number, file, page number) where it first showed up
+        for input_number, (file_path, pdf_reader, page_count) in enumerate(pdf_readers, start=1):
+            try:
+                fingerprints = self._page_fingerprints(file_path, pdf_reader, page_index) if duplicates else None
+                with self._phase("pages", file_path) as phase:
+                    for page_num, page in enumerate(pdf_reader.pages):
+                        done += 1
+                        if duplicates:
+                            # The input's number tells apart the same file given twice
+                            location = (input_number, _source_name(file_path), page_num + 1)
+                            first = seen.setdefault(fingerprints[page_num], location)
+                            if first != location: # Seen before, this page is a duplicate
+                                report["duplicates"].append({"input": input_number, "file": location[1], "page": location[2],
+                                                             "duplicate_of": {"input": first[0], "file": first[1], "page": first[2]}})
+                                if duplicates == "skip":
+                                    report["pages_skipped"] += 1
+                                    self._page_done(done, total)
+                                    continue
+                        pdf_writer.add_page(page) # Add each page to the new PDF of this file
+                        report["pages"] += 1
+                        self._page_done(done, total)
+                    phase.update(pages=page_count)
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                raise IOError(f"Failed to process {_source_name(file_path)}. Error: {e}")
+        for _, pdf_reader, _ in pdf_readers:
+            self._release_reader(pdf_reader)
+
+        # Writing the merged content to an output file
+        merged = self._write_pdf(pdf_writer, output_path, "merged")
+        if merged is not None:
+            report["output"] = merged
+        return report
+
+    def _page_fingerprints(self, file_path, pdf_reader, page_index=None):
+        """
+        Helper function fingerprinting every page of a document, or getting the fingerprints
+        from the page index if the file hasn't changed since it was indexed.
+
+        :param file_path: Path to the PDF file (or the PDF as bytes or a stream, never indexed).
+        :param pdf_reader: PdfReader of the file.
+        :param page_index: A PageIndex, or None.
+        :return: The list of page fingerprints, in page order.
+        """
+        with self._phase("fingerprint", file_path) as phase:
+            indexed = _is_path(file_path) and page_index is not None
+            fingerprints = page_index.lookup(file_path) if indexed else None
+            phase.update(cache_hit=fingerprints is not None)
+            if fingerprints is None:
+                fingerprints = [self._page_fingerprint(page) for page in pdf_reader.pages]
+                if indexed:
+                    page_index.store(file_path, fingerprints)
+            return fingerprints
+
+    def _page_fingerprint(self, page):
+        """
+        Helper function hashing what a page looks like: its decoded content stream, the
+        fingerprints of its resources (fonts, images...), its page box and rotation.
+        Pages that look the same get the same fingerprint whichever file they come from,
+        however their streams happen to be compressed.
+
+        :param page: The PageObject to fingerprint.
+        :return: A hex digest.
+        """
+        digest = hashlib.sha256()
+        contents = page.get_contents()
+        digest.update(contents.get_data() if contents is not None else b"")
+        resources_digest, _ = self._fingerprint(page.get("/Resources"))
+        digest.update(resources_digest.encode())
+        page_box = [float(value) for value in page.mediabox]
+        digest.update(repr((page_box, page.rotation)).encode())
+        return digest.hexdigest()
+        
+    @_instrumented
+    def merge_streaming(self, file_paths, output_path, overwrite_confirm, memory_budget=64 * 1024 * 1024,
+                        max_open_files=2):
+        """
+        Merges multiple PDF files into a single PDF file, keeping memory bounded and
+        writing fonts, images and other XObjects shared between the inputs only once.
+
+        Unlike merge, only one input is open at any time, and its file is closed as soon as
+        its pages are copied. Path inputs are memory-mapped, so however large they are they're
+        never loaded whole into the Python heap. Each page is written to the output as soon as
+        it's copied (see _StreamedPdf), so memory doesn't grow with the number or size of the
+        inputs, only with the page count of the largest input (pypdf reads an input's whole
+        page tree when it's opened) and the largest page. Links to a later page of the same
+        input hold the writing back until that page is copied. With optimize_output or linearize
+        the whole document is kept in memory, and optimized or linearized when it's written.
+        So it is with a pypdf release streaming hasn't been checked against (see _StreamedPdf.supported).
+
+        Before a page is copied, its fonts and XObjects are fingerprinted by content. If an
+        identical one was already copied from an earlier input, the page is pointed at that
+        copy instead, so it's never written to the output twice. The fingerprints of the copies
+        are what the merge keeps from one input to the next, and they're held within
+        memory_budget: past it, those least recently reused are dropped first, and a resource
+        identical to a dropped one is copied again.
+
+        :param file_paths: A list of file paths (or bytes, or streams) for the PDFs to be merged.
+        :param output_path: The file path (or stream) where the merged PDF will be saved, None to return it.
+        :param overwrite_confirm: A callback function to confirm file overwrite.
+        :param memory_budget: Most bytes of fingerprints of copied resources to keep, None for no limit.
+        :param max_open_files: Most files the merge has open at once, the output included.
+        :return: A dict reporting files, pages, input_bytes, output_bytes, duplicates_removed,
+                 bytes_saved (stream bytes not written thanks to deduplication),
+                 fingerprints_dropped (fingerprints let go of to stay within memory_budget) and
+                 peak_memory (peak bytes allocated while merging, only measured with
+                 profile="tracemalloc" since tracing slows every allocation, None otherwise),
+                 plus "output" holding the merged PDF as bytes if output_path is None.
+        :raises ValueError: If less than two files are provided, or max_open_files is too low
+                            for an input and the output to be open together.
+        :raises FileExistsError: If the output file exists and overwrite is not confirmed.
+        :raises IOError: For issues in reading source files or writing the output file.
+        """
+        if len(file_paths) < 2:
+            raise ValueError("Need at least two files to perform merging")
+        # The output, and the mapping of the one path input being copied
+        needed = _is_path(output_path) + any(_is_path(file_path) for file_path in file_paths)
+        if max_open_files < needed:
+            raise ValueError(f"Merging needs {needed} open files at once, max_open_files is {max_open_files}")
+
+        if _is_path(output_path) and os.path.exists(output_path) and not self._confirm_overwrite(output_path, overwrite_confirm):
+            raise FileExistsError(f"Merge cancelled: {output_path} already exists")
+
+        report = {"files": len(file_paths), "pages": 0, "input_bytes": 0, "output_bytes": 0,
+                  "duplicates_removed": 0, "bytes_saved": 0, "fingerprints_dropped": 0, "peak_memory": None}
+        pdf_writer = PdfWriter()
+        # fingerprint -> reference to the copy already in pdf_writer, least recently reused first
+        copied = OrderedDict()
+        merge = lambda streamed: self._merge_files(pdf_writer, streamed, file_paths, copied, memory_budget, report)
+        if self.optimize_output or self.linearize or not _StreamedPdf.supported(pdf_writer):
+            # Optimizing and linearizing work on the whole document, and streaming leans on pypdf
+            # internals of the releases it was checked against, so otherwise that's kept in memory
+            merge(None)
+            merged = self._write_pdf(pdf_writer, output_path, "merged")
+        else:
+            # The header goes out before any page is added, so it's settled up front
+            headers = [header for header in map(_pdf_header, file_paths) if header is not None]
+            pdf_writer.pdf_header = max([pdf_writer.pdf_header] + headers)
+            merged = self._write_streamed(pdf_writer, output_path, "merged", merge)
+        if merged is not None:
+            report["output"] = merged
+            report["output_bytes"] = len(merged)
+        elif _is_path(output_path):
+            report["output_bytes"] = os.path.getsize(output_path)
+        else:
+            report["output_bytes"] = output_path.tell() # As far as the caller's stream has got
+        if self.profile == "tracemalloc":
+            # _profiled started tracing (or reset the peak) right before this call
+            report["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    # Rough heap bytes of one entry of merge_streaming's fingerprints of copied resources:
+    # the hex digest, the reference and the dict's own slot
+    FINGERPRINT_ENTRY_BYTES = 400
+
+    def _merge_files(self, pdf_writer, streamed, file_paths, copied, memory_budget, report):
+        """
+        Helper function adding the pages of every input of merge_streaming to the writer,
+        pointing their fonts and XObjects at identical copies from earlier inputs. When
+        streamed, each page is written out as soon as it's added, and the reader lets go of
+        everything it parsed for the page.
+
+        :param pdf_writer: The PdfWriter the pages go into.
+        :param streamed: The _StreamedPdf writing pdf_writer out as it goes, or None.
+        :param file_paths: The inputs, in order.
+        :param copied: OrderedDict of fingerprint -> reference of the copy in the writer.
+        :param memory_budget: Most bytes of copied to keep, None for no limit.
+        :param report: The merge_streaming report, counting pages and duplicates as they're found.
+        :raises IOError: For issues in reading a source file.
+        """
+        for file_path in file_paths:
+            try:
+                with self._phase("parse", file_path):
+                    pdf_reader = _read_pdf(file_path)
+                report["input_bytes"] += _source_size(file_path)
+                with self._phase("pages", file_path) as phase:
+                    fingerprints = {} # Fingerprints of this input's objects, by object number
+                    pages = len(pdf_reader.pages)
+                    for index, page in enumerate(pdf_reader.pages):
+                        self._reuse_copied_resources(page, copied, fingerprints, report)
+                        new_page = pdf_writer.add_page(page)
+                        self._remember_copied_resources(page, new_page, copied, fingerprints)
+                        if memory_budget is not None:
+                            while copied and len(copied) * self.FINGERPRINT_ENTRY_BYTES > memory_budget:
+                                copied.popitem(last=False)
+                                report["fingerprints_dropped"] += 1
+                        if streamed is not None:
+                            streamed.page_added()
+                            streamed.release_page(pdf_reader, index)
+                        report["pages"] += 1
+                        self._page_done(report["pages"], None) # Later files aren't open yet, total unknown
+                    phase.update(pages=pages)
+                # Drop the writer's link to this reader, so the reader (and its mapping) can be freed
+                pdf_writer.reset_translation(pdf_reader)
+                if streamed is not None:
+                    streamed.file_done()
+                if _is_path(file_path):
+                    # Closed now rather than whenever the reader is collected, so the files
+                    # open at once stay within max_open_files
+                    pdf_reader.stream.close()
+                del pdf_reader
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                raise IOError(f"Failed to process {_source_name(file_path)}. Error: {e}")
+
+    def _confirm_overwrite(self, output_path, overwrite_confirm):
+        """
+        Helper function to ask whether an existing output file may be overwritten.
+
+        :param output_path: The path of the file which might be overwritten.
+        :param overwrite_confirm: A callback function taking the path and returning True to
+                                  overwrite, or a plain True/False answer.
+        :return: True if the file may be overwritten, False otherwise.
+        """
+        if callable(overwrite_confirm):
+            return overwrite_confirm(output_path)
+        return bool(overwrite_confirm)
+
+    # Resource categories that are worth deduplicating across files
+    DEDUPLICATED_RESOURCES = ("/Font", "/XObject")
+
+    def _page_resources(self, page):
+        """
+        Helper function yielding (category, resource dict, name) for each shared font or XObject of a page.
+
+        :param page: PageObject whose resources to walk.
+        """
+        resources = page.get("/Resources")
+        if resources is None:
+            return
+        resources = resources.get_object()
+        # A writer's copy that _StreamedPdf has written out already leaves only its reference behind
+        if not isinstance(resources, DictionaryObject):
+            return
+        for category in self.DEDUPLICATED_RESOURCES:
+            entries = resources.get(category)
+            if entries is None:
+                continue
+            entries = entries.get_object()
+            if not isinstance(entries, DictionaryObject):
+                continue
+            for name in list(entries.keys()):
+                if isinstance(entries.raw_get(name), IndirectObject): # Only shared objects can be reused
+                    yield category, entries, name
+
+    def _reuse_copied_resources(self, page, copied, fingerprints, report):
+        """
+        Helper function pointing a source page's fonts and XObjects at identical copies
+        already in the writer, so the writer doesn't copy them again.
+
+        :param page: Source PageObject about to be copied.
+        :param copied: OrderedDict of fingerprint -> reference of the copy in the writer, least recently reused first.
+        :param fingerprints: Dict of object number -> (fingerprint, stream bytes) for this page's file.
+        :param report: Merge report, whose duplicates_removed and bytes_saved get updated.
+        """
+        for _, entries, name in self._page_resources(page):
+            reference = entries.raw_get(name)
+            if reference.pdf is not page.indirect_reference.pdf:
+                continue # Already points at the writer
+            first_seen = reference.idnum not in fingerprints
+            if first_seen:
+                fingerprints[reference.idnum] = self._fingerprint(reference)
+            fingerprint, size = fingerprints[reference.idnum]
+            if fingerprint in copied:
+                entries[NameObject(name)] = copied[fingerprint]
+                copied.move_to_end(fingerprint) # Recently reused, kept longest
+                if first_seen: # Count each duplicate object once, not once per page using it
+                    report["duplicates_removed"] += 1
+                    report["bytes_saved"] += size
+
+    def _remember_copied_resources(self, page, new_page, copied, fingerprints):
+        """
+        Helper function recording the writer copies of a page's fonts and XObjects,
+        so identical ones in later files can reuse them.
+
+        :param page: Source PageObject that was just copied.
+        :param new_page: The copy of the page in the writer.
+        :param copied: OrderedDict of fingerprint -> reference of the copy in the writer, least recently reused first.
+        :param fingerprints: Dict of object number -> (fingerprint, stream bytes) for this page's file.
+        """
+        new_resources = {}
+        for category, entries, name in self._page_resources(new_page):
+            new_resources[(category, name)] = entries.raw_get(name)
+        for category, entries, name in self._page_resources(page):
+            reference = entries.raw_get(name)
+            if reference.pdf is not page.indirect_reference.pdf:
+                continue # Was pointed at an earlier copy, nothing new to remember
+            if reference.idnum in fingerprints and (category, name) in new_resources:
+                copied.setdefault(fingerprints[reference.idnum][0], new_resources[(category, name)])
+
+    def _fingerprint(self, obj, visiting=None):
+        """
+        Helper function hashing a PDF object by content, following references to other objects.
+        Two objects from different files get the same fingerprint when they hold the same data.
+
+        :param obj: The PDF object (or reference to one) to fingerprint.
+        :param visiting: Objects already being fingerprinted, used to break reference cycles.
+        :return: A tuple (hex digest, total bytes of stream data inside the object).
+        """
+        if visiting is None:
+            visiting = set()
+        digest = hashlib.sha256()
+        size = 0
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key in visiting:
+                return "cycle", 0 # Same object further up, don't loop forever
+            visiting.add(key)
+            result = self._fingerprint(obj.get_object(), visiting)
+            visiting.discard(key)
+            return result
+        if isinstance(obj, DictionaryObject):
+            digest.update(b"<<")
+            for key in sorted(obj.keys()):
+                if key == "/Parent": # Points back up the tree, not part of the content
+                    continue
+                value_digest, value_size = self._fingerprint(obj.raw_get(key), visiting)
+                digest.update(key.encode("utf-8", "replace") + value_digest.encode())
+                size += value_size
+            if isinstance(obj, StreamObject):
+                # Hash the stored (still encoded) data, decoding big images would cost a lot of memory
+                digest.update(b"stream" + obj._data)
+                size += len(obj._data)
+        elif isinstance(obj, ArrayObject):
+            digest.update(b"[")
+            for item in obj:
+                item_digest, item_size = self._fingerprint(item, visiting)
+                digest.update(item_digest.encode())
+                size += item_size
+        else:
+            digest.update(type(obj).__name__.encode() + repr(obj).encode("utf-8", "replace"))
+        return digest.hexdigest(), size
+
+    @_instrumented
+    @_result_cached
+    def split(self, file_path, page_range, output_path):
+        """
+        Splits a PDF file based on the provided page range and saves it to a new file.
+
+        :param file_path: Path to the PDF file to split (or the PDF as bytes or a stream).
+        :param page_range: Page range to split (e.g., "1-3, 5, 7"), as a string or a PageRange.
+        :param output_path: Path (or stream) where the split PDF will be saved, None to return it.
+        :return: The split PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        :raises ValueError: If the page range is invalid or out of bounds.
+        """
+        pdf_reader = self._open_reader(file_path)
+        pdf_writer = PdfWriter()
+
+        # Logic to handle the page range written in helper function _split_pdf
+        with self._phase("pages", file_path) as phase:
+            self._split_pdf(pdf_reader, page_range, pdf_writer)
+            phase.update(pages=len(pdf_writer.pages))
+        self._release_reader(pdf_reader)
+
+        # Write the split PDF to file
+        return self._write_pdf(pdf_writer, output_path, "split")
+
+    def _split_pdf(self, pdf_reader, page_range, pdf_writer):
+        """
+        Helper function to handle the splitting based on the range given.
+
+        :param pdf_reader: PdfReader object of the PDF to split.
+        :param page_range: A PageRange, or a string specifying the page range, e.g., "1-3, 5, 7".
+        :param pdf_writer: PdfWriter object to add the split pages to.
+        :raises ValueError: If the page range is invalid or out of bounds.
+        """
+        page_numbers = self._page_numbers(page_range, len(pdf_reader.pages))
+        for done, page_num in enumerate(page_numbers, start=1):
+            pdf_writer.add_page(pdf_reader.pages[page_num])
+            self._page_done(done, len(page_numbers))
+
+    def _page_numbers(self, page_range, total_pages):
+        """
+        Helper function turning a page range into the 0-indexed page numbers it selects.
+
+        :param page_range: A PageRange, or a string specifying the page range, e.g., "1-3, 5, 7".
+        :param total_pages: Number of pages in the document, to check the range against.
+        :return: A list of 0-indexed page numbers, in the order given.
+        :raises ValueError: If the page range is invalid or out of bounds.
+        """
+        if not isinstance(page_range, PageRange):
+            page_range = PageRange(page_range)
+        return page_range.page_numbers(total_pages)
+
+    @_instrumented
+    def split_many(self, file_path, outputs=None, every=None, at_bookmarks=False, output_dir=None, workers=1):
+        """
+        Splits one PDF file into many outputs (a "burst"), reading the source only once.
+
+        The outputs are given by exactly one of:
+        - 'outputs', a list of (page range, output path) pairs,
+        - 'every', to cut the file into parts of that many pages,
+        - 'at_bookmarks', to start a new part at every top level bookmark.
+        With 'every' and 'at_bookmarks' the parts are saved in 'output_dir', named after the source.
+
+        Every range is parsed and checked before anything is written. With more than one
+        worker, the outputs are written in parallel by worker processes that each parse
+        the source once.
+
+        :param file_path: Path to the PDF file to split, or the PDF as bytes (or a stream, with one worker).
+        :param outputs: List of (page range, output path) pairs, page ranges as in split.
+        :param every: Number of pages per part.
+        :param at_bookmarks: Whether to split at the top level bookmarks.
+        :param output_dir: Directory for the parts made by 'every' or 'at_bookmarks'.
+        :param workers: Number of processes writing outputs.
+        :return: The list of output paths written, in order.
+        :raises IOError: If there's an issue reading the input file or writing an output file.
+        :raises ValueError: If the options are inconsistent, a page range is invalid or out of
+                            bounds, or two outputs share a path.
+        """
+        if sum([outputs is not None, every is not None, bool(at_bookmarks)]) != 1:
+            raise ValueError("Give exactly one of outputs, every or at_bookmarks")
+        if outputs is None and not output_dir:
+            raise ValueError("An output directory is needed to split by every or at_bookmarks")
+
+        pdf_reader = self._open_reader(file_path)
+        total_pages = len(pdf_reader.pages)
+        stem = os.path.splitext(os.path.basename(file_path))[0] if _is_path(file_path) else "split"
+        if every is not None:
+            if every < 1:
+                raise ValueError("Pages per part must be at least 1")
+            outputs = [(PageRange.from_page_numbers(range(start, min(start + every, total_pages))),
+                        os.path.join(output_dir, f"{stem}_{part:04d}.pdf"))
+                       for part, start in enumerate(range(0, total_pages, every), start=1)]
+        elif at_bookmarks:
+            outputs = self._bookmark_parts(pdf_reader, stem, output_dir)
+
+        # Parse and check every range up front, so a bad one fails before anything is written
+        parts = []
+        for page_range, output_path in outputs:
+            parts.append((self._page_numbers(page_range, total_pages), output_path))
+        output_paths = [os.path.abspath(output_path) for _, output_path in parts]
+        if len(set(output_paths)) != len(output_paths):
+            raise ValueError("Two outputs share the same path")
+        if _is_path(file_path) and os.path.abspath(file_path) in output_paths:
+            raise ValueError("An output would overwrite the file being split")
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        if workers > 1 and len(parts) > 1:
+            initargs = (file_path, self.optimize_output, self.max_image_dpi, self.linearize)
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_split_worker, initargs=initargs) as pool:
+                # list() so an error in any worker is raised here
+                list(pool.map(_split_worker, parts))
+        else:
+            total = sum(len(page_numbers) for page_numbers, _ in parts)
+            done = 0
+            for page_numbers, output_path in parts:
+                done = self._write_pages(pdf_reader, page_numbers, output_path, done, total)
+        self._release_reader(pdf_reader)
+        return [output_path for _, output_path in parts]
+
+    def _write_pages(self, pdf_reader, page_numbers, output_path, done=0, total=None):
+        """
+        Helper function writing the given pages of a source PDF to a new file.
+
+        :param pdf_reader: PdfReader object of the source PDF.
+        :param page_numbers: 0-indexed page numbers to write, in order.
+        :param output_path: Path where the PDF will be saved.
+        :param done: Pages already done by earlier outputs, for progress.
+        :param total: Total pages over all outputs, for progress.
+        :return: Pages done including this output.
+        :raises IOError: If the output file cannot be written.
+        """
+        pdf_writer = PdfWriter()
+        with self._phase("pages", output_path) as phase:
+            for page_num in page_numbers:
+                pdf_writer.add_page(pdf_reader.pages[page_num])
+                done += 1
+                self._page_done(done, total)
+            phase.update(pages=len(page_numbers))
+        self._write_pdf(pdf_writer, output_path, "split")
+        return done
+
+    def _bookmark_parts(self, pdf_reader, stem, output_dir):
+        """
+        Helper function working out the parts of a PDF that each start at a top level bookmark.
+        Pages before the first bookmark go into the first part.
+
+        :param pdf_reader: PdfReader object of the PDF to split.
+        :param stem: Name of the source file without its extension, used to name the parts.
+        :param output_dir: Directory where the parts will be saved.
+        :return: A list of (PageRange, output path) pairs.
+        :raises ValueError: If the PDF has no bookmarks.
+        """
+        starts = {}
+        for item in pdf_reader.outline:
+            if isinstance(item, list):
+                continue # A list holds the children of the previous bookmark
+            page_num = pdf_reader.get_destination_page_number(item)
+            if page_num is not None and page_num >= 0:
+                starts.setdefault(page_num, item.title)
+        if not starts:
+            raise ValueError("The PDF has no bookmarks to split at")
+
+        start_pages = sorted(starts)
+        titles = [starts[page_num] for page_num in start_pages]
+        start_pages[0] = 0
+        ends = start_pages[1:] + [len(pdf_reader.pages)]
+        parts = []
+        for part, (start, end, title) in enumerate(zip(start_pages, ends, titles), start=1):
+            # Keep the bookmark title readable in the file name, without characters file systems dislike
+            safe_title = "".join(char if char.isalnum() or char in " -_" else "_" for char in title).strip()
+            file_name = f"{stem}_{part:04d}_{safe_title}.pdf" if safe_title else f"{stem}_{part:04d}.pdf"
+            parts.append((PageRange.from_page_numbers(range(start, end)), os.path.join(output_dir, file_name)))
+        return parts
+
+    @_instrumented
+    @_result_cached
+    def add_watermark(self, file_path, watermark_text, output_path, font_name="Helvetica", font_size=12, position=(100, 100),
+                      incremental=False, workers=1):
+        """
+        Adds a text watermark to each page of a PDF file.
+        By default, the watermark is configured to be placed in the bottom left 
+        corner of each page and it's tiny. 
+
+        The overlay is sized from each page's own mediabox and only rendered once
+        per distinct page box, then reused on every page with the same box.
+
+        With incremental=True the original file is kept byte for byte and only the stamped
+        pages, the overlay objects and a new xref section are appended to it, see
+        _write_incremental. Pass the input path as output_path to append in place.
+
+        The output starts as a full copy of the document, so its outline, links, named
+        destinations and metadata are kept. With more than one worker, worker processes stamp
+        the pages in parallel, and the output is always the original with the stamped pages
+        appended as an incremental update (the original is never rewritten), see _stamp_chunks.
+        That needs a standard font and an unencrypted input; without them, or when a full
+        rewrite is to be optimized or linearized, the pages are stamped here as with one worker.
+
+        :param file_path: Path to the PDF file to be watermarked, or the PDF as bytes (or a stream, with one worker).
+        :param watermark_text: Text to use as the watermark.
+        :param output_path: Path (or stream) where the watermarked PDF will be saved, None to return it.
+        :param font_name: Name of the standard font used for the watermark text.
+        :param font_size: Font size of the watermark text.
+        :param position: (x, y) of the watermark, measured from the bottom left corner of the page.
+        :param incremental: Whether to save as an incremental update of the original file
+                            instead of rewriting the whole document.
+        :param workers: Number of processes stamping pages.
+        :return: The watermarked PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        """
+        pdf_reader = self._open_reader(file_path)
+        if workers > 1 and not pdf_reader.is_encrypted and (incremental or not (self.optimize_output or self.linearize)):
+            from reportlab.pdfbase.pdfmetrics import standardFonts
+            # The page count comes from the page tree's /Count, len(pages) would load every page
+            total = int(pdf_reader.trailer["/Root"]["/Pages"]["/Count"])
+            previous = _last_xref(file_path)
+            if font_name in standardFonts and total > 1 and previous is not None:
+                try:
+                    return self._stamp_chunks(pdf_reader, file_path, (watermark_text, font_name, font_size, position),
+                                              workers, output_path, total, previous)
+                finally:
+                    self._release_reader(pdf_reader)
+        with self._phase("pages", file_path) as phase:
+            total = len(pdf_reader.pages)
+            if incremental:
+                # The writer starts as a copy of the whole document and remembers what each
+                # object looked like, so only what the stamping changes gets written out
+                pdf_writer = PdfWriter(pdf_reader, incremental=True)
+            else:
+                # Stamping the writer's copies of the pages leaves the source pages untouched
+                pdf_writer = PdfWriter(clone_from=pdf_reader)
+            for done, page in enumerate(pdf_writer.pages, start=1): # Loop through each page in file
+                self._stamp_page(page, watermark_text, font_name, font_size, position)
+                self._page_done(done, total)
+            phase.update(pages=total)
+        self._release_reader(pdf_reader)
+
+        if incremental:
+            return self._write_incremental(pdf_writer, file_path, output_path, "watermarked")
+        else:
+            return self._write_pdf(pdf_writer, output_path, "watermarked")
+
+    @_instrumented
+    @_result_cached
+    def edit_metadata(self, file_path, metadata, output_path, incremental=False):
+        """
+        Sets document information entries such as the title or author of a PDF file.
+
+        :param file_path: Path to the PDF file to be edited (or the PDF as bytes or a stream).
+        :param metadata: Dict of entries to set, e.g. {"/Title": "Report", "/Author": "Me"}.
+        :param output_path: Path (or stream) where the edited PDF will be saved, None to return it.
+        :param incremental: Whether to save as an incremental update of the original file
+                            (only the information dictionary and a new xref section are
+                            appended) instead of rewriting the whole document.
+        :return: The edited PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        """
+        pdf_reader = self._open_reader(file_path)
+        if incremental:
+            pdf_writer = PdfWriter(pdf_reader, incremental=True)
+        else:
+            pdf_writer = PdfWriter(clone_from=pdf_reader)
+        self._release_reader(pdf_reader)
+        pdf_writer.add_metadata(metadata)
+
+        if incremental:
+            return self._write_incremental(pdf_writer, file_path, output_path, "edited")
+        else:
+            return self._write_pdf(pdf_writer, output_path, "edited")
+
+    def _stamp_page(self, page, watermark_text, font_name, font_size, position):
+        """
+        Helper function merging the (cached) watermark overlay onto a page already in a PdfWriter.
+
+        :param page: The writer's PageObject to stamp.
+        :param watermark_text: Text to use as the watermark.
+        :param font_name: Name of the standard font used for the watermark text.
+        :param font_size: Font size of the watermark text.
+        :param position: (x, y) of the watermark, measured from the bottom left corner of the page.
+        """
+        overlay = self._watermark_overlay(watermark_text, font_name, font_size, position, page.mediabox)
+        resources = page.get("/Resources")
+        if resources is not None and "/Font" in resources:
+            # The font dictionary is often one object shared by every page, and the merge adds the
+            # watermark font to it under a new name each time; growing a shared dictionary makes
+            # each page slower than the last, so give the page its own copy to merge into
+            resources = DictionaryObject(resources)
+            resources[NameObject("/Font")] = DictionaryObject(resources["/Font"])
+            page[NameObject("/Resources")] = resources
+        page.merge_page(overlay) # Merge watermark onto selected page
+
+    def _stamp_chunks(self, pdf_reader, file_path, stamp, workers, output_path, total, previous):
+        """
+        Helper function stamping every page of a PDF in worker processes, saved as an
+        incremental update of the original.
+
+        The work is shared out by the page tree, so no page is parsed here: the kids of its
+        root (or of the nodes a few levels down, for a deep tree) are cut into a few chunks
+        per worker. Each worker parses the source once and, for every chunk, rewrites the
+        dictionaries of the pages under its kids so they draw the watermark (see _stamp_kids),
+        and sends them back serialized. Here they're only appended to the output as they come
+        back, after a form XObject drawing the watermark that all the pages share, and are
+        followed by an xref section for them and a trailer pointing at the original's.
+        Everything else stays in the original as it was, outline, links and metadata included.
+
+        :param pdf_reader: PdfReader object of the source PDF, not encrypted.
+        :param file_path: Path to the PDF file being watermarked, or the PDF as bytes.
+        :param stamp: A tuple (watermark text, standard font name, font size, position), see _stamp_page.
+        :param workers: Number of worker processes.
+        :param output_path: Path (or stream) where the watermarked PDF will be saved, may be
+                            file_path to append in place, or None to return it.
+        :param total: Number of pages in the document.
+        :param previous: (offset, whether it's a stream) of the original's last xref section, see _last_xref.
+        :return: The watermarked PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue stamping a page or writing the output file.
+        :raises OperationCancelled: If the operation was cancelled.
+        """
+        watermark_text, font_name, font_size, position = stamp
+        trailer = pdf_reader.trailer
+        pages_ref = trailer["/Root"].raw_get("/Pages")
+        # The subtrees to share out, as (node number, generation, index in the node's /Kids),
+        # going a level down while there are fewer than a few per worker
+        kids = [(pages_ref.idnum, pages_ref.generation, index) for index in range(len(pages_ref.get_object()["/Kids"]))]
+        while len(kids) < workers * 4:
+            deeper = []
+            for idnum, generation, index in kids:
+                kid = IndirectObject(idnum, generation, pdf_reader).get_object()["/Kids"][index]
+                node = kid.get_object()
+                if "/Kids" in node:
+                    deeper.extend((kid.idnum, kid.generation, kid_index) for kid_index in range(len(node["/Kids"])))
+                else:
+                    deeper.append((idnum, generation, index))
+            if deeper == kids:
+                break # Nothing but pages left
+            kids = deeper
+        size = math.ceil(len(kids) / (workers * 4))
+        chunks = [kids[start:start + size] for start in range(0, len(kids), size)]
+
+        # The watermark is drawn by one form XObject with its own font, so it can't clash with
+        # the page's fonts, and a stream saving the graphics state goes before each page's content
+        form = StreamObject()
+        form.set_data(f"BT /WatermarkFont {font_size:g} Tf {position[0]:.2f} {position[1]:.2f} Td ".encode()
+                      + self._pdf_string(watermark_text) + b" Tj ET")
+        form.update({NameObject("/Type"): NameObject("/XObject"), NameObject("/Subtype"): NameObject("/Form"),
+                     NameObject("/BBox"): ArrayObject(FloatObject(value) for value in (-10000, -10000, 10000, 10000)),
+                     NameObject("/Resources"): DictionaryObject({
+                         NameObject("/Font"): DictionaryObject({NameObject("/WatermarkFont"): self._standard_font(font_name)})})})
+        save = StreamObject()
+        save.set_data(b"q\n")
+        first_number = int(trailer["/Size"])
+        shared = (first_number, first_number + 1) # Object numbers of the form and of the "q" stream
+
+        def write_update(out, origin):
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Next free object number, taken from by the workers for the objects they add
+            numbers = multiprocessing.Value("q", first_number + 2)
+            offsets = {} # Object number -> (generation, offset)
+            for number, obj in zip(shared, (form, save)):
+                offsets[number] = (0, out.tell() - origin)
+                out.write(f"{number} 0 obj\n".encode())
+                obj.write_to_stream(out)
+                out.write(b"\nendobj\n")
+            with self._phase("pages", file_path) as phase:
+                pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_watermark_worker,
+                                           initargs=(file_path, shared, numbers))
+                try:
+                    done = 0
+                    # Results come back in order, each chunk is written out as soon as it's there
+                    for data, objects, pages in pool.map(_watermark_worker, chunks):
+                        chunk_offset = out.tell() - origin
+                        out.write(data)
+                        for number, generation, offset in objects:
+                            offsets[number] = (generation, chunk_offset + offset)
+                        done += pages
+                        self._page_done(done, total)
+                finally:
+                    # Don't wait for the chunks still queued if this stopped early
+                    pool.shutdown(cancel_futures=True)
+                phase.update(pages=done)
+            self._write_update_xref(out, origin, offsets, max(numbers.value, int(trailer["/Size"])), trailer, previous)
+
+        return self._append_update(file_path, output_path, "watermarked", write_update)
+
+    def _stamp_kids(self, pdf_reader, kids, shared, draws, new_number):
+        """
+        Helper function for _stamp_chunks, run in a worker process: rewrites the dictionaries
+        of the pages under some kids of the page tree so that they draw the watermark form,
+        serialized for an incremental update.
+
+        Like _add_stamped_page, a page's own content isn't touched: its /Contents become the
+        shared "q" stream, its own content streams, then a small stream restoring the graphics
+        state and drawing the form where the page's origin is. The page gets its own resources
+        naming the form, inherited ones included, and everything else it has is kept as it is.
+
+        :param pdf_reader: PdfReader of the source PDF.
+        :param kids: List of (node number, generation, index in the node's /Kids), see _stamp_chunks.
+        :param shared: Object numbers of the form XObject and of the "q" stream.
+        :param draws: Dict of the drawing streams written so far, (origin, form name) -> object number, added to.
+        :param new_number: Callable returning an unused object number.
+        :return: A tuple (the objects serialized as bytes, list of (object number, generation, offset
+                 in the bytes) of each object, number of pages stamped).
+        """
+        form_number, save_number = shared
+        out = BytesIO()
+        objects = []
+
+        def write_object(number, generation, obj):
+            objects.append((number, generation, out.tell()))
+            out.write(f"{number} {generation} obj\n".encode())
+            obj.write_to_stream(out)
+            out.write(b"\nendobj\n")
+
+        def leaves(kid, inherited):
+            # The pages under a kid, in order, with the resources and media box they inherit
+            node = kid.get_object()
+            if "/Kids" not in node:
+                yield kid, node, inherited
+                return
+            inherited = dict(inherited)
+            for key in ("/Resources", "/MediaBox"):
+                if key in node:
+                    inherited[key] = node.raw_get(key)
+            for grandchild in node["/Kids"]:
+                yield from leaves(grandchild, inherited)
+
+        pages = 0
+        for idnum, generation, index in kids:
+            node = IndirectObject(idnum, generation, pdf_reader).get_object()
+            # What the node's kids inherit, from the node itself up to the root
+            inherited = {}
+            ancestor = node
+            while ancestor is not None:
+                for key in ("/Resources", "/MediaBox"):
+                    if key in ancestor and key not in inherited:
+                        inherited[key] = ancestor.raw_get(key)
+                ancestor = ancestor.get("/Parent")
+            for kid, page, page_inherited in leaves(node["/Kids"][index], inherited):
+                resources = page.raw_get("/Resources") if "/Resources" in page else page_inherited.get("/Resources")
+                resources = DictionaryObject() if resources is None else DictionaryObject(resources.get_object())
+                xobjects = resources.get("/XObject")
+                xobjects = DictionaryObject() if xobjects is None else DictionaryObject(xobjects.get_object())
+                # Pick a name the page doesn't already use for something else
+                form_name = "Watermark"
+                while f"/{form_name}" in xobjects:
+                    form_name += "_"
+                xobjects[NameObject(f"/{form_name}")] = IndirectObject(form_number, 0, pdf_reader)
+                resources[NameObject("/XObject")] = xobjects
+
+                box = page.raw_get("/MediaBox") if "/MediaBox" in page else page_inherited.get("/MediaBox")
+                box = [0, 0, 612, 792] if box is None else box.get_object()
+                origin = (min(float(box[0]), float(box[2])), min(float(box[1]), float(box[3])))
+                # Pages of a document mostly share their origin, so they share a drawing stream too
+                draw_number = draws.get((origin, form_name))
+                if draw_number is None:
+                    draw = StreamObject()
+                    draw.set_data("\nQ q 1 0 0 1 {:.2f} {:.2f} cm /{} Do Q\n".format(*origin, form_name).encode())
+                    draw_number = draws[(origin, form_name)] = new_number()
+                    write_object(draw_number, 0, draw)
+
+                contents = page.raw_get("/Contents") if "/Contents" in page else None
+                if contents is None:
+                    contents = ArrayObject()
+                elif isinstance(contents.get_object(), ArrayObject):
+                    contents = ArrayObject(contents.get_object())
+                else:
+                    contents = ArrayObject([contents])
+                contents.insert(0, IndirectObject(save_number, 0, pdf_reader))
+                contents.append(IndirectObject(draw_number, 0, pdf_reader))
+                stamped = DictionaryObject(page) # The page's own entries, references left as they are
+                stamped[NameObject("/Resources")] = resources
+                stamped[NameObject("/Contents")] = contents
+                write_object(kid.idnum, kid.generation, stamped)
+                pages += 1
+        return out.getvalue(), objects, pages
+
+    def _write_update_xref(self, out, origin, offsets, size, trailer, previous):
+        """
+        Helper function ending an incremental update written by hand: the xref section for
+        the objects in it, and a trailer linking it to the original's last section. The
+        section is a table, or a cross-reference stream if the original's last one is.
+
+        :param out: Binary stream the update is written to, positioned after its objects.
+        :param origin: Position in out where the document starts.
+        :param offsets: Dict of object number -> (generation, offset) of the objects in the update.
+        :param size: One more than the highest object number used, in the original or the update.
+        :param trailer: The original's trailer.
+        :param previous: (offset, whether it's a stream) of the original's last xref section.
+        """
+        previous_offset, previous_stream = previous
+        xref_offset = out.tell() - origin
+        if previous_stream:
+            # The stream is an object of the update too, listed in itself
+            offsets = dict(offsets)
+            offsets[size] = (0, xref_offset)
+            size += 1
+        numbers = sorted(offsets)
+        sections = [] # (first number, count) of each run of consecutive numbers
+        for number in numbers:
+            if sections and sections[-1][0] + sections[-1][1] == number:
+                sections[-1][1] += 1
+            else:
+                sections.append([number, 1])
+        # The second half of the file identifier changes with every update
+        digest = hashlib.md5(repr(sorted(offsets.items())).encode()).digest()
+        file_id = trailer.get("/ID")
+        first_id = file_id[0] if file_id is not None else ByteStringObject(digest)
+        entries = DictionaryObject({NameObject("/Size"): NumberObject(size), NameObject("/Root"): trailer.raw_get("/Root"),
+                                    NameObject("/ID"): ArrayObject([first_id, ByteStringObject(digest)]),
+                                    NameObject("/Prev"): NumberObject(previous_offset)})
+        if "/Info" in trailer:
+            entries[NameObject("/Info")] = trailer.raw_get("/Info")
+        if previous_stream:
+            width = max(4, (xref_offset.bit_length() + 7) // 8)
+            rows = b"".join(b"\x01" + offsets[number][1].to_bytes(width, "big") + offsets[number][0].to_bytes(2, "big")
+                            for number in numbers)
+            xref = StreamObject()
+            xref.set_data(rows)
+            xref.update(entries)
+            xref.update({NameObject("/Type"): NameObject("/XRef"),
+                         NameObject("/W"): ArrayObject(NumberObject(value) for value in (1, width, 2)),
+                         NameObject("/Index"): ArrayObject(NumberObject(value) for section in sections for value in section)})
+            out.write(f"{size - 1} 0 obj\n".encode())
+            xref.write_to_stream(out)
+            out.write(b"\nendobj\n")
+        else:
+            out.write(b"xref\n")
+            for first, count in sections:
+                out.write(f"{first} {count}\n".encode())
+                out.write("".join("{:010d} {:05d} n \n".format(offsets[number][1], offsets[number][0])
+                                  for number in range(first, first + count)).encode())
+            out.write(b"trailer\n")
+            entries.write_to_stream(out)
+            out.write(b"\n")
+        out.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+
+    def _watermark_overlay(self, watermark_text, font_name, font_size, position, mediabox):
+        """
+        Helper function returning the single page overlay holding the watermark text.
+
+        Overlays are cached by (text, font, size, position, page box), so a document
+        made of same sized pages renders and parses its overlay exactly once. Only the
+        OVERLAY_CACHE_SIZE most recently used are kept, so a long-lived PdfEdit (in the GUI,
+        a PdfWatcher or AsyncPdfEdit) doesn't grow with every distinct watermark it draws.
+
+        :param watermark_text: Text to use as the watermark.
+        :param font_name: Name of the standard font used for the watermark text.
+        :param font_size: Font size of the watermark text.
+        :param position: (x, y) of the watermark, measured from the bottom left corner of the page.
+        :param mediabox: Mediabox of the page the overlay will be merged onto.
+        :return: A PageObject with the watermark drawn on it.
+        """
+        page_box = (float(mediabox.left), float(mediabox.bottom), float(mediabox.right), float(mediabox.top))
+        key = (watermark_text, font_name, font_size, tuple(position), page_box)
+        overlay = self._overlay_cache.get(key)
+        if overlay is not None:
+            self._overlay_cache.move_to_end(key)
+        else:
+            left, bottom, right, top = page_box
+            from reportlab.pdfgen import canvas
+            packet = BytesIO() # Simulates a file in RAM, used for binary data
+            # Create a PDF canvas the same size as the page, so the overlay never crops or stretches it
+            can = canvas.Canvas(packet, pagesize=(right - left, top - bottom))
+            can.setFont(font_name, font_size)
+            # Position is relative to the page's own origin, which isn't always (0, 0)
+            can.drawString(left + position[0], bottom + position[1], watermark_text) # Drawing a string of text onto a PDF canvas
+            can.save() 
+            packet.seek(0) # Upon writing, need to move back to start of the buffer to read or save to an actual file
+            overlay = PdfReader(packet).pages[0]
+            self._overlay_cache[key] = overlay
+            while len(self._overlay_cache) > self.OVERLAY_CACHE_SIZE:
+                self._overlay_cache.popitem(last=False)
+        return overlay
+
+    # Where a variable stamp can be anchored on the page, see stamp_pages
+    STAMP_ANCHORS = ("bottom-left", "bottom-center", "bottom-right", "top-left", "top-center", "top-right")
+
+    @_instrumented
+    @_result_cached
+    def stamp_pages(self, file_paths, text, output_path, start=1, label=None, font_name="Helvetica", font_size=10,
+                    position=(36, 24), anchor="bottom-right"):
+        """
+        Stamps text that changes from page to page, such as Bates numbers or "Page X of Y",
+        on every page of one or more PDF files, saved as one PDF in the order given.
+
+        Unlike add_watermark, nothing is rendered or parsed per page. The parts every stamp
+        shares (the font, and the label if any) are written once as a form XObject that each
+        page draws with "Do", and each page only gets a small content stream of its own
+        holding its text. Only one input is open at a time, and each page is written to the
+        output as soon as it's stamped (see _StreamedPdf), so memory doesn't grow with the
+        number of pages stamped, only with the page count of the largest input (pypdf reads
+        an input's whole page tree when it's opened). With optimize_output or linearize the
+        whole document is kept in memory, and optimized or linearized when it's written. So it
+        is with a pypdf release streaming hasn't been checked against (see _StreamedPdf.supported).
+
+        The text is a str.format template with these fields:
+        number - the running number, starting at start and carrying on across the inputs,
+        page - the page number within its input, pages - the page count of its input,
+        total - the page count of all the inputs, file - the name of the input without extension.
+        E.g. "ABC{number:06d}" for Bates numbers, or "Page {page} of {pages}".
+        Stamping the inputs separately while keeping one numbering is done by passing each
+        call the "next" number of the call before as start.
+
+        :param file_paths: A list of file paths (or bytes, or streams) for the PDFs to be stamped.
+        :param text: Template of the text stamped on each page.
+        :param output_path: The file path (or stream) where the stamped PDF will be saved, None to return it.
+        :param start: Number stamped on the first page.
+        :param label: Fixed line of text drawn above the stamp on every page, e.g. "CONFIDENTIAL".
+        :param font_name: Name of the standard font used for the stamp.
+        :param font_size: Font size of the stamp.
+        :param position: (x, y) distance of the stamp from its anchor, as the page is displayed.
+        :param anchor: Corner (or middle of the top or bottom edge) of the page the stamp
+                       is placed from, one of STAMP_ANCHORS. Text is aligned towards it.
+        :return: A dict reporting files, pages, first and last (the numbers stamped on the first
+                 and last page) and next (the number to start from to carry on), plus "output"
+                 holding the stamped PDF as bytes if output_path is None.
+        :raises ValueError: If no files are given, or the template, font or anchor is invalid.
+        :raises IOError: For issues in reading source files or writing the output file.
+        """
+        if not file_paths:
+            raise ValueError("Need at least one file to stamp")
+        if anchor not in self.STAMP_ANCHORS:
+            raise ValueError(f"Unknown anchor: {anchor}")
+        from reportlab.pdfbase import pdfmetrics
+        try:
+            pdfmetrics.getFont(font_name)
+        except KeyError:
+            raise ValueError(f"Unknown font: {font_name}")
+        try:
+            text.format(number=start, page=1, pages=1, total=1, file="")
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"Invalid stamp text {text!r}: {e}")
+
+        total = None
+        if "{total" in text:
+            # Page counts come from the page tree's /Count, so this doesn't load any page
+            total = 0
+            for file_path in file_paths:
+                try:
+                    total += len(_read_pdf(file_path).pages)
+                except Exception as e:
+                    raise IOError(f"Failed to process {_source_name(file_path)}. Error: {e}")
+
+        report = {"files": len(file_paths), "pages": 0, "first": start, "last": None, "next": start}
+        pdf_writer = PdfWriter()
+        # The shared parts of the stamp, added to the writer once and referenced by every page
+        template = self._stamp_template(pdf_writer, label, font_name, font_size, anchor)
+        stamp = (text, total, template, position)
+        if self.optimize_output or self.linearize or not _StreamedPdf.supported(pdf_writer):
+            # Optimizing and linearizing work on the whole document, and streaming leans on pypdf
+            # internals of the releases it was checked against, so otherwise that's kept in memory
+            self._stamp_files(pdf_writer, None, file_paths, stamp, report)
+            stamped = self._write_pdf(pdf_writer, output_path, "stamped")
+        else:
+            # The header goes out before any page is added, so it's settled up front: the newest
+            # version of the inputs, as PdfWriter would pick it page by page
+            headers = [header for header in map(_pdf_header, file_paths) if header is not None]
+            pdf_writer.pdf_header = max([pdf_writer.pdf_header] + headers)
+            stamped = self._write_streamed(pdf_writer, output_path, "stamped",
+                                           lambda streamed: self._stamp_files(pdf_writer, streamed, file_paths, stamp, report))
+        if stamped is not None:
+            report["output"] = stamped
+        return report
+
+    def _stamp_files(self, pdf_writer, streamed, file_paths, stamp, report):
+        """
+        Helper function adding the pages of every input of stamp_pages to the writer, each
+        stamped with its own text. When streamed, each page is written out as soon as it's
+        added, and the reader lets go of everything it parsed for the page.
+
+        :param pdf_writer: The PdfWriter the stamped pages go into.
+        :param streamed: The _StreamedPdf writing pdf_writer out as it goes, or None.
+        :param file_paths: The inputs, in order.
+        :param stamp: (text template, total pages or None, dict from _stamp_template, position).
+        :param report: The stamp_pages report, counting the pages and numbers as they're stamped.
+        :raises IOError: For issues in reading a source file.
+        """
+        text, total, template, position = stamp
+        for file_path in file_paths:
+            try:
+                with self._phase("parse", file_path):
+                    pdf_reader = _read_pdf(file_path)
+                with self._phase("pages", file_path) as phase:
+                    pages = len(pdf_reader.pages)
+                    name = os.path.splitext(os.path.basename(_source_name(file_path)))[0] if _is_path(file_path) else ""
+                    for page_num, page in enumerate(pdf_reader.pages, start=1):
+                        stamp_text = text.format(number=report["next"], page=page_num, pages=pages, total=total, file=name)
+                        # The reader is ours alone (it isn't from the document cache), so its page can be changed
+                        self._add_stamped_page(pdf_writer, page, template, stamp_text, position)
+                        if streamed is not None:
+                            streamed.page_added()
+                            streamed.release_page(pdf_reader, page_num - 1)
+                        report["last"] = report["next"]
+                        report["next"] += 1
+                        report["pages"] += 1
+                        self._page_done(report["pages"], total)
+                    phase.update(pages=pages)
+                # Drop the writer's link to this reader, so the reader (and its mapping) can be freed
+                pdf_writer.reset_translation(pdf_reader)
+                del pdf_reader
+                if streamed is not None:
+                    streamed.file_done()
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                raise IOError(f"Failed to process {_source_name(file_path)}. Error: {e}")
+
+    def _write_streamed(self, pdf_writer, output_path, description, add_pages):
+        """
+        Helper function writing a PDF while its pages are being added, see _StreamedPdf.
+        Like _write_pdf, a path output is written to a ".part" file that only replaces the
+        output once complete, and streams are written to directly.
+
+        :param pdf_writer: The PdfWriter the pages go into, empty apart from shared objects.
+        :param output_path: Path or writable binary stream where the PDF will be saved,
+                            None to return it as bytes.
+        :param description: What kind of file this is, used in the error message (e.g. "stamped").
+        :param add_pages: Callable taking the _StreamedPdf, which adds the pages to pdf_writer
+                          and calls page_added and file_done as it goes.
+        :return: The PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If an input cannot be read or the output file cannot be written.
+        :raises OperationCancelled: If the operation was cancelled.
+        """
+        part_path = f"{output_path}.part" if _is_path(output_path) else None
+        out = BytesIO() if output_path is None else open(part_path, "wb") if part_path is not None else output_path
+        try:
+            start = out.tell()
+            streamed = _StreamedPdf(pdf_writer, out)
+            add_pages(streamed)
+            with self._phase("write", output_path) as phase:
+                try:
+                    streamed.finish()
+                except Exception as e:
+                    raise IOError(f"Failed to write {description} file. Error: {e}")
+                phase.update(bytes_written=out.tell() - start)
+        except BaseException:
+            if part_path is not None:
+                out.close()
+                os.remove(part_path)
+            raise
+        if part_path is None:
+            return out.getvalue() if output_path is None else None
+        out.close()
+        os.replace(part_path, output_path) # Swap the finished file in, in one step
+
+    def _stamp_template(self, pdf_writer, label, font_name, font_size, anchor):
+        """
+        Helper function adding the parts shared by every variable stamp to the writer: the
+        font, a form XObject drawing the label (empty if there's none) and a content stream
+        saving the graphics state before a page's own content.
+
+        :param pdf_writer: The PdfWriter the stamped pages go into.
+        :param label: Fixed line of text drawn above the stamp, or None.
+        :param font_name: Name of the standard font used for the stamp.
+        :param font_size: Font size of the stamp.
+        :param anchor: One of STAMP_ANCHORS.
+        :return: A dict with the references to the shared objects and what _stamp_variable
+                 needs to place the text.
+        """
+        from reportlab.pdfbase import pdfmetrics
+        font_ref = pdf_writer._add_object(self._standard_font(font_name))
+
+        # How far the text is moved left of the anchor, as a share of its width
+        align = {"left": 0, "center": 0.5, "right": 1}[anchor.split("-")[1]]
+        content = b""
+        if label:
+            width = pdfmetrics.stringWidth(label, font_name, font_size)
+            # The label sits one line above the stamp (below it, on the top edge, the stamp reads first)
+            line = font_size * 1.2 * (1 if anchor.startswith("bottom") else -1)
+            content = (f"BT /StampFont {font_size:g} Tf {-align * width:.2f} {line:.2f} Td ".encode()
+                       + self._pdf_string(label) + b" Tj ET")
+        form = StreamObject()
+        form.set_data(content)
+        form.update({NameObject("/Type"): NameObject("/XObject"), NameObject("/Subtype"): NameObject("/Form"),
+                     NameObject("/BBox"): ArrayObject(FloatObject(value) for value in (-10000, -10000, 10000, 10000)),
+                     NameObject("/Resources"): DictionaryObject({
+                         NameObject("/Font"): DictionaryObject({NameObject("/StampFont"): font_ref})})})
+        # The page's own content might leave the graphics state changed, so it's wrapped in q ... Q
+        save = StreamObject()
+        save.set_data(b"q\n")
+        return {"font": font_ref, "form": pdf_writer._add_object(form), "save": pdf_writer._add_object(save),
+                "font_name": font_name, "font_size": font_size, "anchor": anchor, "align": align}
+
+    def _add_stamped_page(self, pdf_writer, page, template, stamp_text, position):
+        """
+        Helper function adding a page to the writer, stamped with its own text drawn next
+        to the shared form XObject from _stamp_template.
+
+        The page gets its own copy of its resources (often one object shared by all pages)
+        naming the shared font and form, and its content becomes the shared "q" stream, its
+        own content, then a small stream restoring the graphics state and drawing the stamp.
+        The resources are set on the reader's page before it's copied, so the writer never
+        has to look up objects it copied for earlier pages (they may be written out already).
+
+        :param pdf_writer: The PdfWriter the page is added to.
+        :param page: The reader's PageObject to stamp, which is changed.
+        :param template: The dict returned by _stamp_template.
+        :param stamp_text: Text to stamp on this page.
+        :param position: (x, y) distance of the stamp from its anchor, as the page is displayed.
+        :return: The writer's copy of the page.
+        """
+        from reportlab.pdfbase import pdfmetrics
+        box = page.cropbox
+        left, bottom, right, top = float(box.left), float(box.bottom), float(box.right), float(box.top)
+        rotation = page.rotation % 360
+        # Matrix turning the page's space so that the stamp is upright as the page is displayed,
+        # with (0, 0) at the displayed bottom left corner
+        if rotation == 90:
+            matrix, width, height = (0, 1, -1, 0, right, bottom), top - bottom, right - left
+        elif rotation == 180:
+            matrix, width, height = (-1, 0, 0, -1, right, top), right - left, top - bottom
+        elif rotation == 270:
+            matrix, width, height = (0, -1, 1, 0, left, top), top - bottom, right - left
+        else:
+            matrix, width, height = (1, 0, 0, 1, left, bottom), right - left, top - bottom
+        vertical, horizontal = template["anchor"].split("-")
+        x = {"left": position[0], "center": width / 2 + position[0], "right": width - position[0]}[horizontal]
+        y = position[1] if vertical == "bottom" else height - position[1] - template["font_size"]
+        text_width = pdfmetrics.stringWidth(stamp_text, template["font_name"], template["font_size"])
+
+        resources = page.get("/Resources")
+        resources = DictionaryObject() if resources is None else DictionaryObject(resources.get_object())
+        fonts = resources.get("/Font")
+        fonts = DictionaryObject() if fonts is None else DictionaryObject(fonts.get_object())
+        xobjects = resources.get("/XObject")
+        xobjects = DictionaryObject() if xobjects is None else DictionaryObject(xobjects.get_object())
+        # Pick names the page doesn't already use for something else
+        font_name = form_name = "Stamp"
+        while fonts.get(f"/{font_name}") not in (None, template["font"]):
+            font_name += "_"
+        while xobjects.get(f"/{form_name}") not in (None, template["form"]):
+            form_name += "_"
+        fonts[NameObject(f"/{font_name}")] = template["font"]
+        xobjects[NameObject(f"/{form_name}")] = template["form"]
+        resources[NameObject("/Font")] = fonts
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+        new_page = pdf_writer.add_page(page)
+
+        stamp = StreamObject()
+        stamp.set_data("\nQ q {} {} {} {} {:.2f} {:.2f} cm 1 0 0 1 {:.2f} {:.2f} cm /{} Do BT /{} {:g} Tf {:.2f} 0 Td ".format(
+            *matrix, x, y, form_name, font_name, template["font_size"], -template["align"] * text_width).encode()
+            + self._pdf_string(stamp_text) + b" Tj ET Q\n")
+        # The content is changed on the writer's copy: pypdf copies every stream listed in a
+        # content array, so the shared "q" stream would be copied for every page otherwise
+        contents = new_page.raw_get("/Contents") if "/Contents" in new_page else None
+        if contents is None:
+            contents = ArrayObject()
+        elif isinstance(contents.get_object(), ArrayObject):
+            contents = ArrayObject(contents.get_object())
+        else:
+            contents = ArrayObject([contents]) # Copied streams are always referenced
+        contents.insert(0, template["save"])
+        contents.append(pdf_writer._add_object(stamp))
+        new_page[NameObject("/Contents")] = contents
+        return new_page
+
+    def _pdf_string(self, text):
+        """
+        Helper function writing text as a PDF literal string in the stamp fonts' encoding.
+        Characters the encoding doesn't have are replaced by "?".
+
+        :param text: The text.
+        :return: The string as bytes, brackets included.
+        """
+        data = text.encode("cp1252", errors="replace")
+        return b"(" + re.sub(rb"([\\()])", rb"\\\1", data) + b")"
+
+    def _standard_font(self, font_name):
+        """
+        Helper function making the font dictionary of one of the standard fonts, which every
+        viewer has, so nothing is embedded. Text drawn with it is encoded by _pdf_string.
+
+        :param font_name: Name of the standard font, e.g. "Helvetica".
+        :return: The font as a DictionaryObject.
+        """
+        font = DictionaryObject({NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+                                 NameObject("/BaseFont"): NameObject(f"/{font_name}")})
+        if font_name not in ("Symbol", "ZapfDingbats"): # The symbolic fonts have their own built in encoding
+            font[NameObject("/Encoding")] = NameObject("/WinAnsiEncoding")
+        return font
+
+    @_instrumented
+    @_result_cached
+    def encrypt_pdf(self, file_path, password, output_path):
+        """
+        Encrypts a PDF file with user given password.
+
+        :param file_path: Path to the PDF file to be encrypted (or the PDF as bytes or a stream).
+        :param password: Password for encrypting the PDF.
+        :param output_path: Path (or stream) where the encrypted PDF will be saved, None to return it.
+        :return: The encrypted PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        """
+        pdf_reader = self._open_reader(file_path)
+        pdf_writer = PdfWriter()
+
+        with self._phase("pages", file_path) as phase:
+            total = len(pdf_reader.pages)
+            for done, page in enumerate(pdf_reader.pages, start=1):
+                pdf_writer.add_page(page)
+                self._page_done(done, total)
+            phase.update(pages=total)
+        self._release_reader(pdf_reader)
+
+        # The key is set up here, the objects themselves are encrypted as they are written
+        with self._phase("encrypt", file_path):
+            pdf_writer.encrypt(password) 
+
+        return self._write_pdf(pdf_writer, output_path, "encrypted", password=password)
+
+    @_instrumented
+    @_result_cached
+    def decrypt_pdf(self, file_path, password, output_path):
+        """
+        Decrypts a PDF file with the given password.
+
+        :param file_path: Path to the encrypted PDF file (or the PDF as bytes or a stream).
+        :param password: Password for decrypting the PDF.
+        :param output_path: Path (or stream) where the decrypted PDF will be saved, None to return it.
+        :return: The decrypted PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        """
+        pdf_reader = self._open_reader(file_path)
+        with self._phase("decrypt", file_path):
+            pdf_reader.decrypt(password)
+        pdf_writer = PdfWriter()
+
+        with self._phase("pages", file_path) as phase:
+            total = len(pdf_reader.pages)
+            for done, page in enumerate(pdf_reader.pages, start=1):
+                pdf_writer.add_page(page)
+                self._page_done(done, total)
+            phase.update(pages=total)
+        self._release_reader(pdf_reader) # Encrypted files are never kept by the cache
+
+        return self._write_pdf(pdf_writer, output_path, "decrypted")
+
+    # Algorithms accepted by encrypt_many
+    ENCRYPTION_ALGORITHMS = ("AES-128", "AES-256")
+    # What a recipient of encrypt_many can be allowed to do
+    PERMISSIONS = ("print", "modify", "extract", "add_or_modify", "fill_form_fields",
+                   "extract_text_and_graphics", "assemble_doc", "print_to_representation")
+
+    @_instrumented
+    def encrypt_many(self, file_path, recipients, algorithm="AES-256", owner_password=None, workers=1):
+        """
+        Encrypts one PDF file for many recipients, each with their own password and permissions,
+        reading the source and copying its pages only once.
+
+        The pages are copied into a single PdfWriter, which is then encrypted and written once
+        per recipient. Objects are only encrypted as they are written, so nothing is parsed or
+        copied again between recipients. With more than one worker, the variants are written in
+        parallel by worker processes that each parse the source and copy its pages once.
+
+        Every recipient is checked before anything is written. A variant that fails to write is
+        reported and doesn't stop the others; passwords are never part of the report.
+
+        :param file_path: Path to the PDF file to encrypt, or the PDF as bytes (or a stream, with one worker).
+        :param recipients: List of dicts with "recipient" (a name for the report), "password",
+                           "output" (path) and optionally "permissions", a list of the PERMISSIONS
+                           the recipient gets (all of them if left out). See read_recipients.
+        :param algorithm: "AES-128" or "AES-256".
+        :param owner_password: Password lifting the permissions, the same for every variant.
+                               None makes a random one per variant, so nobody can lift them.
+        :param workers: Number of processes writing variants.
+        :return: A dict with the number of recipients, succeeded and failed counts, the list of
+                 failures (recipient, output and error), bytes_written, wall_time in seconds,
+                 documents_per_sec and the per-recipient results.
+        :raises IOError: If there's an issue reading the input file.
+        :raises ValueError: If the algorithm or a permission is unknown, a recipient has no
+                            password or output, or two recipients share an output path.
+        """
+        if algorithm not in self.ENCRYPTION_ALGORITHMS:
+            raise ValueError(f"Unknown encryption algorithm: {algorithm}")
+        variants = [] # (recipient, password, permissions flag, output path)
+        for recipient in recipients:
+            if not recipient.get("password") or not recipient.get("output"):
+                raise ValueError(f"Recipient {recipient.get('recipient')} needs a password and an output")
+            variants.append((recipient.get("recipient"), recipient["password"],
+                             self._permissions_flag(recipient.get("permissions")), recipient["output"]))
+        output_paths = [os.path.abspath(output_path) for _, _, _, output_path in variants]
+        if len(set(output_paths)) != len(output_paths):
+            raise ValueError("Two recipients share the same output path")
+        if _is_path(file_path) and os.path.abspath(file_path) in output_paths:
+            raise ValueError("An output would overwrite the file being encrypted")
+        for output_dir in set(os.path.dirname(output_path) for output_path in output_paths):
+            os.makedirs(output_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        if workers > 1 and len(variants) > 1:
+            initargs = (file_path, self.optimize_output, self.max_image_dpi, self.linearize)
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_encrypt_worker, initargs=initargs) as pool:
+                results = list(pool.map(_encrypt_worker, [(variant, algorithm, owner_password) for variant in variants]))
+        else:
+            pdf_writer = self._encryption_source(file_path)
+            results = []
+            for done, variant in enumerate(variants, start=1):
+                results.append(self._encrypt_variant(pdf_writer, variant, algorithm, owner_password))
+                self._page_done(done, len(variants)) # Progress counts variants rather than pages here
+        wall_time = time.perf_counter() - start
+
+        failures = [{"recipient": result["recipient"], "output": result["output"], "error": result["error"]}
+                    for result in results if not result["ok"]]
+        return {
+            "recipients": len(results),
+            "succeeded": len(results) - len(failures),
+            "failed": len(failures),
+            "failures": failures,
+            "bytes_written": sum(result["bytes"] for result in results),
+            "wall_time": wall_time,
+            "documents_per_sec": len(results) / wall_time if wall_time > 0 else 0.0,
+            "results": results,
+        }
+
+    def read_recipients(self, manifest_path):
+        """
+        Reads the recipients for encrypt_many from a manifest: either a CSV file with
+        recipient, password, permissions and output columns (permissions separated by
+        spaces or "|", left empty for all of them), or a JSON list of recipient dicts.
+
+        :param manifest_path: Path to the .csv or .json manifest.
+        :return: A list of recipient dicts.
+        """
+        with open(manifest_path, "r", encoding="utf-8", newline="") as manifest:
+            if manifest_path.lower().endswith(".json"):
+                return json.load(manifest)
+            return [{"recipient": row.get("recipient"), "password": row.get("password"),
+                     "permissions": row.get("permissions") or None, "output": row.get("output")}
+                    for row in csv.DictReader(manifest)]
+
+    def _permissions_flag(self, permissions):
+        """
+        Helper function turning the permissions granted to a recipient into pypdf's permission flags.
+
+        :param permissions: List of names from PERMISSIONS (or a string of them separated by
+                            spaces or "|"), None for all of them.
+        :return: A UserAccessPermissions flag.
+        :raises ValueError: If a permission name is unknown.
+        """
+        flag = UserAccessPermissions.all()
+        if permissions is None:
+            return flag
+        if isinstance(permissions, str):
+            permissions = permissions.replace("|", " ").split()
+        unknown = set(permissions) - set(self.PERMISSIONS)
+        if unknown:
+            raise ValueError(f"Unknown permission: {', '.join(sorted(unknown))}")
+        for name in self.PERMISSIONS:
+            if name not in permissions:
+                flag &= ~UserAccessPermissions[name.upper()]
+        return flag
+
+    def _encryption_source(self, file_path):
+        """
+        Helper function parsing the source of encrypt_many and copying its pages into the
+        PdfWriter that every variant is written from. Optimizes it once, if asked to.
+
+        :param file_path: Path to the PDF file, or the PDF as bytes or a stream.
+        :return: A PdfWriter holding the pages.
+        """
+        pdf_reader = self._open_reader(file_path)
+        pdf_writer = PdfWriter()
+        with self._phase("pages", file_path) as phase:
+            for page in pdf_reader.pages:
+                pdf_writer.add_page(page)
+            phase.update(pages=len(pdf_writer.pages))
+        self._release_reader(pdf_reader)
+        if self.optimize_output:
+            self._optimize(pdf_writer, self.max_image_dpi)
+        return pdf_writer
+
+    def _encrypt_variant(self, pdf_writer, variant, algorithm, owner_password):
+        """
+        Helper function encrypting and writing one recipient's variant of encrypt_many.
+        Never raises (except to cancel), so one bad output doesn't stop the others.
+
+        :param pdf_writer: PdfWriter from _encryption_source.
+        :param variant: A tuple (recipient, password, permissions flag, output path).
+        :param algorithm: "AES-128" or "AES-256".
+        :param owner_password: Password lifting the permissions, None for a random one.
+        :return: A dict with the recipient, output, ok, bytes written and error (None if ok).
+        """
+        recipient, password, permissions, output_path = variant
+        result = {"recipient": recipient, "output": output_path, "ok": True, "bytes": 0, "error": None}
+        try:
+            with self._phase("encrypt", output_path):
+                # Encrypting again replaces the previous recipient's key, the pages stay as they are
+                pdf_writer.encrypt(password, owner_password or secrets.token_urlsafe(32),
+                                   permissions_flag=permissions, algorithm=algorithm)
+            self._write_pdf(pdf_writer, output_path, "encrypted", optimize=False, password=password)
+            result["bytes"] = os.path.getsize(output_path)
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            result.update(ok=False, error=f"{type(e).__name__}: {e}")
+        return result
+
+    @_instrumented
+    def probe(self, file_path, page_sizes=True):
+        """
+        Quickly reads what's needed to triage a PDF file: whether it's encrypted, how many
+        pages it has and what size they are.
+
+        Only the header, trailer, xref and page tree are read, from a memory-mapped file;
+        page contents, fonts and images are never touched, and the page tree nodes are picked
+        out of the raw bytes (see _tree_node) rather than fully parsed. The page count comes
+        from the root of the page tree, so without page_sizes the tree isn't even walked.
+
+        Numbers and references aren't encrypted, so the page count and sizes can usually be
+        read even from an encrypted file whose password isn't known (needs_password: the empty
+        user password, common for files that only restrict permissions, doesn't open it).
+        When they can't, pages and page_sizes are None.
+
+        :param file_path: Path to the PDF file (or the PDF as bytes or a stream).
+        :param page_sizes: Whether to walk the page tree for the page sizes.
+        :return: A dict with file, size (bytes), mtime (nanoseconds, None unless a path), version,
+                 encrypted, needs_password, pages and page_sizes, a list of {"width", "height",
+                 "pages"} in points, as displayed (after rotation), in order of first appearance.
+        :raises IOError: If the file can't be read as a PDF.
+        """
+        try:
+            pdf_reader = self._open_reader(file_path)
+            result = {"file": _source_name(file_path), "size": _source_size(file_path),
+                      "mtime": os.stat(file_path).st_mtime_ns if _is_path(file_path) else None,
+                      "version": pdf_reader.pdf_header[5:], "encrypted": pdf_reader.is_encrypted,
+                      "needs_password": False, "pages": None, "page_sizes": None}
+            if pdf_reader.is_encrypted and not pdf_reader.decrypt(""):
+                result["needs_password"] = True
+            with self._phase("pages", file_path) as phase:
+                try:
+                    pages_reference = self._tree_node(pdf_reader, pdf_reader.trailer.raw_get("/Root"))["pages"]
+                    result["pages"] = self._tree_node(pdf_reader, pages_reference)["count"]
+                    if page_sizes:
+                        result["page_sizes"] = self._page_sizes(pdf_reader, pages_reference)
+                except Exception:
+                    if not result["needs_password"]:
+                        raise
+                    # Part of the tree could only be read by pypdf, which needs the password
+                    result["pages"] = result["page_sizes"] = None
+                phase.update(pages=result["pages"])
+            self._release_reader(pdf_reader)
+            return result
+        except Exception as e:
+            raise IOError(f"Failed to probe {_source_name(file_path)}. Error: {e}")
+
+    def _tree_node(self, pdf_reader, reference):
+        """
+        Helper function reading the entries of the catalog or a page tree node that probe needs.
+
+        The node is looked up in the xref and its top level entries are scanned straight out of
+        the file (see _scan_dictionary), skipping whatever else it holds (a page's resources,
+        annotations...). Nodes the scanner can't handle, e.g. kept in an object stream or
+        holding strings, are parsed by pypdf instead.
+
+        :param pdf_reader: PdfReader of the file.
+        :param reference: IndirectObject pointing at the node.
+        :return: A dict with pages (reference to the page tree, in the catalog), count, kids
+                 (list of references), mediabox (list of 4 numbers) and rotate, each None if
+                 the node doesn't have it.
+        """
+        offset = pdf_reader.xref.get(reference.generation, {}).get(reference.idnum)
+        if offset is not None:
+            pdf_reader.stream.seek(offset)
+            data = pdf_reader.stream.read(4096) # Plenty for a page, bigger ones are left to pypdf
+            header = re.match(rb"\s*(\d+)\s+(\d+)\s+obj", data)
+            entries = None
+            if header is not None and (int(header[1]), int(header[2])) == (reference.idnum, reference.generation):
+                entries = _scan_dictionary(data[header.end():])
+            if entries is not None:
+                try:
+                    return {
+                        "pages": self._raw_reference(pdf_reader, entries[b"/Pages"]) if b"/Pages" in entries else None,
+                        "count": int(entries[b"/Count"]) if b"/Count" in entries else None,
+                        "kids": [self._raw_reference(pdf_reader, kid) for kid in entries[b"/Kids"]]
+                                if b"/Kids" in entries else None,
+                        "mediabox": [float(value) for value in entries[b"/MediaBox"]] if b"/MediaBox" in entries else None,
+                        "rotate": int(entries[b"/Rotate"]) if b"/Rotate" in entries else None,
+                    }
+                except (TypeError, ValueError):
+                    pass # Something indirect, like a MediaBox kept in its own object
+
+        node = reference.get_object()
+        return {
+            "pages": node.raw_get("/Pages") if "/Pages" in node else None,
+            "count": int(node["/Count"]) if "/Count" in node else None,
+            "kids": list(node["/Kids"]) if "/Kids" in node else None,
+            "mediabox": [float(value.get_object()) for value in node["/MediaBox"]] if "/MediaBox" in node else None,
+            "rotate": int(node["/Rotate"]) if "/Rotate" in node else None,
+        }
+
+    def _raw_reference(self, pdf_reader, token):
+        """
+        Helper function turning a raw b"12 0 R" token from _scan_dictionary into an IndirectObject.
+
+        :raises ValueError: If the token isn't a reference.
+        """
+        match = re.fullmatch(rb"(\d+)\s+(\d+)\s+R", token) if isinstance(token, bytes) else None
+        if match is None:
+            raise ValueError(f"Not a reference: {token}")
+        return IndirectObject(int(match[1]), int(match[2]), pdf_reader)
+
+    def _page_sizes(self, pdf_reader, pages_reference):
+        """
+        Helper function walking a page tree for the page sizes, reading nothing but the tree's
+        own nodes. MediaBox and Rotate are inherited from parent nodes when a page has none.
+
+        :param pdf_reader: PdfReader of the file.
+        :param pages_reference: Reference to the /Pages node at the root of the tree.
+        :return: A list of {"width", "height", "pages"}, see probe.
+        """
+        sizes = {} # (width, height) -> number of pages, in order of first appearance
+        visited = set() # Object numbers of the nodes already walked, a broken tree can loop
+        stack = [(pages_reference, None, 0)] # (node, inherited MediaBox, inherited Rotate)
+        while stack:
+            reference, mediabox, rotate = stack.pop()
+            if reference.idnum in visited:
+                continue
+            visited.add(reference.idnum)
+            node = self._tree_node(pdf_reader, reference)
+            mediabox = node["mediabox"] or mediabox
+            rotate = node["rotate"] if node["rotate"] is not None else rotate
+            if node["kids"] is not None:
+                # Reversed, so the first kid comes off the stack first and pages stay in order
+                stack.extend((kid, mediabox, rotate) for kid in reversed(node["kids"]))
+                continue
+            box = mediabox or [0, 0, 612, 792] # MediaBox is required, fall back on letter for the odd file that has none
+            width, height = round(abs(box[2] - box[0]), 2), round(abs(box[3] - box[1]), 2)
+            if rotate % 180:
+                width, height = height, width
+            sizes[(width, height)] = sizes.get((width, height), 0) + 1
+        return [{"width": width, "height": height, "pages": pages} for (width, height), pages in sizes.items()]
+
+    def probe_directory(self, directory, pattern="**/*.pdf", workers=8, cache_path=None, page_sizes=True):
+        """
+        Probes every PDF file in a directory (see probe) with a pool of threads.
+
+        With a cache file, files whose size and modification time haven't changed since the
+        last run aren't probed again; the cache is updated at the end. A file that can't be
+        probed gets an "error" in its result and doesn't stop the others.
+
+        :param directory: Directory to look in.
+        :param pattern: Glob pattern of the files, relative to the directory.
+        :param workers: Number of threads probing files.
+        :param cache_path: Path to a JSON file to keep results in between runs, None for no cache.
+        :param page_sizes: Whether to read the page sizes, as in probe.
+        :return: A dict with the per-file results (sorted by path), files, cache_hits,
+                 errors, wall_time in seconds and files_per_sec.
+        """
+        start = time.perf_counter()
+        file_paths = sorted(os.path.abspath(file_path)
+                            for file_path in glob.glob(os.path.join(directory, pattern), recursive=True))
+        cached = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as cache_file:
+                cached = {result["file"]: result for result in json.load(cache_file)["files"]}
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(lambda file_path: self._probe_cached(file_path, cached, page_sizes), file_paths))
+        results = [result for result, _ in outcomes]
+
+        if cache_path:
+            cached.update((result["file"], result) for result in results)
+            part_path = f"{cache_path}.part"
+            with open(part_path, "w", encoding="utf-8") as cache_file:
+                json.dump({"version": 1, "files": list(cached.values())}, cache_file)
+            os.replace(part_path, cache_path) # Swap the finished file in, in one step
+        wall_time = time.perf_counter() - start
+        return {
+            "results": results,
+            "files": len(results),
+            "cache_hits": sum(1 for _, cache_hit in outcomes if cache_hit),
+            "errors": sum(1 for result in results if "error" in result),
+            "wall_time": wall_time,
+            "files_per_sec": len(results) / wall_time if wall_time > 0 else 0.0,
+        }
+
+    def _probe_cached(self, file_path, cached, page_sizes):
+        """
+        Helper function probing one file for probe_directory, or taking its result from the cache.
+
+        :param file_path: Absolute path to the PDF file.
+        :param cached: Dict of cached results by path.
+        :param page_sizes: Whether the page sizes are wanted.
+        :return: A tuple (result, whether it came from the cache).
+        """
+        stat = os.stat(file_path)
+        result = cached.get(file_path)
+        if (result is not None and (result["size"], result["mtime"]) == (stat.st_size, stat.st_mtime_ns)
+                and (result.get("page_sizes") is not None or not page_sizes or result.get("pages") is None)):
+            return result, True
+        try:
+            return self.probe(file_path, page_sizes), False
+        except IOError as e:
+            return {"file": file_path, "size": stat.st_size, "mtime": stat.st_mtime_ns, "error": str(e)}, False
+
+    @_instrumented
+    @_result_cached
+    def optimize(self, file_path, output_path, max_image_dpi=None):
+        """
+        Makes a PDF file smaller: compresses its content streams, writes identical objects
+        only once, drops objects nothing refers to and optionally downsamples images.
+
+        :param file_path: Path to the PDF file to optimize (or the PDF as bytes or a stream).
+        :param output_path: Path (or stream) where the optimized PDF will be saved, None to return it.
+        :param max_image_dpi: Downsample images shown above this resolution, None to leave images alone.
+        :return: The report from _optimize, plus "output" holding the optimized PDF as bytes
+                 if output_path is None.
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        """
+        pdf_reader = self._open_reader(file_path)
+        pdf_writer = PdfWriter(clone_from=pdf_reader) # Keeps bookmarks, links and metadata
+        self._release_reader(pdf_reader)
+
+        report = self._optimize(pdf_writer, max_image_dpi)
+        optimized = self._write_pdf(pdf_writer, output_path, "optimized", optimize=False)
+        if optimized is not None:
+            report["output"] = optimized
+        return report
+
+    def _optimize(self, pdf_writer, max_image_dpi=None):
+        """
+        Helper function shrinking a finished document in place, just before it's written.
+
+        Runs, in order: image downsampling (only with max_image_dpi), content stream
+        compression, removal of duplicate identical objects (the later copies are pointed
+        at the first one) and removal of objects nothing refers to anymore, e.g. resources
+        left over from pages that were not copied. The whole document is only sized before
+        and after; each step reports what it saved from the streams it replaced or the
+        objects it removed, so the steps add up to roughly the difference.
+
+        :param pdf_writer: PdfWriter holding the finished document.
+        :param max_image_dpi: Downsample images shown above this resolution, None to leave images alone.
+        :return: A dict with before_bytes, after_bytes (size of the objects, see _object_bytes)
+                 and the bytes saved by each of images, content_streams, duplicates and unreferenced.
+        """
+        def remove_objects(**options):
+            # Size only the objects the step drops, rather than the whole document again
+            objects = list(pdf_writer._objects)
+            pdf_writer.compress_identical_objects(**options)
+            return _object_bytes(pdf_writer, [obj for obj, kept in zip(objects, pdf_writer._objects) if kept is None])
+
+        steps = [
+            ("images", lambda: self._downsample_images(pdf_writer, max_image_dpi)),
+            ("content_streams", lambda: self._compress_content_streams(pdf_writer)),
+            ("duplicates", lambda: remove_objects(remove_duplicates=True, remove_unreferenced=False)),
+            ("unreferenced", lambda: remove_objects(remove_duplicates=False, remove_unreferenced=True)),
+        ]
+        # The encryption dictionary is only referred to by the trailer, so it looks unreferenced.
+        # pypdf has no public way to keep it, so it's put back by object number if there is one
+        encrypt_entry = getattr(pdf_writer, "_encrypt_entry", None)
+        with self._phase("optimize") as phase:
+            report = {"before_bytes": _object_bytes(pdf_writer)}
+            for category, step in steps:
+                report[category] = step()
+            if encrypt_entry is not None:
+                pdf_writer._objects[encrypt_entry.indirect_reference.idnum - 1] = encrypt_entry
+            report["after_bytes"] = _object_bytes(pdf_writer)
+            phase.update(**report)
+        return report
+
+    def _compress_content_streams(self, pdf_writer):
+        """
+        Helper function Flate compressing the content stream of every page that isn't compressed yet.
+
+        :param pdf_writer: PdfWriter holding the pages.
+        :return: Bytes saved, from the sizes of the streams before and after.
+        """
+        saved = 0
+        for page in pdf_writer.pages:
+            contents = page.get("/Contents")
+            contents = contents.get_object() if contents is not None else None
+            if isinstance(contents, StreamObject) and "/Filter" in contents:
+                continue # Already a single compressed stream, nothing to gain from decoding it again
+            if contents is not None:
+                streams = contents if isinstance(contents, ArrayObject) else [contents]
+                saved += _object_bytes(pdf_writer, [stream.get_object() for stream in streams])
+                page.compress_content_streams() # Also joins several streams into one
+                saved -= _object_bytes(pdf_writer, [page["/Contents"].get_object()])
+        return saved
+
+    def _downsample_images(self, pdf_writer, max_image_dpi):
+        """
+        Helper function downsampling the images shown above max_image_dpi, using Pillow.
+
+        An image's resolution is worked out from the largest size it is drawn at on any page
+        (from the transformation matrix in effect when it's drawn), so an image reused at
+        several sizes keeps enough pixels for the biggest. Images with a transparency mask,
+        and images that wouldn't get smaller, are left as they are.
+
+        :param pdf_writer: PdfWriter holding the pages.
+        :param max_image_dpi: Highest resolution to keep, in dots per inch, None to do nothing.
+        :return: Bytes saved, from the sizes of the images before and after.
+        """
+        if not max_image_dpi:
+            return 0
+        from PIL import Image # Only needed when downsampling, so Pillow stays optional
+
+        shown = {} # Image object number -> (page, name, largest width and height drawn, in points)
+        for page in pdf_writer.pages:
+            resources = page.get("/Resources")
+            xobjects = resources.get_object().get("/XObject") if resources is not None else None
+            if xobjects is None:
+                continue
+            xobjects = xobjects.get_object()
+
+            def visit(operator, operands, cm, tm, page=page, xobjects=xobjects):
+                if operator != b"Do" or not operands or operands[0] not in xobjects:
+                    return
+                reference = xobjects.raw_get(operands[0])
+                if not isinstance(reference, IndirectObject) or reference.get_object().get("/Subtype") != "/Image":
+                    return
+                width, height = math.hypot(cm[0], cm[1]), math.hypot(cm[2], cm[3])
+                _, _, (shown_width, shown_height) = shown.get(reference.idnum, (None, None, (0, 0)))
+                shown[reference.idnum] = (page, operands[0], (max(width, shown_width), max(height, shown_height)))
+
+            page.extract_text(visitor_operand_before=visit) # Walks the content stream, tracking the matrix
+
+        saved = 0
+        for idnum, (page, name, (width, height)) in shown.items():
+            image = pdf_writer._objects[idnum - 1]
+            if "/SMask" in image or "/Mask" in image or image.get("/ImageMask"):
+                continue
+            target = (math.ceil(width / 72 * max_image_dpi), math.ceil(height / 72 * max_image_dpi))
+            if target[0] >= image["/Width"] or target[1] >= image["/Height"] or min(target) < 1:
+                continue # Already at or below the limit
+            image_file = page.images[name]
+            if image_file.image.mode not in ("L", "RGB", "CMYK"):
+                continue
+            image_file.replace(image_file.image.resize(target, Image.LANCZOS), quality=85)
+            if len(pdf_writer._objects[idnum - 1]._data) >= len(image._data):
+                pdf_writer._objects[idnum - 1] = image # The resampled image came out bigger, keep the original
+            else:
+                saved += _object_bytes(pdf_writer, [image]) - _object_bytes(pdf_writer, [pdf_writer._objects[idnum - 1]])
+        return saved
+
+    def _write_pdf(self, pdf_writer, output_path, description, optimize=None, password=None):
+        """
+        Helper function writing the finished PDF to its output file.
+
+        The PDF is written to a temporary ".part" file next to the output and only renamed
+        into place once complete, so a failed or cancelled write never leaves a half-written
+        output behind (or clobbers an existing one). Streams are written to directly, the
+        caller owns them and whatever is left in them if the write fails.
+
+        :param pdf_writer: PdfWriter holding the finished document.
+        :param output_path: Path or writable binary stream where the PDF will be saved,
+                            None to return it as bytes.
+        :param description: What kind of file this is, used in the error message (e.g. "split").
+        :param optimize: Whether to run the optimize stage first, None to follow optimize_output.
+        :param password: Password pdf_writer is encrypted with, if it is, see _write_document.
+        :return: The PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If the output file cannot be written.
+        :raises OperationCancelled: If the operation was cancelled before writing.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise OperationCancelled("Operation cancelled")
+        if optimize is None:
+            optimize = self.optimize_output
+        if optimize and not pdf_writer.incremental: # Incremental saves keep the original as it is
+            self._optimize(pdf_writer, self.max_image_dpi)
+        if not _is_path(output_path):
+            out = BytesIO() if output_path is None else output_path
+            try:
+                with self._phase("write", output_path) as phase:
+                    start = out.tell()
+                    self._write_document(pdf_writer, out, password)
+                    phase.update(bytes_written=out.tell() - start)
+            except Exception as e:
+                raise IOError(f"Failed to write {description} file. Error: {e}")
+            return out.getvalue() if output_path is None else None
+        part_path = f"{output_path}.part"
+        try:
+            with self._phase("write", output_path) as phase:
+                with open(part_path, "wb") as out: # 'wb' = binary write, writing binary data
+                    self._write_document(pdf_writer, out, password)
+                    phase.update(bytes_written=out.tell())
+                os.replace(part_path, output_path) # Swap the finished file in, in one step
+        except Exception as e:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            # Raise an error if file cannot be written
+            raise IOError(f"Failed to write {description} file. Error: {e}")
+
+    def _write_document(self, pdf_writer, out, password=None):
+        """
+        Helper function writing a PdfWriter's document to an open output, linearized if the
+        PdfEdit was asked to.
+
+        A linearized PDF starts with a hint table and everything the first page needs, so a
+        viewer reading it over byte-range HTTP can show the first page from the start of the
+        file and fetch other pages as they're asked for. pypdf can't write one, so pypdf's
+        output is rewritten by qpdf (through pikepdf). An encrypted document is opened with
+        its password and keeps its encryption. Incremental saves are never linearized, since
+        the update appended after the original would break it anyway.
+
+        :param pdf_writer: PdfWriter holding the finished document.
+        :param out: Writable binary stream.
+        :param password: Password pdf_writer is encrypted with, if it is.
+        """
+        if not self.linearize or pdf_writer.incremental:
+            pdf_writer.write(out)
+            return
+        import pikepdf
+        unlinearized = BytesIO()
+        pdf_writer.write(unlinearized)
+        unlinearized.seek(0)
+        linearized = BytesIO()
+        with pikepdf.open(unlinearized, password=password or "") as pdf:
+            # encryption=True keeps the encryption the document was opened with, rather than dropping it
+            pdf.save(linearized, linearize=True, encryption=pdf.is_encrypted)
+        out.write(linearized.getvalue())
+
+    def _write_incremental(self, pdf_writer, file_path, output_path, description):
+        """
+        Helper function saving an incremental PdfWriter as an update appended to its original file.
+
+        Only the new and changed objects and a new xref section are written by pypdf, so the
+        write grows with the size of the change rather than the size of the document. If
+        output_path is the input file itself, the update is appended in place (and cut off
+        again if the write fails). Otherwise the original is first copied to a ".part" file
+        by the OS, without passing through pypdf, and renamed into place once the update is on.
+
+        Bytes and stream inputs or outputs have no file to append to, so pypdf writes the
+        original followed by the update, through _write_pdf.
+
+        :param pdf_writer: PdfWriter opened on file_path's reader with incremental=True.
+        :param file_path: Path to the original PDF file (or the PDF as bytes or a stream).
+        :param output_path: Path where the PDF will be saved, may be file_path (or a stream, or None).
+        :param description: What kind of file this is, used in the error message (e.g. "watermarked").
+        :return: The PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If the output file cannot be written.
+        :raises OperationCancelled: If the operation was cancelled before writing.
+        """
+        if not (_is_path(file_path) and _is_path(output_path)):
+            return self._write_pdf(pdf_writer, output_path, description)
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise OperationCancelled("Operation cancelled")
+        return self._append_update(file_path, output_path, description,
+                                   lambda out, origin: pdf_writer.write(_AppendOnly(out, out.tell())))
+
+    def _append_update(self, file_path, output_path, description, write_update):
+        """
+        Helper function saving an incremental update after its original file, see _write_incremental.
+
+        Unlike pypdf, write_update only writes the update. For a path input and output, it's
+        appended to the input itself or to a copy of it, the same way as in _write_incremental.
+        Otherwise the original's bytes are copied to the output stream (or the returned bytes) first.
+
+        :param file_path: Path to the original PDF file, or the PDF as bytes.
+        :param output_path: Path where the PDF will be saved, may be file_path (or a stream, or None).
+        :param description: What kind of file this is, used in the error message (e.g. "watermarked").
+        :param write_update: Callable taking the binary output, positioned at the end of the
+                             original, and the position in it where the document starts.
+        :return: The PDF as bytes if output_path is None, otherwise None.
+        :raises IOError: If the output file cannot be written.
+        :raises OperationCancelled: If the operation was cancelled while the update was written.
+        """
+        if not (_is_path(file_path) and _is_path(output_path)):
+            out = BytesIO() if output_path is None else output_path
+            try:
+                origin = out.tell()
+                if _is_path(file_path):
+                    with open(file_path, "rb") as original:
+                        shutil.copyfileobj(original, out)
+                else:
+                    out.write(file_path)
+                with self._phase("write", output_path) as phase:
+                    original_size = out.tell() - origin
+                    write_update(out, origin)
+                    phase.update(bytes_written=out.tell() - origin - original_size, incremental=True)
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                raise IOError(f"Failed to write {description} file. Error: {e}")
+            return out.getvalue() if output_path is None else None
+        in_place = os.path.exists(output_path) and os.path.samefile(file_path, output_path)
+        target_path = file_path if in_place else f"{output_path}.part"
+        original_size = os.path.getsize(file_path)
+        try:
+            with self._phase("write", output_path) as phase:
+                if not in_place:
+                    shutil.copyfile(file_path, target_path)
+                with open(target_path, "r+b") as out:
+                    out.seek(original_size)
+                    write_update(out, 0)
+                    phase.update(bytes_written=out.tell() - original_size, incremental=True)
+                if not in_place:
+                    os.replace(target_path, output_path) # Swap the finished file in, in one step
+        except BaseException as e:
+            if in_place:
+                with open(file_path, "r+b") as out:
+                    out.truncate(original_size) # Drop the partial update, back to the original
+            elif os.path.exists(target_path):
+                os.remove(target_path)
+            if isinstance(e, OperationCancelled) or not isinstance(e, Exception):
+                raise
+            raise IOError(f"Failed to write {description} file. Error: {e}")
+
+class PageRange:
+    """
+    A page range such as "1-3, 5, 7", parsed and checked once so it can be applied to
+    any number of documents or outputs without re-parsing the string.
+    """
+    def __init__(self, page_range):
+        """
+        Parses a page range string.
+
+        :param page_range: A string specifying the page range, e.g., "1-3, 5, 7" (pages start at 1).
+        :raises ValueError: If the page range is malformed or has numbers below 1.
+        """
+        self.text = page_range
+        self.spans = [] # List of (first page, last page), 1-indexed and inclusive, in the order given
+
+        # Splitting the page_range string into individual page numbers and ranges
+        for r in page_range.split(","): # Loop through each unit of entry (page number or range)
+            r = r.strip() # remove leading and trailing whitespace
+            if "-" in r:
+                # Processing a range of pages unit
+                start, end = map(int, r.split("-"))
+                if not 1 <= start <= end:
+                    raise ValueError("Invalid page range")
+                self.spans.append((start, end))
+            else:
+                # Processing a single page unit
+                page = int(r)
+                if page < 1:
+                    raise ValueError("Page number out of range")
+                self.spans.append((page, page))
+        # The highest page the range needs, so checking it against a document is a single comparison
+        self.last_page = max(end for _, end in self.spans)
+
+    @classmethod
+    def from_page_numbers(cls, page_numbers):
+        """
+        Builds a PageRange from 0-indexed page numbers, joining consecutive pages into spans.
+
+        :param page_numbers: Iterable of 0-indexed page numbers, in the order they should be taken.
+        :return: A PageRange, e.g. [0, 1, 2, 6] gives "1-3, 7".
+        :raises ValueError: If there are no page numbers.
+        """
+        spans = []
+        for page_num in page_numbers:
+            page = page_num + 1 # +1 to go back to 1-indexing
+            if spans and spans[-1][1] + 1 == page:
+                spans[-1][1] = page
+            else:
+                spans.append([page, page])
+        if not spans:
+            raise ValueError("Invalid page range")
+        return cls(", ".join(str(start) if start == end else f"{start}-{end}" for start, end in spans))
+
+    def validate(self, total_pages):
+        """
+        Checks that every page of the range exists in a document.
+
+        :param total_pages: Number of pages in the document.
+        :raises ValueError: If the page range is out of bounds.
+        """
+        if self.last_page <= total_pages:
+            return
+        for start, end in self.spans:
+            if end > total_pages:
+                # Same messages as a single page or a range would have always given
+                raise ValueError("Page number out of range" if start == end else "Invalid page range")
+
+    def page_numbers(self, total_pages):
+        """
+        Lists the 0-indexed page numbers selected in a document with the given number of pages.
+
+        :param total_pages: Number of pages in the document.
+        :return: A list of 0-indexed page numbers, in the order given.
+        :raises ValueError: If the page range is out of bounds.
+        """
+        self.validate(total_pages)
+        page_numbers = []
+        for start, end in self.spans:
+            page_numbers.extend(range(start - 1, end)) # -1 to account for 0-indexing
+        return page_numbers
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"PageRange({self.text!r})"
+
+
+class PdfPipeline:
+    """
+    Chains PdfEdit operations (split, add_watermark, encrypt_pdf) so they run one after
+    another on the same in-memory pages. The source is parsed once and the result is
+    written once, with no intermediate files in between.
+
+    Example:
+        PdfPipeline().split("1-3").add_watermark("Draft").encrypt_pdf("secret").run("in.pdf", "out.pdf")
+    """
+    def __init__(self, pdf_edit=None):
+        """
+        Initializes an empty pipeline.
+
+        :param pdf_edit: PdfEdit to borrow helpers (and the watermark overlay cache) from.
+        """
+        self.pdf_edit = pdf_edit or PdfEdit()
+        self.stages = [] # List of (stage name, keyword arguments)
+        self.timings = {} # Seconds spent in each stage of the last run
+        self.optimize_report = None # Report of the optimize stage of the last run, if it had one
+
+    def split(self, page_range):
+        """
+        Adds a stage keeping only the pages in the given range. Must come before any add_watermark stage.
+
+        :param page_range: Page range to keep (e.g., "1-3, 5, 7"), numbered within the pages left so far.
+        :return: The pipeline, so stages can be chained.
+        :raises ValueError: If a watermark stage was already added.
+        """
+        if any(name == "add_watermark" for name, _ in self.stages):
+            raise ValueError("split must come before add_watermark in a pipeline")
+        self.stages.append(("split", {"page_range": page_range}))
+        return self
+
+    def add_watermark(self, watermark_text, font_name="Helvetica", font_size=12, position=(100, 100)):
+        """
+        Adds a stage stamping a text watermark on each page, see PdfEdit.add_watermark.
+
+        :return: The pipeline, so stages can be chained.
+        """
+        self.stages.append(("add_watermark", {"watermark_text": watermark_text, "font_name": font_name,
+                                              "font_size": font_size, "position": position}))
+        return self
+
+    def encrypt_pdf(self, password):
+        """
+        Adds a stage encrypting the output with a password. The encryption itself is applied
+        when the output is written, so this can go anywhere in the pipeline.
+
+        :param password: Password for encrypting the PDF.
+        :return: The pipeline, so stages can be chained.
+        """
+        self.stages.append(("encrypt_pdf", {"password": password}))
+        return self
+
+    def optimize(self, max_image_dpi=None):
+        """
+        Adds a stage shrinking the output, see PdfEdit.optimize. It always runs last, just
+        before the output is written, so this can go anywhere in the pipeline; its report
+        is kept in optimize_report.
+
+        :param max_image_dpi: Downsample images shown above this resolution, None to leave images alone.
+        :return: The pipeline, so stages can be chained.
+        """
+        self.stages.append(("optimize", {"max_image_dpi": max_image_dpi}))
+        return self
+
+    def run(self, file_path, output_path):
+        """
+        Runs every stage over the source PDF and saves the result.
+
+        :param file_path: Path to the source PDF file (or the PDF as bytes or a stream).
+        :param output_path: Path (or writable binary stream) where the resulting PDF will be saved.
+        :return: Dict of seconds spent per stage, in run order: "parse", each stage by name
+                 (repeated stages get "#2", "#3"...), "optimize" if the pipeline has it, and "write".
+        :raises IOError: If there's an issue reading the input file or writing the output file.
+        :raises ValueError: If a page range is invalid or out of bounds.
+        """
+        self.timings = {}
+        self.optimize_report = None
+        optimize_arguments = None # Arguments of the optimize stage, run just before writing
+        password = None # Password of the encrypt_pdf stage, if any
+        start = time.perf_counter()
+        pdf_reader = _read_pdf(file_path)
+        pages = list(pdf_reader.pages) # Pages still to be written, from the source until copied
+        pdf_writer = PdfWriter()
+        in_writer = False # Whether pages have been copied into pdf_writer yet
+        self._record("parse", start)
+
+        for name, arguments in self.stages:
+            start = time.perf_counter()
+            if name == "split":
+                pages = [pages[page_num] for page_num in self.pdf_edit._page_numbers(arguments["page_range"], len(pages))]
+            elif name == "add_watermark":
+                if not in_writer:
+                    # Stamping happens on the writer's copy, so the source pages are left untouched
+                    pages = [pdf_writer.add_page(page) for page in pages]
+                    in_writer = True
+                for page in pages:
+                    self.pdf_edit._stamp_page(page, **arguments)
+            elif name == "encrypt_pdf":
+                pdf_writer.encrypt(arguments["password"])
+                password = arguments["password"]
+            elif name == "optimize":
+                optimize_arguments = arguments
+                continue # Timed when it runs, just before the write
+            self._record(name, start)
+
+        start = time.perf_counter()
+        if not in_writer:
+            for page in pages:
+                pdf_writer.add_page(page)
+        if optimize_arguments is not None:
+            self.optimize_report = self.pdf_edit._optimize(pdf_writer, **optimize_arguments)
+            self._record("optimize", start)
+            start = time.perf_counter()
+        # The stage has already run, don't let the PdfEdit's own optimize_output run it again
+        self.pdf_edit._write_pdf(pdf_writer, output_path, "pipeline",
+                                 optimize=None if optimize_arguments is None else False, password=password)
+        self._record("write", start)
+        return self.timings
+
+    def _record(self, name, start):
+        """
+        Helper function storing how long a stage took, numbering repeated stages.
+
+        :param name: Name of the stage.
+        :param start: time.perf_counter() value from when the stage started.
+        """
+        label = name
+        count = 1
+        while label in self.timings:
+            count += 1
+            label = f"{name}#{count}"
+        self.timings[label] = time.perf_counter() - start
+
+
+class JobTimeoutError(BaseException):
+    """
+    Raised inside a batch worker when a job runs past its timeout. Derives from
+    BaseException so that pypdf's own 'except Exception' recovery code can't swallow it.
+    """
+
+
+def _raise_job_timeout(signum, frame):
+    """
+    Signal handler used by batch workers to abort a job that ran past its timeout.
+    """
+    raise JobTimeoutError("Job timed out")
+
+
+def _check_job_timeout(timeout):
+    """
+    Checks that a job timeout can be enforced here, for PdfBatch and PdfWatcher.
+
+    :param timeout: Seconds a job may run for, or None for no limit.
+    :raises ValueError: If a timeout is given on a platform without SIGALRM (e.g. Windows).
+    """
+    if timeout and not hasattr(signal, "SIGALRM"):
+        raise ValueError("Job timeouts need SIGALRM, which this platform doesn't have")
+
+
+def _unique_path(path, taken=()):
+    """
+    Returns the path, or if a file already exists there (or it's taken), the same path
+    with the first free counter added to its name, e.g. "scan_1.pdf", "scan_2.pdf".
+
+    :param path: The path wanted.
+    :param taken: Paths to treat as existing, e.g. outputs of jobs still running.
+    :return: A path nothing is at yet.
+    """
+    stem, extension = os.path.splitext(path)
+    unique = path
+    counter = 0
+    while os.path.exists(unique) or unique in taken:
+        counter += 1
+        unique = f"{stem}_{counter}{extension}"
+    return unique
+
+
+def _count_pages(file_path, password=None):
+    """
+    Counts the pages of a PDF file, decrypting it first if needed.
+
+    :param file_path: Path to the PDF file.
+    :param password: Password to use if the file is encrypted.
+    :return: Number of pages in the file.
+    """
+    pdf_reader = _read_pdf(file_path)
+    if pdf_reader.is_encrypted:
+        pdf_reader.decrypt(password or "")
+    return len(pdf_reader.pages)
+
+
+def _run_batch_job(job, timeout):
+    """
+    Runs a single batch job inside a worker process. Never raises, so that one bad
+    input can only fail its own job and the rest of the batch keeps running.
+
+    :param job: A job dict, see PdfBatch for the keys each operation needs.
+    :param timeout: Seconds the job may run for, or None for no limit.
+    :return: A dict with the job, whether it succeeded ("ok"), the pages written,
+             the seconds it took and the error message if it failed.
+    """
+    result = {"job": job, "ok": False, "pages": 0, "seconds": 0.0, "error": None}
+    # Timeouts rely on SIGALRM, which isn't available on every platform (e.g. Windows),
+    # PdfBatch and PdfWatcher refuse a timeout there
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    output_existed = os.path.exists(job.get("output", ""))
+    start = time.perf_counter()
+    try:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, _raise_job_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        pdf_edit = PdfEdit()
+        operation = job["operation"]
+        if operation == "merge":
+            pdf_edit.merge(job["inputs"], job["output"], overwrite_confirm=True)
+        elif operation == "split":
+            pdf_edit.split(job["input"], job["page_range"], job["output"])
+        elif operation == "add_watermark":
+            pdf_edit.add_watermark(job["input"], job["watermark_text"], job["output"])
+        elif operation == "encrypt_pdf":
+            pdf_edit.encrypt_pdf(job["input"], job["password"], job["output"])
+        elif operation == "decrypt_pdf":
+            pdf_edit.decrypt_pdf(job["input"], job["password"], job["output"])
+        else:
+            raise ValueError(f"Unknown operation: {operation}")
+        result["pages"] = _count_pages(job["output"], job.get("password"))
+        result["ok"] = True
+    except (Exception, JobTimeoutError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0) # Cancel the alarm if the job finished in time
+        result["seconds"] = time.perf_counter() - start
+    if not result["ok"] and not output_existed and os.path.exists(job.get("output", "")):
+        os.remove(job["output"]) # Don't leave a half-written output behind
+    return result
+
+
+# PdfEdit and source PdfReader of a split_many worker process, set by _init_split_worker
+_split_edit = None
+_split_source = None
+
+# (path, PdfReader) of the file a TextIndex worker extracted text from last, set by _text_worker
+_text_source = None
+
+# PdfEdit, source PdfReader, shared object numbers, next free object number (shared between
+# the workers) and drawing streams written (see PdfEdit._stamp_kids) of an add_watermark
+# worker process, set by _init_watermark_worker
+_watermark_edit = None
+_watermark_source = None
+_watermark_shared = None
+_watermark_numbers = None
+_watermark_draws = None
+
+# PdfEdit and source PdfWriter of an encrypt_many worker process, set by _init_encrypt_worker
+_encrypt_edit = None
+_encrypt_source = None
+
+
+def _init_split_worker(file_path, optimize_output, max_image_dpi, linearize=False):
+    """
+    Initializer for split_many's worker processes: parses the source once per worker.
+
+    :param file_path: Path to the PDF file being split, or the PDF as bytes.
+    :param optimize_output: Whether outputs are optimized, as in the calling PdfEdit.
+    :param max_image_dpi: Image resolution limit for the optimizer, as in the calling PdfEdit.
+    :param linearize: Whether outputs are linearized, as in the calling PdfEdit.
+    """
+    global _split_edit, _split_source
+    _split_edit = PdfEdit(optimize_output=optimize_output, max_image_dpi=max_image_dpi, linearize=linearize)
+    _split_source = _read_pdf(file_path)
+
+
+def _split_worker(part):
+    """
+    Writes one output of split_many inside a worker process.
+
+    :param part: A tuple (0-indexed page numbers, output path).
+    """
+    page_numbers, output_path = part
+    _split_edit._write_pages(_split_source, page_numbers, output_path)
+
+
+def _init_watermark_worker(file_path, shared, numbers):
+    """
+    Initializer for add_watermark's worker processes: parses the source once per worker.
+
+    :param file_path: Path to the PDF file being watermarked, or the PDF as bytes.
+    :param shared: Object numbers of the objects every page uses, see PdfEdit._stamp_chunks.
+    :param numbers: multiprocessing.Value holding the next free object number.
+    """
+    global _watermark_edit, _watermark_source, _watermark_shared, _watermark_numbers, _watermark_draws
+    _watermark_edit = PdfEdit()
+    _watermark_source = _read_pdf(file_path)
+    _watermark_shared = shared
+    _watermark_numbers = numbers
+    _watermark_draws = {}
+
+
+def _watermark_worker(chunk):
+    """
+    Stamps one chunk of add_watermark's pages inside a worker process.
+
+    :param chunk: List of the page tree kids to stamp the pages under, see PdfEdit._stamp_chunks.
+    :return: The stamped page objects serialized for an incremental update, see PdfEdit._stamp_kids.
+    """
+    return _watermark_edit._stamp_kids(_watermark_source, chunk, _watermark_shared, _watermark_draws, _watermark_number)
+
+
+def _watermark_number():
+    """
+    Takes the next free object number for an object a watermark worker adds.
+
+    :return: The object number, not used by the original or by any other worker.
+    """
+    with _watermark_numbers.get_lock():
+        number = _watermark_numbers.value
+        _watermark_numbers.value += 1
+    return number
+
+
+def _text_worker(task):
+    """
+    Extracts the text of one chunk of a file's pages for TextIndex.update, in a worker
+    process (or in the calling one with a single worker). Never raises, so that one bad
+    file only fails its own pages.
+
+    :param task: A tuple (absolute path, first page, page after the last one), 0-indexed.
+    :return: A tuple (list of page texts, None) or ([], error message).
+    """
+    global _text_source
+    path, first, stop = task
+    try:
+        # Chunks of the same file come one after another, so the last file parsed is kept
+        if _text_source is None or _text_source[0] != path:
+            _text_source = (path, _read_pdf(path))
+        pdf_reader = _text_source[1]
+        return [pdf_reader.pages[page_num].extract_text() for page_num in range(first, stop)], None
+    except Exception as e:
+        return [], f"Failed to extract text from {path}. Error: {e}"
+
+
+def _release_text_source():
+    """
+    Forgets the file _text_worker kept parsed, so it can be closed. Used when the text is
+    extracted in the calling process, where nothing else would let go of it.
+    """
+    global _text_source
+    _text_source = None
+
+
+def _init_encrypt_worker(file_path, optimize_output, max_image_dpi, linearize=False):
+    """
+    Initializer for encrypt_many's worker processes: parses the source and copies its pages once per worker.
+
+    :param file_path: Path to the PDF file being encrypted, or the PDF as bytes.
+    :param optimize_output: Whether the source is optimized, as in the calling PdfEdit.
+    :param max_image_dpi: Image resolution limit for the optimizer, as in the calling PdfEdit.
+    :param linearize: Whether outputs are linearized, as in the calling PdfEdit.
+    """
+    global _encrypt_edit, _encrypt_source
+    _encrypt_edit = PdfEdit(optimize_output=optimize_output, max_image_dpi=max_image_dpi, linearize=linearize)
+    _encrypt_source = _encrypt_edit._encryption_source(file_path)
+
+
+def _encrypt_worker(task):
+    """
+    Writes one recipient's variant of encrypt_many inside a worker process.
+
+    :param task: A tuple (variant, algorithm, owner password), see PdfEdit._encrypt_variant.
+    :return: The variant's result dict.
+    """
+    variant, algorithm, owner_password = task
+    return _encrypt_edit._encrypt_variant(_encrypt_source, variant, algorithm, owner_password)
+
+
+class PdfBatch:
+    """
+    Runs PdfEdit operations over many files at once, spread across a pool of worker processes.
+
+    Each job is a dict holding the "operation" (merge, split, add_watermark, encrypt_pdf or
+    decrypt_pdf), its "output" path, and what that operation needs:
+    "inputs" (a list of paths) for merge, otherwise "input", plus "page_range" for split,
+    "watermark_text" for add_watermark and "password" for encrypt_pdf/decrypt_pdf.
     """
-    def __init__(self):
+    OPERATIONS = ("merge", "split", "add_watermark", "encrypt_pdf", "decrypt_pdf")
+
+    def __init__(self, workers=None, timeout=None):
         """
-        Initializes the PdfEdit class. Currently, there's no specific initialization needed.
+        Initializes the batch runner.
+
+        :param workers: Number of worker processes, defaults to the number of CPUs.
+        :param timeout: Seconds a single job may run before it is failed, None for no limit.
+                        Needs SIGALRM, so it isn't available on Windows.
+        :raises ValueError: If a timeout is given on a platform without SIGALRM.
         """
-        pass
-        
-    def merge(self, file_paths, output_path, overwrite_confirm):
+        _check_job_timeout(timeout)
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+
+    def jobs_from_glob(self, pattern, operation, output_dir, group_size=None, **params):
         """
-        Merges multiple PDF files into a single PDF file.
+        Builds one job per file matching a glob pattern (or one job per group of files for merge).
+        Outputs are written to 'output_dir' under the input's path relative to the pattern's
+        root (the part before the first wildcard), so "a/x.pdf" and "b/x.pdf" matched by
+        "scans/**/*.pdf" don't overwrite each other. Merges are named merged_0001.pdf,
+        merged_0002.pdf and so on.
 
-        This method combines the contents of multiple PDF files specified in 'file_paths'
-        into a single PDF file saved at 'output_path'. If the output file already exists,
-        it prompts the user for confirmation before overwriting, depending on the
-        'overwrite_confirm' parameter.
+        :param pattern: Glob pattern of the input files, e.g. "scans/**/*.pdf".
+        :param operation: The PdfEdit operation to run on each file.
+        :param output_dir: Directory where the outputs will be saved.
+        :param group_size: For merge, how many files go into each merged output (default: all of them).
+        :param params: Extra job keys, e.g. page_range, watermark_text or password.
+        :return: A list of job dicts.
+        :raises ValueError: If the operation is unknown.
+        """
+        if operation not in self.OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+        file_paths = sorted(glob.glob(pattern, recursive=True))
+        # The pattern's root is the directory part before the first wildcard
+        wildcard = re.search(r"[*?[]", pattern)
+        root = os.path.dirname(pattern[:wildcard.start()] if wildcard else pattern)
+        jobs = []
+        if operation == "merge":
+            group_size = group_size or len(file_paths) or 1
+            for number, start in enumerate(range(0, len(file_paths), group_size), start=1):
+                output = os.path.join(output_dir, f"merged_{number:04d}.pdf")
+                jobs.append(dict(params, operation=operation, inputs=file_paths[start:start + group_size], output=output))
+        else:
+            for file_path in file_paths:
+                output = os.path.join(output_dir, os.path.relpath(file_path, root or os.curdir))
+                jobs.append(dict(params, operation=operation, input=file_path, output=output))
+        return jobs
 
-        :param file_paths: A list of file paths for the PDFs to be merged.
-        :param output_path: The file path where the merged PDF will be saved.
-        :param overwrite_confirm: A callback function to confirm file overwrite.
-        :raises ValueError: If less than two files are provided.
-        :raises FileExistsError: If the output file exists and overwrite is not confirmed.
-        :raises IOError: For issues in reading source files or writing the output file.
+    def jobs_from_manifest(self, manifest_path):
         """
-        if len(file_paths) < 2:
-            # Ensure atleast 2 files are provided
-            raise ValueError("Need at least two files to perform merging")
+        Reads jobs from a JSON manifest, either a list of job dicts or {"jobs": [...]}.
 
-        if os.path.exists(output_path) and not self.confirm_overwrite(output_path):
-            # Check if output file exists and confirm overwrite if necessary (and if No)
-            raise FileExistsError(f"Merge cancelled: {output_path} already exists")
+        :param manifest_path: Path to the JSON manifest.
+        :return: A list of job dicts.
+        :raises ValueError: If a job has an unknown operation.
+        """
+        with open(manifest_path, "r", encoding="utf-8") as manifest:
+            jobs = json.load(manifest)
+        if isinstance(jobs, dict):
+            jobs = jobs["jobs"]
+        for job in jobs:
+            if job.get("operation") not in self.OPERATIONS:
+                raise ValueError(f"Unknown operation in manifest: {job.get('operation')}")
+        return jobs
 
-        pdf_writer = PdfWriter() # Used to create a new PDF file
-        for file_path in file_paths: # Loop through each file chosen
-            try:
-                pdf_reader = PdfReader(file_path) # Read each file to access contents like pages
-                for page in pdf_reader.pages:
-                    pdf_writer.add_page(page) # Add each page to the new PDF of this file
-            except Exception as e:
-                # Raise an error if any of the files cannot be read
-                raise IOError(f"Failed to process {file_path}. Error: {e}")
+    def run(self, jobs):
+        """
+        Runs the jobs across the process pool and summarizes how it went.
+        A job that fails (corrupt input, wrong password, timeout...) is reported and
+        doesn't affect the other jobs.
 
-        try:
-            # Writing the merged content to an output file
-            with open(output_path, 'wb') as out: # 'wb' = binary write, writing binary data 
-                pdf_writer.write(out)
-        except Exception as e:
-            # Raise an error if file cannot be written
-            raise IOError(f"Failed to write merged file. Error: {e}")
-        
-    def split(self, file_path, page_range, output_path):
+        A job that takes its worker process down (a crash in a C extension, the OS killing
+        it...) breaks the whole pool. The jobs that were handed to the pool but hadn't
+        finished are then run again one at a time, each in a pool of its own, so only the
+        one that takes its worker down again fails; the rest carry on in a fresh pool.
+
+        :param jobs: A list of job dicts.
+        :return: A dict with the number of jobs, succeeded and failed counts, the list of
+                 failures (job and error), total pages, wall_time in seconds, pages_per_sec
+                 and the per-job results.
         """
-        Splits a PDF file based on the provided page range and saves it to a new file.
+        start = time.perf_counter()
+        for job in jobs:
+            output_dir = os.path.dirname(job.get("output", ""))
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        from concurrent.futures.process import BrokenProcessPool
+        results = [None] * len(jobs)
+        pending = list(range(len(jobs)))[::-1] # Indexes of the jobs not handed to a pool yet, next one last
+        suspects = [] # Jobs that were in a pool when it broke, run one at a time
+        while pending or suspects:
+            if suspects:
+                index = suspects.pop(0)
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    try:
+                        results[index] = pool.submit(_run_batch_job, jobs[index], self.timeout).result()
+                    except Exception as e:
+                        # Only happens if the worker process itself died (e.g. crashed or was killed)
+                        results[index] = {"job": jobs[index], "ok": False, "pages": 0, "seconds": 0.0,
+                                          "error": f"{type(e).__name__}: {e}"}
+                continue
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                running = {} # future -> job index
+                broken = False
+                while (pending or running) and not broken:
+                    # Only a few jobs are handed over at a time, so a broken pool takes few down with it
+                    while pending and len(running) < self.workers * 2:
+                        index = pending.pop()
+                        running[pool.submit(_run_batch_job, jobs[index], self.timeout)] = index
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = running.pop(future)
+                        try:
+                            results[index] = future.result()
+                        except BrokenProcessPool:
+                            suspects.append(index)
+                            broken = True
+                        except Exception as e: # The job couldn't be handed over (e.g. it can't be pickled)
+                            results[index] = {"job": jobs[index], "ok": False, "pages": 0, "seconds": 0.0,
+                                              "error": f"{type(e).__name__}: {e}"}
+                if broken:
+                    # Every job still in the pool fails with it, whichever one took the worker down
+                    suspects.extend(running.values())
+        wall_time = time.perf_counter() - start
 
-        :param file_path: Path to the PDF file to split.
-        :param page_range: Page range to split (e.g., "1-3, 5, 7").
-        :param output_path: Path where the split PDF will be saved.
-        :raises IOError: If there's an issue reading the input file or writing the output file.
-        :raises ValueError: If the page range is invalid or out of bounds.
+        pages = sum(result["pages"] for result in results)
+        failures = [{"job": result["job"], "error": result["error"]} for result in results if not result["ok"]]
+        return {
+            "jobs": len(results),
+            "succeeded": len(results) - len(failures),
+            "failed": len(failures),
+            "failures": failures,
+            "pages": pages,
+            "wall_time": wall_time,
+            "pages_per_sec": pages / wall_time if wall_time > 0 else 0.0,
+            "results": results,
+        }
+
+
+class PdfWatcher:
+    """
+    Watches folders that files get dropped into (e.g. by scanners) and runs PdfBatch style
+    jobs on them, for use as a long-running daemon. The folders are polled, which works the
+    same on every platform and on network shares.
+
+    Each rule is a dict with the "folder" to watch, the "operation" to run (one of
+    PdfBatch.OPERATIONS, split needs a "page_range"), its "output_dir", and the keys that
+    operation needs, as in a PdfBatch job (e.g. "watermark_text" or "password"). Optional
+    keys are the rule's "name" (defaults to the folder's name), the file "pattern" ("*.pdf"),
+    and the "processed_dir" where inputs are moved once done (the folder's "processed"
+    subfolder). Merge rules merge "batch_size" files at a time (10), or every file waiting
+    once the oldest has waited "batch_wait" seconds (60). A merge needs two files, so a
+    file left on its own after batch_wait is moved to the dead letter folder.
+
+    Scanners often reuse file names, so outputs, processed inputs and dead letters never
+    overwrite a file already there: a counter is added to the name instead ("scan_1.pdf").
+
+    A file is only picked up once its size and modification time have stayed the same for
+    settle_seconds, so files still being copied in are left alone. At most max_queue jobs
+    are handed to the worker pool at once; files beyond that wait in their folder, so a
+    burst of files never piles up in memory. The inputs of a failed job are moved to the
+    dead letter folder, under the rule's name, each with a .error.json describing the job
+    and the error.
+    """
+    def __init__(self, rules, dead_letter_dir, status_path=None, workers=None, max_queue=None, settle_seconds=2.0,
+                 poll_interval=1.0, timeout=None):
         """
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
+        :param rules: List of rule dicts, see above.
+        :param dead_letter_dir: Directory where the inputs of failed jobs are moved.
+        :param status_path: Path to a JSON file rewritten after every poll with the queue
+                            depth and throughput (see status), None for no status file.
+        :param workers: Number of worker processes, defaults to the number of CPUs.
+        :param max_queue: Most jobs handed to the pool at once, defaults to twice the workers.
+        :param settle_seconds: How long a file must stay unchanged before it is picked up.
+        :param poll_interval: Seconds between polls in run.
+        :param timeout: Seconds a single job may run before it is failed, None for no limit.
+                        Needs SIGALRM, so it isn't available on Windows.
+        :raises ValueError: If a rule has no folder or output_dir, or an unknown operation,
+                            or a timeout is given on a platform without SIGALRM.
+        """
+        _check_job_timeout(timeout)
+        for rule in rules:
+            if not rule.get("folder") or not rule.get("output_dir"):
+                raise ValueError("Every rule needs a folder and an output_dir")
+            if rule.get("operation") not in PdfBatch.OPERATIONS:
+                raise ValueError(f"Unknown operation in rule: {rule.get('operation')}")
+        self.rules = rules
+        self.dead_letter_dir = dead_letter_dir
+        self.status_path = status_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or self.workers * 2
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.timeout = timeout
 
-        # Logic to handle the page range written in helper function _split_pdf
-        self._split_pdf(pdf_reader, page_range, pdf_writer)
+        self._pool = None # Started on the first job
+        self._seen = {} # path -> (size, mtime, time it last changed)
+        self._ready = [[] for _ in rules] # Per rule, [path, time it became ready] of settled files, oldest first
+        self._claimed = set() # Paths that are ready or in a running job
+        self._crashed = set() # Paths whose job took its worker process down once already
+        self._running = {} # future -> (rule index, job)
+        self._started = time.time()
+        self._totals = {"succeeded": 0, "failed": 0, "pages": 0}
+        self._recent = [] # (time, pages) of the jobs finished in the last minute
+        self._merge_counter = 0
+
+    @classmethod
+    def from_config(cls, config_path):
+        """
+        Creates a watcher from a JSON config file holding "rules", "dead_letter_dir" and
+        optionally any other argument of __init__.
+
+        :param config_path: Path to the JSON file.
+        :return: A PdfWatcher.
+        """
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            return cls(**json.load(config_file))
+
+    def run(self, stop_event=None):
+        """
+        Polls until the stop event is set (or forever), then waits for the running jobs.
 
+        :param stop_event: A threading.Event (or anything with is_set() and wait()), None to run until interrupted.
+        """
+        stop_event = stop_event or threading.Event()
         try:
-            # Write the split PDF to file
-            with open(output_path, "wb") as out:
-                pdf_writer.write(out)
-        except Exception as e:
-            raise IOError(f"Failed to write split file. Error: {e}")
+            while not stop_event.is_set():
+                self.poll()
+                stop_event.wait(self.poll_interval)
+        finally:
+            self.close()
 
-    def _split_pdf(self, pdf_reader, page_range, pdf_writer):
+    def close(self):
         """
-        Helper function to handle the splitting based on the range given.
+        Waits for the running jobs to finish, handles their results and shuts the pool down.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._collect()
+            self._pool = None
+        self._write_status()
 
-        :param pdf_reader: PdfReader object of the PDF to split.
-        :param page_range: A string specifying the page range, e.g., "1-3, 5, 7".
-        :param pdf_writer: PdfWriter object to add the split pages to.
-        :raises ValueError: If the page range is invalid or out of bounds.
+    def poll(self):
         """
-        # Splitting the page_range string into individual page numbers and ranges
-        ranges = page_range.split(",")
-        total_pages = len(pdf_reader.pages) # For conditionals to raise error later
+        Does one round: handles finished jobs, looks for settled files and starts as many
+        jobs as the queue allows.
 
-        for r in ranges: # Loop through each unit of entry (page number or range)
-            r = r.strip() # remove leading and trailing whitespace
-            if "-" in r: 
-                # Processing a range of pages unit
-                start, end = map(int, r.split("-"))
-                if start <= end and 1 <= start <= total_pages and 1 <= end <= total_pages:
-                    for page_num in range(start - 1, end):  # -1 to account for 0-indexing
-                        pdf_writer.add_page(pdf_reader.pages[page_num])
-                else:
-                    raise ValueError("Invalid page range")
+        :return: The status dict, see status.
+        """
+        self._collect()
+        now = time.time()
+        listed = set()
+        for index, rule in enumerate(self.rules):
+            listed.update(self._scan(index, rule, now))
+        # Forget files that went away before they settled
+        self._seen = {path: seen for path, seen in self._seen.items() if path in listed or path in self._claimed}
+        for index, rule in enumerate(self.rules):
+            self._dispatch(index, rule, now)
+        return self._write_status()
+
+    def status(self):
+        """
+        :return: A dict with waiting (files not settled yet), queued (settled files waiting for
+                 a job), running, queue_depth (queued + running), succeeded, failed, pages,
+                 jobs_per_minute and pages_per_sec over the last minute, uptime in seconds,
+                 and per rule its queued and running counts.
+        """
+        now = time.time()
+        self._recent = [(finished, pages) for finished, pages in self._recent if now - finished < 60]
+        queued = sum(len(ready) for ready in self._ready)
+        running_per_rule = [0] * len(self.rules)
+        for index, _ in self._running.values():
+            running_per_rule[index] += 1
+        return {
+            "updated": now,
+            "uptime": now - self._started,
+            "waiting": len(self._seen) - len(self._claimed & set(self._seen)),
+            "queued": queued,
+            "running": len(self._running),
+            "queue_depth": queued + len(self._running),
+            "succeeded": self._totals["succeeded"],
+            "failed": self._totals["failed"],
+            "pages": self._totals["pages"],
+            "jobs_per_minute": len(self._recent),
+            "pages_per_sec": sum(pages for _, pages in self._recent) / 60,
+            "rules": {self._rule_name(rule): {"queued": len(self._ready[index]), "running": running_per_rule[index]}
+                      for index, rule in enumerate(self.rules)},
+        }
+
+    def _rule_name(self, rule):
+        return rule.get("name") or os.path.basename(os.path.normpath(rule["folder"]))
+
+    def _scan(self, index, rule, now):
+        """
+        Helper function looking at a rule's folder, queueing the files that have settled.
+
+        :param index: Index of the rule.
+        :param rule: The rule dict.
+        :param now: Time of this poll.
+        :return: The paths found in the folder.
+        """
+        paths = sorted(glob.glob(os.path.join(rule["folder"], rule.get("pattern", "*.pdf"))))
+        for path in paths:
+            if path in self._claimed:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # Moved away between the listing and now
+            seen = self._seen.get(path)
+            if seen is None or seen[:2] != (stat.st_size, stat.st_mtime_ns):
+                self._seen[path] = (stat.st_size, stat.st_mtime_ns, now) # New, or still being written
+            elif now - seen[2] >= self.settle_seconds:
+                self._claimed.add(path)
+                self._ready[index].append([path, now])
+        return paths
+
+    def _dispatch(self, index, rule, now):
+        """
+        Helper function starting jobs for a rule's settled files, while the queue has room.
+
+        :param index: Index of the rule.
+        :param rule: The rule dict.
+        :param now: Time of this poll.
+        """
+        ready = self._ready[index]
+        if rule["operation"] == "merge" and len(ready) == 1 and now - ready[0][1] >= rule.get("batch_wait", 60):
+            # Nothing came to merge it with, so it needs someone to look at it (no job, no queue slot)
+            path = ready.pop(0)[0]
+            self._totals["failed"] += 1
+            self._move_inputs(rule, [path], {"inputs": [path]},
+                              "Merge needs at least two files, no other file arrived within batch_wait")
+        while ready and len(self._running) < self.max_queue:
+            if rule["operation"] == "merge":
+                batch_size = rule.get("batch_size", 10)
+                timed_out = now - ready[0][1] >= rule.get("batch_wait", 60)
+                if len(ready) < 2 or (len(ready) < batch_size and not timed_out):
+                    return # Wait for more files
+                inputs = [path for path, _ in ready[:batch_size]]
+                self._merge_counter += 1
+                stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+                output = _unique_path(os.path.join(rule["output_dir"], f"merged_{stamp}_{self._merge_counter:04d}.pdf"))
+                job = {"inputs": inputs, "output": output}
             else:
-                # Processing a single page unit
-                page_num = int(r) - 1  # -1 to account for 0-indexing
-                if 1 <= page_num + 1 <= total_pages:
-                    pdf_writer.add_page(pdf_reader.pages[page_num])
-                else:
-                    raise ValueError("Page number out of range")
+                inputs = [ready[0][0]]
+                # Outputs of running jobs don't exist yet, but are taken all the same
+                taken = {job["output"] for _, job in self._running.values()}
+                output = _unique_path(os.path.join(rule["output_dir"], os.path.basename(inputs[0])), taken)
+                job = {"input": inputs[0], "output": output}
+            del ready[:len(inputs)]
+            params = {key: value for key, value in rule.items()
+                      if key not in ("name", "folder", "pattern", "output_dir", "processed_dir", "batch_size", "batch_wait")}
+            job.update(params)
+            os.makedirs(rule["output_dir"], exist_ok=True)
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._running[self._pool.submit(_run_batch_job, job, self.timeout)] = (index, job)
 
-    def add_watermark(self, file_path, watermark_text, output_path):
+    def _collect(self):
         """
-        Adds a text watermark to each page of a PDF file.
-        By default, the watermark is configured to be placed in the bottom left 
-        corner of each page and it's tiny. 
+        Helper function handling the jobs that finished: moving their inputs to the rule's
+        processed folder, or to the dead letter folder if the job failed.
+        """
+        for future in [future for future in self._running if future.done()]:
+            index, job = self._running.pop(future)
+            rule = self.rules[index]
+            inputs = job["inputs"] if "inputs" in job else [job["input"]]
+            try:
+                result = future.result()
+            except BaseException as e:
+                # The worker process died (crashed, was killed or interrupted) rather than the job
+                # failing, and the pool can't be used any more. Inputs get a second chance before
+                # they are taken for the cause, and an interrupted daemon leaves them where they were
+                result = {"job": job, "ok": False, "pages": 0, "error": f"{type(e).__name__}: {e}"}
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                if not self._crashed.intersection(inputs):
+                    self._crashed.update(inputs)
+                    for path in inputs:
+                        self._claimed.discard(path)
+                        self._seen.pop(path, None)
+                    continue
+            if result["ok"]:
+                self._totals["succeeded"] += 1
+                self._totals["pages"] += result["pages"]
+                self._recent.append((time.time(), result["pages"]))
+            else:
+                self._totals["failed"] += 1
+                self._recent.append((time.time(), 0))
+            self._move_inputs(rule, inputs, job, None if result["ok"] else result["error"])
 
-        :param file_path: Path to the PDF file to be watermarked.
-        :param watermark_text: Text to use as the watermark.
-        :param output_path: Path where the watermarked PDF will be saved.
-        :raises IOError: If there's an issue reading the input file or writing the output file.
+    def _move_inputs(self, rule, inputs, job, error):
         """
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
+        Helper function moving a job's inputs to the rule's processed folder, or to the dead
+        letter folder with a .error.json next to each if it failed, and forgetting them.
 
-        for page_number in range(len(pdf_reader.pages)): # Loop through each page in file
-            packet = BytesIO() # Simulates a file in RAM, used for binary data
-            can = canvas.Canvas(packet, pagesize=letter) # Create a PF canvas where you can draw/write on
-            can.drawString(100, 100, watermark_text) # Drawing a string of text onto a PDF canvas
-            can.save() 
-            packet.seek(0) # Upon writing, need to move back to start of the buffer to read or save to an actual file
-            new_pdf = PdfReader(packet)
-            page = pdf_reader.pages[page_number] # Retrieve specific page in this loop 
-            page.merge_page(new_pdf.pages[0]) # Merge watermark onto selected page 
-            pdf_writer.add_page(page)
+        :param rule: The rule dict.
+        :param inputs: Paths of the job's inputs.
+        :param job: The job dict, written to the .error.json without its password.
+        :param error: The error message, None if the job succeeded.
+        """
+        if error is None:
+            target_dir = rule.get("processed_dir") or os.path.join(rule["folder"], "processed")
+        else:
+            target_dir = os.path.join(self.dead_letter_dir, self._rule_name(rule))
+        os.makedirs(target_dir, exist_ok=True)
+        for path in inputs:
+            self._claimed.discard(path)
+            self._crashed.discard(path)
+            self._seen.pop(path, None)
+            target = _unique_path(os.path.join(target_dir, os.path.basename(path)))
+            try:
+                shutil.move(path, target)
+            except FileNotFoundError:
+                continue # Taken away by someone else in the meantime
+            if error is not None:
+                # Never write passwords next to the files
+                safe_job = {key: value for key, value in job.items() if key != "password"}
+                with open(target + ".error.json", "w", encoding="utf-8") as error_file:
+                    json.dump({"job": safe_job, "error": error, "failed_at": time.time()}, error_file, indent=2)
 
-        try:
-            with open(output_path, "wb") as out:
-                pdf_writer.write(out)
-        except Exception as e:
-            raise IOError(f"Failed to write watermarked file. Error: {e}")
+    def _write_status(self):
+        """
+        Helper function writing the status file, if any, in one step.
 
-    def encrypt_pdf(self, file_path, password, output_path):
+        :return: The status dict.
         """
-        Encrypts a PDF file with user given password.
+        status = self.status()
+        if self.status_path:
+            part_path = f"{self.status_path}.part"
+            with open(part_path, "w", encoding="utf-8") as status_file:
+                json.dump(status, status_file, indent=2)
+            os.replace(part_path, self.status_path)
+        return status
 
-        :param file_path: Path to the PDF file to be encrypted.
-        :param password: Password for encrypting the PDF.
-        :param output_path: Path where the encrypted PDF will be saved.
-        :raises IOError: If there's an issue reading the input file or writing the output file.
+
+class PdfEditBusy(Exception):
+    """
+    Raised by AsyncPdfEdit when too many calls are already waiting for a free slot.
+    """
+
+
+def _call_pdf_edit(method_name, args, kwargs, cancel_event, document_cache=None):
+    """
+    Runs one PdfEdit operation for AsyncPdfEdit, inside its executor (thread or process).
+
+    :param method_name: Name of the PdfEdit method, e.g. "split".
+    :param args: Positional arguments for the method.
+    :param kwargs: Keyword arguments for the method.
+    :param cancel_event: threading.Event to stop the operation early, None if it can't be cancelled.
+    :param document_cache: DocumentCache to get parsed inputs from, if any.
+    :return: Whatever the method returns.
+    """
+    pdf_edit = PdfEdit(cancel_event=cancel_event, document_cache=document_cache)
+    return getattr(pdf_edit, method_name)(*args, **kwargs)
+
+
+class AsyncPdfEdit:
+    """
+    Asyncio version of PdfEdit for use from async code such as web services.
+
+    Each operation runs in an executor, so the event loop is never blocked by parsing,
+    page work or file I/O. At most 'max_concurrency' operations run at once, further calls
+    wait their turn, and once 'max_pending' calls are waiting new ones are refused with
+    PdfEditBusy instead of piling up. Cancelling the awaiting task (e.g. with a timeout)
+    stops the operation at its next page, and it doesn't write its output.
+
+    Like PdfEdit, operations take bytes as well as paths and return the output as bytes
+    when output_path is None, e.g. for a PDF received in a request. Streams can only be
+    passed with a thread pool executor, they can't be sent to worker processes.
+    """
+    def __init__(self, max_concurrency=4, max_pending=None, executor=None, document_cache=None):
         """
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
+        :param max_concurrency: Most operations running at the same time.
+        :param max_pending: Most calls allowed to wait for a free slot, None for no limit.
+        :param executor: concurrent.futures executor to run operations in. Defaults to a thread pool.
+                         A ProcessPoolExecutor sidesteps the GIL for CPU-heavy loads, but an
+                         operation that has already started in it can't be cancelled.
+        :param document_cache: DocumentCache shared by the operations. Only used with thread
+                               executors, worker processes can't share parsed documents.
+        """
+        self.document_cache = document_cache
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None # Created on first use, so it belongs to the running event loop
+        self._pending = 0 # Calls waiting for a free slot
+
+    async def merge(self, file_paths, output_path, overwrite_confirm=True, **options):
+        """
+        Async version of PdfEdit.merge. 'overwrite_confirm' must be True/False, not a callback.
+        A page_index can only be passed with a thread pool executor.
+        """
+        return await self._run("merge", file_paths, output_path, overwrite_confirm, **options)
 
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
+    async def merge_streaming(self, file_paths, output_path, overwrite_confirm=True, **options):
+        """
+        Async version of PdfEdit.merge_streaming.
+        """
+        return await self._run("merge_streaming", file_paths, output_path, overwrite_confirm, **options)
 
-        pdf_writer.encrypt(password) 
+    async def split(self, file_path, page_range, output_path):
+        """
+        Async version of PdfEdit.split.
+        """
+        return await self._run("split", file_path, page_range, output_path)
 
-        try:
-            with open(output_path, "wb") as out:
-                pdf_writer.write(out)
-        except Exception as e:
-            raise IOError(f"Failed to write encrypted file. Error: {e}")
+    async def split_many(self, file_path, **options):
+        """
+        Async version of PdfEdit.split_many.
+        """
+        return await self._run("split_many", file_path, **options)
 
-    def decrypt_pdf(self, file_path, password, output_path):
+    async def add_watermark(self, file_path, watermark_text, output_path, **options):
         """
-        Decrypts a PDF file with the given password.
+        Async version of PdfEdit.add_watermark.
+        """
+        return await self._run("add_watermark", file_path, watermark_text, output_path, **options)
 
-        :param file_path: Path to the encrypted PDF file.
-        :param password: Password for decrypting the PDF.
-        :param output_path: Path where the decrypted PDF will be saved.
-        :raises IOError: If there's an issue reading the input file or writing the output file.
+    async def stamp_pages(self, file_paths, text, output_path, **options):
         """
-        pdf_reader = PdfReader(file_path)
-        pdf_reader.decrypt(password)
-        pdf_writer = PdfWriter()
+        Async version of PdfEdit.stamp_pages.
+        """
+        return await self._run("stamp_pages", file_paths, text, output_path, **options)
+
+    async def edit_metadata(self, file_path, metadata, output_path, **options):
+        """
+        Async version of PdfEdit.edit_metadata.
+        """
+        return await self._run("edit_metadata", file_path, metadata, output_path, **options)
+
+    async def optimize(self, file_path, output_path, **options):
+        """
+        Async version of PdfEdit.optimize.
+        """
+        return await self._run("optimize", file_path, output_path, **options)
+
+    async def encrypt_pdf(self, file_path, password, output_path):
+        """
+        Async version of PdfEdit.encrypt_pdf.
+        """
+        return await self._run("encrypt_pdf", file_path, password, output_path)
+
+    async def encrypt_many(self, file_path, recipients, **options):
+        """
+        Async version of PdfEdit.encrypt_many.
+        """
+        return await self._run("encrypt_many", file_path, recipients, **options)
+
+    async def decrypt_pdf(self, file_path, password, output_path):
+        """
+        Async version of PdfEdit.decrypt_pdf.
+        """
+        return await self._run("decrypt_pdf", file_path, password, output_path)
+
+    async def close(self):
+        """
+        Shuts down the executor, waiting for running operations to finish.
+        """
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
 
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
+    async def _run(self, method_name, *args, **kwargs):
+        """
+        Helper function running a PdfEdit method in the executor, within the concurrency limit.
 
+        :param method_name: Name of the PdfEdit method.
+        :return: Whatever the method returns.
+        :raises PdfEditBusy: If max_pending calls are already waiting.
+        """
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked():
+            if self.max_pending is not None and self._pending >= self.max_pending:
+                raise PdfEditBusy(f"{self._pending} operations already waiting")
+        self._pending += 1
         try:
-            with open(output_path, "wb") as out:
-                pdf_writer.write(out)    
-        except Exception as e:
-            raise IOError(f"Failed to write decrypted file. Error: {e}")
+            await self._semaphore.acquire()
+        finally:
+            self._pending -= 1
+
+        try:
+            # Threading events and parsed documents can't be sent to another process
+            in_process = isinstance(self.executor, ProcessPoolExecutor)
+            cancel_event = None if in_process else threading.Event()
+            document_cache = None if in_process else self.document_cache
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, _call_pdf_edit, method_name, args, kwargs,
+                                          cancel_event, document_cache)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Ask the operation to stop, and keep the slot until it really has
+                if cancel_event is not None:
+                    cancel_event.set()
+                else:
+                    future.cancel() # Only stops it if it hasn't started yet
+                try:
+                    await future
+                except (asyncio.CancelledError, Exception):
+                    pass # Expected, usually OperationCancelled
+                raise
+        finally:
+            self._semaphore.release()
+
+
+def _import_tkinter():
+    """
+    Imports tkinter and the tkinter modules PdfGui uses, binding them to the module level
+    names tk, filedialog, messagebox, simpledialog and ttk. Only the GUI needs them, so they
+    aren't imported until it starts.
+    """
+    global tk, filedialog, messagebox, simpledialog, ttk
+    import tkinter as tk
+    from tkinter import filedialog
+    from tkinter import messagebox
+    from tkinter import simpledialog
+    from tkinter import ttk
+
 
 class PdfGui:
     """
@@ -202,11 +4488,12 @@ class PdfGui:
 
         :param root: The main window for the tkinter GUI, typically an instance of tk.Tk()
         """
+        _import_tkinter()
         self.root = root
         root.title("PDF Editor")
 
         # Setting window size
-        root.geometry("300x445")
+        root.geometry("300x530")
 
         # Creating a button
         # command as self.merge, the function merge is called which belong to PdfGui class
@@ -227,6 +4514,25 @@ class PdfGui:
         self.decrypt_button = tk.Button(root, text="Decrypt PDF", command=self.decrypt_pdf, width=40, height=5)
         self.decrypt_button.pack()
 
+        # Operations run on a background thread so the window keeps responding,
+        # these show how far along it is and allow stopping it
+        self.progress_bar = ttk.Progressbar(root, orient="horizontal", length=280, mode="determinate")
+        self.progress_bar.pack(pady=(8, 0))
+        self.status_label = tk.Label(root, text="Ready")
+        self.status_label.pack()
+        self.cancel_button = tk.Button(root, text="Cancel", command=self.cancel, width=20, state="disabled")
+        self.cancel_button.pack()
+
+        self.operation_buttons = [self.merge_button, self.split_button, self.watermark_button,
+                                  self.encrypt_button, self.decrypt_button]
+        self.worker = None # Thread running the current operation, if any
+        self.cancel_event = None # Set to ask the running operation to stop
+        self.started = None # When the running operation started, for pages/sec
+        # Messages from the worker thread. Tk may only be touched from the main thread,
+        # so the worker puts progress and results here and _poll_worker picks them up
+        self.updates = queue.Queue()
+        root.protocol("WM_DELETE_WINDOW", self.close)
+
     def confirm_overwrite(self, file_path):
         """
         Confirms with the user whether to overwrite an existing file.
@@ -237,6 +4543,116 @@ class PdfGui:
         # GUI version using Tkinter's messagebox
         return messagebox.askyesno("Overwrite File", f"The file {file_path} already exists. Do you want to overwrite it?")
 
+    def _run_in_background(self, run, success_message, failure_message):
+        """
+        Runs a PdfEdit operation on a background thread, showing its progress until it ends.
+
+        :param run: Function taking a PdfEdit and running the operation with it.
+        :param success_message: Message shown when the operation succeeds.
+        :param failure_message: Start of the message shown when it fails, the error is added after it.
+        """
+        self.cancel_event = threading.Event()
+        pdf_edit = PdfEdit(progress_callback=self._report_progress, cancel_event=self.cancel_event)
+        for button in self.operation_buttons: # One operation at a time
+            button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_bar.config(mode="determinate", value=0)
+        self.status_label.config(text="Working...")
+        self.started = time.perf_counter()
+
+        self.worker = threading.Thread(target=self._work, args=(run, pdf_edit), daemon=True)
+        self.worker.start()
+        self.root.after(100, self._poll_worker, success_message, failure_message)
+
+    def _work(self, run, pdf_edit):
+        """
+        Body of the background thread: runs the operation and reports how it ended.
+
+        :param run: Function taking a PdfEdit and running the operation with it.
+        :param pdf_edit: PdfEdit set up to report progress and watch for cancellation.
+        """
+        try:
+            run(pdf_edit)
+            self.updates.put(("done", None))
+        except Exception as e:
+            self.updates.put(("error", e))
+
+    def _report_progress(self, done, total):
+        """
+        Progress callback for PdfEdit, called on the background thread after each page.
+
+        :param done: Number of pages done so far.
+        :param total: Total number of pages, or None if not known.
+        """
+        self.updates.put(("progress", (done, total)))
+
+    def _poll_worker(self, success_message, failure_message):
+        """
+        Checks on the background operation from the Tk main thread: updates the progress bar,
+        and once the operation ends shows the result and gets the window ready for the next one.
+
+        :param success_message: Message shown when the operation succeeds.
+        :param failure_message: Start of the message shown when it fails.
+        """
+        progress = None
+        outcome = None
+        while True: # Only the latest progress matters, skip over older ones
+            try:
+                kind, value = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress = value
+            else:
+                outcome = (kind, value)
+
+        if progress is not None and outcome is None:
+            done, total = progress
+            pages_per_sec = done / max(time.perf_counter() - self.started, 1e-6)
+            if total:
+                self.progress_bar.config(mode="determinate", maximum=total, value=done)
+                self.status_label.config(text=f"{done}/{total} pages, {pages_per_sec:.0f} pages/sec")
+            else:
+                # The total isn't known, so just keep the bar moving
+                self.progress_bar.config(mode="indeterminate")
+                self.progress_bar.step()
+                self.status_label.config(text=f"{done} pages, {pages_per_sec:.0f} pages/sec")
+
+        if outcome is None:
+            self.root.after(100, self._poll_worker, success_message, failure_message)
+            return
+
+        self.worker = None
+        for button in self.operation_buttons:
+            button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        self.progress_bar.config(mode="determinate", value=0)
+        self.status_label.config(text="Ready")
+        kind, error = outcome
+        if kind == "done":
+            messagebox.showinfo("Success", success_message)
+        elif isinstance(error, OperationCancelled):
+            messagebox.showinfo("Cancelled", "The operation was cancelled, no file was written.")
+        else:
+            messagebox.showerror("Error", f"{failure_message} Error: {error}")
+
+    def cancel(self):
+        """
+        Asks the running operation to stop. It stops at the next page, without writing its output.
+        """
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.status_label.config(text="Cancelling...")
+
+    def close(self):
+        """
+        Closes the window, first stopping a running operation so it doesn't leave temporary files behind.
+        """
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.worker.join(timeout=5)
+        self.root.destroy()
+
     def merge(self):
         """
         Handles the merging of PDF files. Opens a file dialog for the user to select multiple PDF files,
@@ -262,15 +4678,16 @@ class PdfGui:
             messagebox.showwarning("No Output File Selected", "Please select an output file.")
             return
 
-        pdf_edit = PdfEdit()
-        try:
-            # Pass the confirm_overwrite function to PdfEdit
-            pdf_edit.merge(file_paths, output_path, self.confirm_overwrite)
-            messagebox.showinfo("Success", f"PDF files have been merged into {output_path}")
-        except FileExistsError as e: # Error with file already exists
-            messagebox.showinfo("Merge Cancelled", str(e))
-        except Exception as e: # Any other error
-            messagebox.showerror("Error", f"Failed to merge files. Error: {e}")
+        # Ask about overwriting here, dialogs can't be shown from the background thread
+        if os.path.exists(output_path) and not self.confirm_overwrite(output_path):
+            messagebox.showinfo("Merge Cancelled", f"Merge cancelled: {output_path} already exists")
+            return
+
+        self._run_in_background(
+            lambda pdf_edit: pdf_edit.merge(file_paths, output_path, overwrite_confirm=True),
+            f"PDF files have been merged into {output_path}",
+            "Failed to merge files."
+        )
 
 
     def split(self):
@@ -301,12 +4718,11 @@ class PdfGui:
             messagebox.showwarning("No Output File Selected", "Please select an output file.")
             return
 
-        pdf_edit = PdfEdit()
-        try:
-            pdf_edit.split(file_path, page_range, output_path)
-            messagebox.showinfo("Success", f"PDF has been split and saved to {output_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to split file. Error: {e}")
+        self._run_in_background(
+            lambda pdf_edit: pdf_edit.split(file_path, page_range, output_path),
+            f"PDF has been split and saved to {output_path}",
+            "Failed to split file."
+        )
 
 
     def add_watermark(self):
@@ -337,12 +4753,11 @@ class PdfGui:
             messagebox.showwarning("No Output File Selected", "Please select an output file.")
             return
 
-        pdf_edit = PdfEdit()
-        try:
-            pdf_edit.add_watermark(file_path, watermark_text, output_path)
-            messagebox.showinfo("Success", f"Watermark added and saved to {output_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add watermark. Error: {e}")
+        self._run_in_background(
+            lambda pdf_edit: pdf_edit.add_watermark(file_path, watermark_text, output_path),
+            f"Watermark added and saved to {output_path}",
+            "Failed to add watermark."
+        )
 
 
     def encrypt_pdf(self):
@@ -373,12 +4788,11 @@ class PdfGui:
             messagebox.showwarning("No Output File Selected", "Please select an output file.")
             return
 
-        pdf_edit = PdfEdit()
-        try:
-            pdf_edit.encrypt_pdf(file_path, password, output_path)
-            messagebox.showinfo("Success", f"PDF has been encrypted and saved to {output_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to encrypt file. Error: {e}")
+        self._run_in_background(
+            lambda pdf_edit: pdf_edit.encrypt_pdf(file_path, password, output_path),
+            f"PDF has been encrypted and saved to {output_path}",
+            "Failed to encrypt file."
+        )
 
 
     def decrypt_pdf(self):
@@ -409,18 +4823,209 @@ class PdfGui:
             messagebox.showwarning("No Output File Selected", "Please select an output file.")
             return
 
-        pdf_edit = PdfEdit()
+        self._run_in_background(
+            lambda pdf_edit: pdf_edit.decrypt_pdf(file_path, password, output_path),
+            f"PDF has been decrypted and saved to {output_path}",
+            "Failed to decrypt file."
+        )
+
+
+def _build_parser():
+    """
+    Builds the command line parser, one subcommand per PdfEdit operation.
+
+    :return: An argparse.ArgumentParser.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="project.py", description="Edit PDF files. Run without arguments for the GUI.")
+    parser.add_argument("--optimize", action="store_true", help="run every output through the optimize stage")
+    parser.add_argument("--max-image-dpi", type=float, help="with --optimize, downsample images shown above this resolution")
+    parser.add_argument("--cache", dest="cache_dir", help="result cache directory: repeated operations copy their earlier output")
+    parser.add_argument("--linearize", action="store_true", help="write fast web view files, needs pikepdf")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    merge = commands.add_parser("merge", help="merge PDF files into one")
+    merge.add_argument("inputs", nargs="+", help="files to merge, in order")
+    merge.add_argument("-o", "--output", required=True, help="merged file")
+    merge.add_argument("-f", "--force", action="store_true", help="overwrite the output if it exists")
+    merge.add_argument("--duplicates", choices=("skip", "report"), help="leave out or only report duplicate pages")
+    merge.add_argument("--streaming", action="store_true", help="use merge_streaming, which shares fonts and images across files")
+
+    split = commands.add_parser("split", help="keep a range of pages")
+    split.add_argument("input")
+    split.add_argument("pages", help='page range, e.g. "1-3, 5, 7"')
+    split.add_argument("-o", "--output", required=True)
+
+    burst = commands.add_parser("burst", help="split a file into many parts (split_many)")
+    burst.add_argument("input")
+    parts = burst.add_mutually_exclusive_group(required=True)
+    parts.add_argument("--every", type=int, help="pages per part")
+    parts.add_argument("--at-bookmarks", action="store_true", help="start a part at every top level bookmark")
+    burst.add_argument("--output-dir", required=True)
+    burst.add_argument("--workers", type=int, default=1)
+
+    watermark = commands.add_parser("watermark", help="stamp a text watermark on every page")
+    watermark.add_argument("input")
+    watermark.add_argument("text")
+    watermark.add_argument("-o", "--output", required=True)
+    watermark.add_argument("--font", default="Helvetica", help="standard PDF font name")
+    watermark.add_argument("--size", type=float, default=12)
+    watermark.add_argument("--position", type=float, nargs=2, default=(100, 100), metavar=("X", "Y"))
+    watermark.add_argument("--incremental", action="store_true", help="append the change to the original file's bytes")
+    watermark.add_argument("--workers", type=int, default=1)
+
+    stamp = commands.add_parser("stamp", help="stamp numbered text such as Bates numbers on every page (stamp_pages)")
+    stamp.add_argument("inputs", nargs="+", help="files to stamp, numbered on from one to the next, saved as one file")
+    stamp.add_argument("-o", "--output", required=True)
+    stamp.add_argument("--text", default="{number:06d}", help='template, e.g. "ABC{number:06d}" or "Page {page} of {pages}"')
+    stamp.add_argument("--start", type=int, default=1, help="number stamped on the first page")
+    stamp.add_argument("--label", help='fixed line drawn above the stamp, e.g. "CONFIDENTIAL"')
+    stamp.add_argument("--font", default="Helvetica", help="standard PDF font name")
+    stamp.add_argument("--size", type=float, default=10)
+    stamp.add_argument("--position", type=float, nargs=2, default=(36, 24), metavar=("X", "Y"), help="distance from the anchor")
+    stamp.add_argument("--anchor", choices=PdfEdit.STAMP_ANCHORS, default="bottom-right")
+
+    for name, help_text in (("encrypt", "encrypt with a password"), ("decrypt", "decrypt with a password")):
+        crypt = commands.add_parser(name, help=help_text)
+        crypt.add_argument("input")
+        crypt.add_argument("-o", "--output", required=True)
+        crypt.add_argument("--password", help="asked for if left out, so it doesn't end up in the shell history")
+
+    encrypt_many = commands.add_parser("encrypt-many", help="encrypt one file for many recipients")
+    encrypt_many.add_argument("input")
+    encrypt_many.add_argument("manifest", help="CSV or JSON list of recipients, see PdfEdit.read_recipients")
+    encrypt_many.add_argument("--algorithm", choices=PdfEdit.ENCRYPTION_ALGORITHMS, default="AES-256")
+    encrypt_many.add_argument("--owner-password")
+    encrypt_many.add_argument("--workers", type=int, default=1)
+
+    metadata = commands.add_parser("metadata", help="set document information entries")
+    metadata.add_argument("input")
+    metadata.add_argument("-o", "--output", required=True)
+    metadata.add_argument("--set", action="append", required=True, metavar="KEY=VALUE", help='e.g. --set Title="Annual report"')
+    metadata.add_argument("--incremental", action="store_true", help="append the change to the original file's bytes")
+
+    optimize = commands.add_parser("optimize", help="make a file smaller")
+    optimize.add_argument("input")
+    optimize.add_argument("-o", "--output", required=True)
+    optimize.add_argument("--max-image-dpi", dest="image_dpi", type=float, help="downsample images shown above this resolution")
+
+    probe = commands.add_parser("probe", help="page count, page sizes and encryption of files, or of every PDF in directories")
+    probe.add_argument("paths", nargs="+")
+    probe.add_argument("--cache", help="JSON file keeping directory results between runs")
+    probe.add_argument("--workers", type=int, default=8)
+
+    index = commands.add_parser("index", help="add new and changed files to a text search index")
+    index.add_argument("database", help="SQLite file of the index")
+    index.add_argument("paths", nargs="+", help="files, or directories to look for PDF files in")
+    index.add_argument("--workers", type=int, default=1)
+
+    watch = commands.add_parser("watch", help="watch folders and run jobs on the files dropped into them, until interrupted")
+    watch.add_argument("config", help="JSON config with the rules, see PdfWatcher")
+
+    search = commands.add_parser("search", help="find the pages containing a phrase in a text search index")
+    search.add_argument("database")
+    search.add_argument("phrase")
+    search.add_argument("--raw", action="store_true", help="the phrase is an SQLite FTS5 query")
+    search.add_argument("--ranges", action="store_true", help="print a page range per file, ready for split")
+    return parser
+
+
+def _run_command(args):
+    """
+    Runs the command parsed by _build_parser. Reports and results are printed as JSON.
+
+    :param args: The parsed arguments.
+    """
+    result_cache = ResultCache(args.cache_dir) if args.cache_dir else None
+    pdf_edit = PdfEdit(optimize_output=args.optimize, max_image_dpi=args.max_image_dpi, result_cache=result_cache,
+                       linearize=args.linearize)
+    result = None
+    if args.command == "merge":
+        if args.streaming:
+            result = pdf_edit.merge_streaming(args.inputs, args.output, args.force)
+        else:
+            result = pdf_edit.merge(args.inputs, args.output, args.force, duplicates=args.duplicates)
+    elif args.command == "split":
+        pdf_edit.split(args.input, args.pages, args.output)
+    elif args.command == "burst":
+        result = pdf_edit.split_many(args.input, every=args.every, at_bookmarks=args.at_bookmarks,
+                                     output_dir=args.output_dir, workers=args.workers)
+    elif args.command == "watermark":
+        pdf_edit.add_watermark(args.input, args.text, args.output, font_name=args.font, font_size=args.size,
+                               position=tuple(args.position), incremental=args.incremental, workers=args.workers)
+    elif args.command == "stamp":
+        result = pdf_edit.stamp_pages(args.inputs, args.text, args.output, start=args.start, label=args.label,
+                                      font_name=args.font, font_size=args.size, position=tuple(args.position),
+                                      anchor=args.anchor)
+    elif args.command in ("encrypt", "decrypt"):
+        password = args.password
+        if password is None:
+            import getpass
+            password = getpass.getpass("Password: ")
+        if args.command == "encrypt":
+            pdf_edit.encrypt_pdf(args.input, password, args.output)
+        else:
+            pdf_edit.decrypt_pdf(args.input, password, args.output)
+    elif args.command == "encrypt-many":
+        result = pdf_edit.encrypt_many(args.input, pdf_edit.read_recipients(args.manifest), algorithm=args.algorithm,
+                                       owner_password=args.owner_password, workers=args.workers)
+    elif args.command == "metadata":
+        metadata = {}
+        for entry in args.set:
+            key, separator, value = entry.partition("=")
+            if not separator:
+                raise ValueError(f"Expected KEY=VALUE, got {entry}")
+            metadata["/" + key.lstrip("/")] = value
+        pdf_edit.edit_metadata(args.input, metadata, args.output, incremental=args.incremental)
+    elif args.command == "optimize":
+        result = pdf_edit.optimize(args.input, args.output, max_image_dpi=args.image_dpi)
+    elif args.command == "probe":
+        result = []
+        for path in args.paths:
+            if os.path.isdir(path):
+                result.extend(pdf_edit.probe_directory(path, workers=args.workers, cache_path=args.cache)["results"])
+            else:
+                result.append(pdf_edit.probe(path))
+    elif args.command == "watch":
         try:
-            pdf_edit.decrypt_pdf(file_path, password, output_path)
-            messagebox.showinfo("Success", f"PDF has been decrypted and saved to {output_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to decrypt file. Error: {e}")
+            PdfWatcher.from_config(args.config).run()
+        except KeyboardInterrupt:
+            pass # Running jobs were finished by run
+    elif args.command in ("index", "search"):
+        with TextIndex(args.database, workers=getattr(args, "workers", 1)) as text_index:
+            if args.command == "index":
+                result = text_index.update(args.paths)
+            elif args.ranges:
+                result = {path: page_range.text for path, page_range in text_index.search_ranges(args.phrase, args.raw).items()}
+            else:
+                result = [{"file": path, "page": page} for path, page in text_index.search(args.phrase, args.raw)]
+    if result_cache is not None:
+        result_cache.flush() # Hits only reorder the cache in memory
+    if result is not None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
 
 
-def main():
+def main(argv=None):
     """
-    The main function to initialize and run the tkinter GUI application.
+    The main function: runs a command given on the command line (see _build_parser, and
+    `python project.py --help`), or with no arguments initializes and runs the tkinter
+    GUI application.
+
+    :param argv: The command line arguments, defaults to sys.argv[1:].
+    :return: The exit status, 0 on success and 1 if the command failed.
     """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        args = _build_parser().parse_args(argv)
+        try:
+            _run_command(args)
+        except (IOError, ValueError) as e: # FileExistsError is an IOError too
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    _import_tkinter()
     # Creating main window for GUI application
     # tk.Tk() is a constructor that initializes a tkinter 'Tk' object which serves as main window
     root = tk.Tk()
@@ -433,4 +5038,4 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main()  
+    sys.exit(main())  
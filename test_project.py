@@ -1,8 +1,20 @@
-from pypdf import PdfReader
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+import asyncio
+import io
+import json
+import multiprocessing
 import os
+import re
+import subprocess
+import sys
+import threading
+import time
 from reportlab.pdfgen import canvas
 import pytest
-from project import PdfEdit
+import project
+from project import AsyncPdfEdit, DocumentCache, OperationCancelled, PageIndex, PageRange, PdfBatch, PdfEdit, PdfEditBusy, PdfPipeline, PdfWatcher, ResultCache, TextIndex, main
+from project import _run_batch_job
 
 ### Yet to test corner cases due to complexity of setting up test cases. 
 ### Did minimal but sufficient testing, including checking of existence of resulting file, and basic features
@@ -148,3 +160,1021 @@ def test_encrypt_decrypt(pdf_setupteardown):
 
     os.remove(encrypted_file)
     os.remove(decrypted_file)
+
+# Test for the watermark overlay cache
+def test_add_watermark_overlay_cache(tmp_path):
+    """
+    Test that the watermark overlay is rendered once per page size and sized from each page.
+
+    This test case watermarks a 3 page PDF with two different page sizes and checks that
+    only two overlays were rendered, and that the watermark text ends up on every page.
+    """
+    test_file = str(tmp_path / "sizes.pdf")
+    c = canvas.Canvas(test_file, pagesize=(612, 792))
+    c.drawString(100, 700, "Page one")
+    c.showPage()
+    c.drawString(100, 700, "Page two")
+    c.showPage()
+    c.setPageSize((842, 595)) # Landscape A4 for the last page
+    c.drawString(100, 500, "Page three")
+    c.save()
+    pdf_edit = PdfEdit()
+
+    output_file = str(tmp_path / "watermarked_sizes.pdf")
+    pdf_edit.add_watermark(test_file, "Cached Watermark", output_file)
+
+    assert len(pdf_edit._overlay_cache) == 2, "Overlay should be rendered once per page size"
+    watermarked_reader = PdfReader(output_file)
+    for page in watermarked_reader.pages:
+        assert "Cached Watermark" in page.extract_text(), "Watermark missing from a page"
+    assert float(watermarked_reader.pages[2].mediabox.width) == 842, "Page size changed by watermark"
+
+    pdf_edit.OVERLAY_CACHE_SIZE = 1
+    pdf_edit.add_watermark(test_file, "Another Watermark", output_file)
+    assert len(pdf_edit._overlay_cache) == 1, "Overlay cache should stay within its size"
+    assert "Another Watermark" in PdfReader(output_file).pages[2].extract_text()
+
+# Test for the streaming merge
+def test_merge_streaming(tmp_path):
+    """
+    Test that the streaming merge keeps every page and writes shared resources only once.
+
+    This test case merges three PDFs that all draw the same image and checks the page count,
+    the reported duplicates, and that the output is smaller than a plain merge.
+    """
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    logo = ImageReader(Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3))) # Same "logo" in every file
+    file_paths = []
+    for file_number in range(3):
+        file_path = str(tmp_path / f"report{file_number}.pdf")
+        c = canvas.Canvas(file_path)
+        for page_number in range(2):
+            c.drawImage(logo, 100, 600, 64, 64)
+            c.drawString(100, 750, f"Report {file_number} page {page_number}")
+            c.showPage()
+        c.save()
+        file_paths.append(file_path)
+    pdf_edit = PdfEdit()
+
+    plain_file = str(tmp_path / "merged.pdf")
+    streamed_file = str(tmp_path / "merged_streaming.pdf")
+    pdf_edit.merge(file_paths, plain_file, overwrite_confirm=True)
+    report = pdf_edit.merge_streaming(file_paths, streamed_file, overwrite_confirm=True)
+
+    streamed_reader = PdfReader(streamed_file)
+    assert len(streamed_reader.pages) == 6, "Pages in merged PDF don't match original PDFs"
+    assert "Report 2 page 1" in streamed_reader.pages[5].extract_text(), "Pages out of order"
+    assert report["duplicates_removed"] == 4, "Logo and font should be reused from the first file"
+    assert report["output_bytes"] == os.path.getsize(streamed_file)
+    assert report["output_bytes"] < os.path.getsize(plain_file), "Shared resources written more than once"
+    assert report["peak_memory"] is None, "Memory should only be traced when profiling"
+    profiled = PdfEdit(metrics_sink=lambda event: None, profile="tracemalloc")
+    assert profiled.merge_streaming(file_paths, streamed_file, overwrite_confirm=True)["peak_memory"] > 0
+
+    report = pdf_edit.merge_streaming(file_paths, streamed_file, overwrite_confirm=True, memory_budget=0)
+    assert report["duplicates_removed"] == 0 and report["fingerprints_dropped"] > 0, "Budget should drop every fingerprint"
+    assert len(PdfReader(streamed_file).pages) == 6
+    with pytest.raises(ValueError):
+        pdf_edit.merge_streaming(file_paths, streamed_file, overwrite_confirm=True, max_open_files=1)
+
+# Test for the memory use of the streaming merge
+def test_merge_streaming_memory(tmp_path, monkeypatch):
+    """
+    Test that the streaming merge's peak memory stays flat as the inputs grow, and that it
+    keeps at most one input open.
+
+    This test case merges 3 and then 12 files, each with its own images, measures the peak
+    memory of both, and counts the open files as pages are copied. It then checks the
+    in-memory fallback used with unchecked pypdf releases gives the same pages.
+    """
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    file_paths = []
+    for file_number in range(12):
+        file_path = str(tmp_path / f"scan{file_number}.pdf")
+        c = canvas.Canvas(file_path)
+        for page_number in range(4):
+            c.drawImage(ImageReader(Image.frombytes("RGB", (100, 100), os.urandom(100 * 100 * 3))), 100, 400, 200, 200)
+            c.drawString(100, 750, f"Scan {file_number} page {page_number}")
+            c.showPage()
+        c.save()
+        file_paths.append(file_path)
+    output_file = str(tmp_path / "merged.pdf")
+
+    profiled = PdfEdit(metrics_sink=lambda event: None, profile="tracemalloc")
+    small = profiled.merge_streaming(file_paths[:3], output_file, overwrite_confirm=True)
+    large = profiled.merge_streaming(file_paths, output_file, overwrite_confirm=True)
+    assert large["input_bytes"] > 3 * small["input_bytes"]
+    assert large["peak_memory"] < 1.5 * small["peak_memory"], "Peak memory grew with the inputs"
+    assert large["peak_memory"] < large["input_bytes"] / 4, "Inputs held in memory"
+
+    if os.path.isdir("/proc/self/fd"):
+        open_files = []
+        def count_files(done, total):
+            open_files.append(sum(os.path.realpath(f"/proc/self/fd/{fd}").startswith(str(tmp_path))
+                                  for fd in os.listdir("/proc/self/fd")))
+        PdfEdit(progress_callback=count_files).merge_streaming(file_paths, output_file, overwrite_confirm=True)
+        assert max(open_files) <= 2, "More than the output and one input open"
+
+    monkeypatch.setattr(project, "pypdf_version", "6.99.0")
+    report = PdfEdit().merge_streaming(file_paths, output_file, overwrite_confirm=True)
+    pdf_reader = PdfReader(output_file)
+    assert report["pages"] == len(pdf_reader.pages) == 48
+    assert "Scan 11 page 3" in pdf_reader.pages[47].extract_text()
+
+# Test for the batch runner
+def test_batch_isolates_failures(tmp_path):
+    """
+    Test running a batch of watermark jobs where one input is corrupt.
+
+    This test case checks that the corrupt input fails only its own job, and that
+    the other jobs still succeed and are counted in the summary.
+    """
+    for number in range(3):
+        create_test_pdf(str(tmp_path / f"good{number}.pdf"))
+    with open(tmp_path / "corrupt.pdf", "wb") as corrupt:
+        corrupt.write(b"%PDF-1.4 this is not really a pdf")
+    batch = PdfBatch(workers=2, timeout=60)
+
+    jobs = batch.jobs_from_glob(str(tmp_path / "*.pdf"), "add_watermark", str(tmp_path / "out"), watermark_text="Batch")
+    report = batch.run(jobs)
+
+    assert report["jobs"] == 4
+    assert report["succeeded"] == 3 and report["failed"] == 1, "Only the corrupt file should fail"
+    assert report["failures"][0]["job"]["input"].endswith("corrupt.pdf")
+    assert report["pages"] == 3
+    for number in range(3):
+        assert os.path.exists(tmp_path / "out" / f"good{number}.pdf"), "Watermarked file doesn't exist"
+
+    for folder in ("a", "b"):
+        os.makedirs(tmp_path / "nested" / folder)
+        create_test_pdf(str(tmp_path / "nested" / folder / "x.pdf"))
+    jobs = batch.jobs_from_glob(str(tmp_path / "nested" / "**" / "*.pdf"), "add_watermark", str(tmp_path / "nested_out"),
+                                watermark_text="Batch")
+    assert batch.run(jobs)["succeeded"] == 2
+    assert sorted(os.listdir(tmp_path / "nested_out")) == ["a", "b"], "Same named files should keep their folders"
+
+
+def _crashing_batch_job(job, timeout):
+    """
+    Stand-in for project._run_batch_job that takes its worker process down on "crash.pdf".
+    """
+    if job["input"].endswith("crash.pdf"):
+        os._exit(1)
+    return _run_batch_job(job, timeout)
+
+# Test for the batch runner surviving a crashed worker
+def test_batch_worker_crash(tmp_path, monkeypatch):
+    """
+    Test that a job taking its worker process down fails only itself, not the jobs that
+    were in the pool with it or still waiting for it.
+    """
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("The stand-in job only reaches the workers when they are forked")
+    monkeypatch.setattr(project, "_run_batch_job", _crashing_batch_job)
+    for number in range(6):
+        create_test_pdf(str(tmp_path / f"good{number}.pdf"))
+    create_test_pdf(str(tmp_path / "crash.pdf"))
+    batch = PdfBatch(workers=2)
+
+    report = batch.run(batch.jobs_from_glob(str(tmp_path / "*.pdf"), "add_watermark", str(tmp_path / "out"),
+                                            watermark_text="Batch"))
+    assert report["succeeded"] == 6 and report["failed"] == 1
+    assert report["failures"][0]["job"]["input"].endswith("crash.pdf")
+    assert "BrokenProcessPool" in report["failures"][0]["error"]
+
+# Test for the operation pipeline
+def test_pipeline(tmp_path):
+    """
+    Test running split, watermark and encrypt as one pipeline.
+
+    This test case checks that the output holds only the selected pages, is encrypted,
+    carries the watermark, and that every stage was timed.
+    """
+    test_file = str(tmp_path / "pipeline.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(5):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+
+    output_file = str(tmp_path / "pipeline_out.pdf")
+    timings = PdfPipeline().split("2-4").add_watermark("Pipeline").encrypt_pdf("password").run(test_file, output_file)
+
+    assert list(timings) == ["parse", "split", "add_watermark", "encrypt_pdf", "write"]
+    output_reader = PdfReader(output_file)
+    assert output_reader.is_encrypted, "PDF not encrypted"
+    output_reader.decrypt("password")
+    assert len(output_reader.pages) == 3, "Pages in pipeline output don't match range"
+    first_page_text = output_reader.pages[0].extract_text()
+    assert "Page 2" in first_page_text and "Pipeline" in first_page_text
+
+# Test for page range parsing
+def test_page_range():
+    """
+    Test that a PageRange is parsed once, checked against a page count, and rebuilt from page numbers.
+    """
+    page_range = PageRange("1-3, 5, 7")
+    assert page_range.page_numbers(7) == [0, 1, 2, 4, 6]
+    with pytest.raises(ValueError, match="Page number out of range"):
+        page_range.validate(6)
+    with pytest.raises(ValueError, match="Invalid page range"):
+        PageRange("4-2")
+    assert str(PageRange.from_page_numbers([0, 1, 2, 6, 8, 9])) == "1-3, 7, 9-10"
+
+# Test for burst splitting
+def test_split_many(tmp_path):
+    """
+    Test splitting one PDF into many outputs, by explicit ranges, every N pages and at bookmarks.
+    """
+    test_file = str(tmp_path / "statements.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(5):
+        c.drawString(100, 750, f"Statement page {page_number + 1}")
+        if page_number in (0, 3):
+            c.bookmarkPage(f"customer{page_number}")
+            c.addOutlineEntry(f"Customer {page_number}", f"customer{page_number}")
+        c.showPage()
+    c.save()
+    pdf_edit = PdfEdit()
+
+    outputs = [("1-2", str(tmp_path / "a.pdf")), (PageRange("5, 3"), str(tmp_path / "b.pdf"))]
+    assert pdf_edit.split_many(test_file, outputs=outputs) == [path for _, path in outputs]
+    assert "Statement page 5" in PdfReader(outputs[1][1]).pages[0].extract_text()
+
+    parts = pdf_edit.split_many(test_file, every=2, output_dir=str(tmp_path / "every"), workers=2)
+    assert [len(PdfReader(part).pages) for part in parts] == [2, 2, 1]
+
+    parts = pdf_edit.split_many(test_file, at_bookmarks=True, output_dir=str(tmp_path / "bookmarks"))
+    assert [len(PdfReader(part).pages) for part in parts] == [3, 2]
+    assert parts[1].endswith("statements_0002_Customer 3.pdf")
+
+    with pytest.raises(ValueError):
+        # Nothing is written when any range is out of bounds
+        pdf_edit.split_many(test_file, outputs=[("1", str(tmp_path / "c.pdf")), ("9", str(tmp_path / "d.pdf"))])
+    assert not os.path.exists(tmp_path / "c.pdf")
+
+    # Test for optimized parts: worker processes should optimize them just like the serial path
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    image_file = str(tmp_path / "images.pdf")
+    c = canvas.Canvas(image_file)
+    for page_number in range(2):
+        noise = Image.frombytes("RGB", (400, 400), os.urandom(400 * 400 * 3))
+        c.drawImage(ImageReader(noise), 72, 72, 96, 96) # 300 dpi, halved by a 150 dpi limit
+        c.showPage()
+    c.save()
+    pdf_edit = PdfEdit(optimize_output=True, max_image_dpi=150)
+    serial = pdf_edit.split_many(image_file, every=1, output_dir=str(tmp_path / "serial"))
+    parallel = pdf_edit.split_many(image_file, every=1, output_dir=str(tmp_path / "parallel"), workers=2)
+    for serial_part, parallel_part in zip(serial, parallel):
+        assert PdfReader(parallel_part).pages[0].images[0].image.size == (200, 200)
+        assert os.path.getsize(parallel_part) == os.path.getsize(serial_part)
+
+# Test for phase instrumentation
+def test_metrics_sink(pdf_setupteardown, tmp_path):
+    """
+    Test that an attached metrics sink receives an event per phase and one for the whole operation.
+    """
+    test_file, _ = pdf_setupteardown
+    events = []
+    pdf_edit = PdfEdit(metrics_sink=events.append, profile="cprofile")
+
+    output_file = str(tmp_path / "encrypted_metrics.pdf")
+    pdf_edit.encrypt_pdf(test_file, "password", output_file)
+
+    assert [event["phase"] for event in events] == ["parse", "pages", "encrypt", "write", "operation"]
+    assert all(event["operation"] == "encrypt_pdf" and event["duration"] >= 0 for event in events)
+    assert events[0]["bytes_read"] == os.path.getsize(test_file)
+    assert events[1]["pages"] == 1
+    assert events[3]["bytes_written"] == os.path.getsize(output_file)
+    assert "function calls" in events[4]["profile"], "cProfile output missing"
+    with pytest.raises(ValueError):
+        PdfEdit(profile="cprofile") # Nowhere to send the profile
+
+# Test for progress reporting and cancellation
+def test_progress_and_cancel(tmp_path):
+    """
+    Test that operations report progress per page, and that cancelling one stops it
+    without leaving an output file (or a temporary one) behind.
+    """
+    test_file = str(tmp_path / "long.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(4):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+
+    progress = []
+    output_file = str(tmp_path / "watermarked_progress.pdf")
+    PdfEdit(progress_callback=lambda done, total: progress.append((done, total))).add_watermark(test_file, "Progress", output_file)
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+
+    cancel_event = threading.Event()
+    def cancel_after_two(done, total):
+        if done == 2:
+            cancel_event.set()
+    pdf_edit = PdfEdit(progress_callback=cancel_after_two, cancel_event=cancel_event)
+    cancelled_file = str(tmp_path / "encrypted_cancelled.pdf")
+    with pytest.raises(OperationCancelled):
+        pdf_edit.encrypt_pdf(test_file, "password", cancelled_file)
+    assert not os.path.exists(cancelled_file), "Cancelled operation wrote its output"
+    assert not os.path.exists(cancelled_file + ".part"), "Cancelled operation left a temporary file"
+
+# Test for the asyncio API
+def test_async_pdf_edit(tmp_path, monkeypatch):
+    """
+    Test running several async encryptions at once, refusing calls past the pending limit,
+    and cancelling a running watermark through asyncio.
+
+    The watermark is held at its first page until it's cancelled, through the per page
+    progress hook, so the test doesn't depend on how fast the machine is.
+    """
+    test_file = str(tmp_path / "async.pdf")
+    create_test_pdf(test_file)
+    long_file = str(tmp_path / "async_long.pdf")
+    c = canvas.Canvas(long_file)
+    for page_number in range(20):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+    started = threading.Event()
+    page_done = PdfEdit._page_done
+
+    def hold_first_page(self, done, total):
+        if self.cancel_event is not None and not started.is_set():
+            started.set()
+            self.cancel_event.wait(10) # Until the awaiting task is cancelled
+        page_done(self, done, total)
+
+    async def scenario():
+        async_edit = AsyncPdfEdit(max_concurrency=2, max_pending=2)
+        outputs = [str(tmp_path / f"encrypted_async{number}.pdf") for number in range(4)]
+        calls = [asyncio.ensure_future(async_edit.encrypt_pdf(test_file, "password", output)) for output in outputs]
+        await asyncio.sleep(0) # Let all four calls start: two run, two wait
+        with pytest.raises(PdfEditBusy):
+            await async_edit.split(test_file, "1", str(tmp_path / "refused.pdf"))
+        await asyncio.gather(*calls)
+        assert all(PdfReader(output).is_encrypted for output in outputs), "PDF not encrypted"
+
+        cancelled_file = str(tmp_path / "watermarked_cancelled.pdf")
+        monkeypatch.setattr(PdfEdit, "_page_done", hold_first_page)
+        watermark = asyncio.ensure_future(async_edit.add_watermark(long_file, "Async", cancelled_file))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+        watermark.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await watermark
+        assert not os.path.exists(cancelled_file), "Cancelled operation wrote its output"
+        await async_edit.close()
+
+    asyncio.run(scenario())
+
+
+# Test for the parsed-document cache
+def test_document_cache(tmp_path):
+    """
+    Test that the document cache reuses parsed files, notices changed files, evicts
+    the least recently used file, and never keeps encrypted files.
+    """
+    template = str(tmp_path / "template.pdf")
+    cover = str(tmp_path / "cover.pdf")
+    create_test_pdf(template)
+    create_test_pdf(cover)
+    cache = DocumentCache(max_bytes=os.path.getsize(template) + os.path.getsize(cover))
+    pdf_edit = PdfEdit(document_cache=cache)
+
+    pdf_edit.add_watermark(template, "First", str(tmp_path / "first.pdf"))
+    pdf_edit.add_watermark(template, "Second", str(tmp_path / "second.pdf"))
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert "Second" in PdfReader(str(tmp_path / "second.pdf")).pages[0].extract_text()
+
+    # Rewrite the template with two pages, the cache has to notice
+    c = canvas.Canvas(template)
+    c.showPage()
+    c.showPage()
+    c.save()
+    os.utime(template, ns=(0, os.stat(template).st_mtime_ns + 1)) # Make sure the mtime moves
+    pdf_edit.merge([template, cover], str(tmp_path / "merged.pdf"), overwrite_confirm=True)
+    assert cache.invalidations == 1
+    assert len(PdfReader(str(tmp_path / "merged.pdf")).pages) == 3, "Stale template was used"
+
+    pdf_edit.encrypt_pdf(cover, "password", str(tmp_path / "encrypted.pdf"))
+    pdf_edit.decrypt_pdf(str(tmp_path / "encrypted.pdf"), "password", str(tmp_path / "decrypted.pdf"))
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["evictions"] == 1, "Bigger template should push the cover out"
+    assert stats["bytes"] <= cache.max_bytes
+    assert 0 < stats["hit_rate"] < 1
+
+# Test for incremental saving
+def test_incremental_save(tmp_path):
+    """
+    Test that incremental saves keep the original bytes and only append the update.
+
+    This test case watermarks a copy of a PDF incrementally and in place, checks the original
+    bytes are untouched at the start of both outputs, and that a metadata edit only appends
+    a small update that is read back.
+    """
+    test_file = str(tmp_path / "original.pdf")
+    create_test_pdf(test_file)
+    with open(test_file, "rb") as original_file:
+        original = original_file.read()
+    pdf_edit = PdfEdit()
+
+    output_file = str(tmp_path / "watermarked.pdf")
+    pdf_edit.add_watermark(test_file, "Incremental Watermark", output_file, incremental=True)
+    with open(output_file, "rb") as output:
+        watermarked = output.read()
+    assert watermarked.startswith(original), "Original bytes should be kept as they are"
+    assert "Incremental Watermark" in PdfReader(output_file).pages[0].extract_text()
+    assert not os.path.exists(output_file + ".part")
+
+    in_place_file = str(tmp_path / "in_place.pdf")
+    with open(in_place_file, "wb") as in_place:
+        in_place.write(original)
+    pdf_edit.add_watermark(in_place_file, "Incremental Watermark", in_place_file, incremental=True)
+    with open(in_place_file, "rb") as in_place:
+        assert in_place.read() == watermarked, "In place update should match the copied one"
+
+    metadata_file = str(tmp_path / "metadata.pdf")
+    pdf_edit.edit_metadata(test_file, {"/Title": "Incremental"}, metadata_file, incremental=True)
+    assert PdfReader(metadata_file).metadata.title == "Incremental"
+    assert os.path.getsize(metadata_file) - len(original) < 1024, "Only the info dict should be appended"
+
+# Test for bytes and stream inputs and outputs
+def test_bytes_in_bytes_out(pdf_setupteardown):
+    """
+    Test that operations take bytes and streams as inputs and return bytes or write to streams.
+
+    This test case merges two PDFs given as bytes and a memoryview without touching the disk,
+    splits the result from a stream into a stream, and round trips encryption through bytes.
+    """
+    test_file1, test_file2 = pdf_setupteardown
+    with open(test_file1, "rb") as pdf_file1, open(test_file2, "rb") as pdf_file2:
+        pdf_bytes1 = pdf_file1.read()
+        pdf_bytes2 = pdf_file2.read()
+    pdf_edit = PdfEdit()
+
+    report = pdf_edit.merge([pdf_bytes1, memoryview(pdf_bytes2)], None, overwrite_confirm=False)
+    merged = report["output"]
+    assert merged.startswith(b"%PDF"), "Merge should return the PDF as bytes"
+    assert report["pages"] == 2 and report["duplicates"] == []
+    assert len(PdfReader(io.BytesIO(merged)).pages) == 2
+
+    output = io.BytesIO()
+    assert pdf_edit.split(io.BytesIO(merged), "2", output) is None
+    assert len(PdfReader(output).pages) == 1
+
+    encrypted = pdf_edit.encrypt_pdf(test_file1, "password", None) # Path in, bytes out
+    decrypted = pdf_edit.decrypt_pdf(encrypted, "password", None)
+    assert "Hello, World!" in PdfReader(io.BytesIO(decrypted)).pages[0].extract_text()
+
+# Test for the optimize stage
+def test_optimize(tmp_path):
+    """
+    Test that optimizing removes duplicates, downsamples images and reports what it saved.
+
+    This test case merges a file holding a large image drawn small with itself, so the image
+    is duplicated and shown at 300 dpi, then optimizes the result with a 150 dpi limit.
+    """
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+
+    test_file = str(tmp_path / "image.pdf")
+    noise = Image.frombytes("RGB", (400, 400), os.urandom(400 * 400 * 3)) # Noise doesn't compress away
+    c = canvas.Canvas(test_file)
+    c.drawString(100, 750, "Hello, World!")
+    c.drawImage(ImageReader(noise), 72, 72, 96, 96) # 400 pixels over 96 points is 300 dpi
+    c.save()
+    pdf_edit = PdfEdit()
+    merged = pdf_edit.merge([test_file, test_file], None, overwrite_confirm=False)["output"]
+
+    optimized_file = str(tmp_path / "optimized.pdf")
+    report = pdf_edit.optimize(merged, optimized_file, max_image_dpi=150)
+    assert report["images"] > 0 and report["duplicates"] > 0
+    assert report["after_bytes"] < report["before_bytes"] / 2
+    assert os.path.getsize(optimized_file) < len(merged)
+    optimized_reader = PdfReader(optimized_file)
+    assert len(optimized_reader.pages) == 2
+    assert optimized_reader.pages[1].images[0].image.size == (200, 200), "Image should be halved to 150 dpi"
+    assert "Hello, World!" in optimized_reader.pages[1].extract_text()
+
+    pipeline = PdfPipeline().split("1").optimize()
+    timings = pipeline.run(optimized_file, str(tmp_path / "pipeline.pdf"))
+    assert list(timings) == ["parse", "split", "optimize", "write"]
+    assert pipeline.optimize_report["unreferenced"] >= 0
+
+# Test for encrypting for many recipients
+def test_encrypt_many(pdf_setupteardown, tmp_path):
+    """
+    Test that one source is encrypted for each recipient with their own password and permissions.
+
+    This test case reads recipients from a CSV manifest, encrypts for them in two worker
+    processes, and checks each variant only opens with its own password and has the
+    requested algorithm and permissions.
+    """
+    test_file1, _ = pdf_setupteardown
+    manifest = tmp_path / "recipients.csv"
+    manifest.write_text("recipient,password,permissions,output\n"
+                        f"alice,alice-pw,,{tmp_path / 'out' / 'alice.pdf'}\n"
+                        f"bob,bob-pw,print|extract_text_and_graphics,{tmp_path / 'out' / 'bob.pdf'}\n"
+                        f"carol,carol-pw,,{tmp_path / 'out' / 'carol.pdf'}\n", encoding="utf-8")
+    pdf_edit = PdfEdit()
+    recipients = pdf_edit.read_recipients(str(manifest))
+
+    report = pdf_edit.encrypt_many(test_file1, recipients, algorithm="AES-128", workers=2)
+    assert report["succeeded"] == 3 and report["failed"] == 0
+    assert report["documents_per_sec"] > 0
+    for recipient in recipients:
+        encrypted_reader = PdfReader(recipient["output"])
+        assert encrypted_reader.trailer["/Encrypt"]["/V"] == 4, "AES-128 should be used"
+        assert not encrypted_reader.decrypt("wrong-pw")
+        assert encrypted_reader.decrypt(recipient["password"])
+        assert "Hello, World!" in encrypted_reader.pages[0].extract_text()
+    bob_permissions = PdfReader(recipients[1]["output"]).user_access_permissions.to_dict()
+    assert bob_permissions["print"] and not bob_permissions["modify"]
+
+    with pytest.raises(ValueError):
+        pdf_edit.encrypt_many(test_file1, [dict(recipients[0], permissions=["fly"])])
+
+# Test for duplicate page detection in merge
+def test_merge_duplicates(tmp_path):
+    """
+    Test that merge reports or skips duplicate pages, and that the page index is reused.
+
+    This test case merges a file with a copy of itself and a different file, checks the
+    copied pages are reported and then skipped, and that a saved and reloaded index
+    answers for the unchanged files instead of fingerprinting them again.
+    """
+    first_file = str(tmp_path / "first.pdf")
+    copy_file = str(tmp_path / "copy.pdf")
+    other_file = str(tmp_path / "other.pdf")
+    create_test_pdf(first_file)
+    c = canvas.Canvas(copy_file, pageCompression=0) # Same page, stored uncompressed this time
+    c.drawString(100, 750, "Hello, World!")
+    c.save()
+    c = canvas.Canvas(other_file)
+    c.drawString(100, 750, "Something else")
+    c.save()
+    pdf_edit = PdfEdit()
+    file_paths = [first_file, copy_file, other_file]
+
+    report = pdf_edit.merge(file_paths, str(tmp_path / "reported.pdf"), False, duplicates="report")
+    assert report["duplicates"] == [{"input": 2, "file": copy_file, "page": 1,
+                                     "duplicate_of": {"input": 1, "file": first_file, "page": 1}}]
+    assert len(PdfReader(str(tmp_path / "reported.pdf")).pages) == 3
+
+    page_index = PageIndex()
+    report = pdf_edit.merge(file_paths, str(tmp_path / "skipped.pdf"), False, duplicates="skip", page_index=page_index)
+    assert report["pages"] == 2 and report["pages_skipped"] == 1
+    assert len(PdfReader(str(tmp_path / "skipped.pdf")).pages) == 2
+
+    index_file = str(tmp_path / "pages.json")
+    page_index.save(index_file)
+    reloaded_index = PageIndex.load(index_file)
+    pdf_edit.merge(file_paths, str(tmp_path / "again.pdf"), True, duplicates="skip", page_index=reloaded_index)
+    assert reloaded_index.hits == 3 and reloaded_index.misses == 0
+
+    report = pdf_edit.merge([first_file, first_file], None, True, duplicates="skip")
+    assert report["pages"] == 1 and report["pages_skipped"] == 1, "The same file given twice should be a duplicate"
+    assert report["duplicates"][0]["input"] == 2 and report["duplicates"][0]["duplicate_of"]["input"] == 1
+    assert len(PdfReader(io.BytesIO(report["output"])).pages) == 1
+
+# Test for page-parallel watermarking
+def test_add_watermark_workers(tmp_path):
+    """
+    Test that watermarking, with one worker or several, stamps every page and keeps the
+    outline, links and metadata.
+
+    This test case adds a bookmark, a link and a title to a multi-page file, watermarks it
+    with one and with two workers, as a full rewrite and as an incremental update, and
+    checks the result.
+    """
+    test_file = str(tmp_path / "long.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(10):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+    pdf_writer = PdfWriter(clone_from=test_file)
+    pdf_writer.add_outline_item("Chapter 2", 5)
+    pdf_writer.add_annotation(0, Link(rect=(0, 0, 100, 100), target_page_index=9))
+    pdf_writer.add_metadata({"/Title": "Long report"})
+    pdf_writer.write(test_file)
+
+    for workers, incremental in ((1, False), (1, True), (2, False), (2, True)):
+        output_file = str(tmp_path / f"stamped_{workers}_{incremental}.pdf")
+        PdfEdit().add_watermark(test_file, "Confidential", output_file, incremental=incremental, workers=workers)
+        pdf_reader = PdfReader(output_file)
+        assert pdf_reader.metadata.title == "Long report"
+        assert len(pdf_reader.pages) == 10
+        for page_number, page in enumerate(pdf_reader.pages):
+            text = page.extract_text()
+            assert f"Page {page_number + 1}" in text and "Confidential" in text
+        outline = pdf_reader.outline
+        assert outline[0].title == "Chapter 2" and pdf_reader.get_destination_page_number(outline[0]) == 5
+        link = pdf_reader.pages[0]["/Annots"][0].get_object()
+        assert link["/Dest"][0] == pdf_reader.pages[9].indirect_reference, "Link should point at the last page"
+        if workers > 1:
+            with open(test_file, "rb") as original, open(output_file, "rb") as stamped:
+                assert stamped.read().startswith(original.read()), "Workers should append an update to the original"
+
+
+# Test for parallel watermarking of a nested page tree
+def test_add_watermark_workers_page_tree(tmp_path):
+    """
+    Test that watermarking with several workers handles intermediate page tree nodes,
+    inherited resources, shifted media boxes and a name already taken by the page.
+
+    This test case regroups the pages of a file under two intermediate nodes that carry the
+    shared resources, watermarks the bytes with two workers and checks every page.
+    """
+    pikepdf = pytest.importorskip("pikepdf")
+    test_file = str(tmp_path / "tree.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(12):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+    with pikepdf.open(test_file, allow_overwriting_input=True) as pdf:
+        pages = pdf.Root.Pages
+        kids = list(pages.Kids)
+        resources = kids[0].Resources
+        nodes = []
+        for part in (kids[:6], kids[6:]):
+            node = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Pages, Kids=pikepdf.Array(part), Count=len(part), Parent=pages, Resources=resources))
+            for kid in part:
+                kid.Parent = node
+                del kid.Resources
+            nodes.append(node)
+        pages.Kids = pikepdf.Array(nodes)
+        kids[0].MediaBox = pikepdf.Array([10, 20, 600, 800])
+        taken = pdf.make_stream(b"", Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Form, BBox=pikepdf.Array([0, 0, 1, 1]))
+        kids[1].Resources = pikepdf.Dictionary(Font=resources.Font, XObject=pikepdf.Dictionary(Watermark=taken))
+        pdf.save(test_file)
+    with open(test_file, "rb") as f:
+        data = f.read()
+
+    stamped = PdfEdit().add_watermark(data, "Confidential", None, workers=2)
+    assert stamped.startswith(data)
+    pdf_reader = PdfReader(io.BytesIO(stamped))
+    assert len(pdf_reader.pages) == 12
+    for page_number, page in enumerate(pdf_reader.pages):
+        text = page.extract_text()
+        assert f"Page {page_number + 1}" in text and "Confidential" in text
+    with pikepdf.open(io.BytesIO(stamped)) as pdf:
+        assert pdf.check_pdf_syntax() == []
+        assert b"1 0 0 1 10.00 20.00 cm /Watermark Do" in pdf.pages[0].Contents[-1].read_bytes()
+        assert set(pdf.pages[1].Resources.XObject.keys()) == {"/Watermark", "/Watermark_"}
+
+
+# Test for the text search index
+def test_text_index(tmp_path):
+    """
+    Test that the text index finds phrases by file and page, only re-indexes what changed,
+    and gives page ranges that split accepts.
+
+    This test case indexes two files and a broken one, searches them, then changes, touches
+    and deletes files and updates the index again.
+    """
+    def write_pages(file_name, texts):
+        c = canvas.Canvas(str(tmp_path / file_name))
+        for text in texts:
+            c.drawString(100, 750, text)
+            c.showPage()
+        c.save()
+    write_pages("a.pdf", ["Quarterly report", "Nothing here", "The quarterly report, continued", "Quarterly summary"])
+    write_pages("b.pdf", ["Report quarterly", "quarterly report"])
+    with open(tmp_path / "broken.pdf", "wb") as broken:
+        broken.write(b"not a pdf")
+
+    with TextIndex(str(tmp_path / "index.db")) as text_index:
+        report = text_index.update([str(tmp_path)])
+        assert report["indexed"] == 2 and report["pages"] == 6 and len(report["errors"]) == 1
+        a_file, b_file = str(tmp_path / "a.pdf"), str(tmp_path / "b.pdf")
+        assert text_index.search("quarterly report") == [(a_file, 1), (a_file, 3), (b_file, 2)]
+        ranges = text_index.search_ranges("quarterly report")
+        assert ranges[a_file].text == "1, 3"
+        PdfEdit().split(a_file, ranges[a_file], str(tmp_path / "hits.pdf"))
+        assert len(PdfReader(str(tmp_path / "hits.pdf")).pages) == 2
+
+        write_pages("b.pdf", ["Annual report"])
+        os.utime(a_file) # Touched, but the same contents
+        report = text_index.update([a_file, b_file])
+        assert report["indexed"] == 1 and report["unchanged"] == 1
+        assert text_index.search("quarterly report") == [(a_file, 1), (a_file, 3)]
+        assert text_index.search("annual") == [(b_file, 1)]
+
+        os.remove(b_file)
+        report = text_index.update([a_file])
+        assert report["removed"] == 1 and report["unchanged"] == 1 and report["indexed"] == 0
+        assert text_index.search("annual") == []
+        with pytest.raises(ValueError):
+            text_index.search("AND (", raw=True)
+
+
+# Test for the watch-folder daemon
+def test_watcher(tmp_path):
+    """
+    Test that the watcher waits for files to settle, runs each folder's rule on them,
+    dead-letters failures and keeps its status file up to date.
+
+    This test case drops files into a watermark, an encrypt and two merge folders (plus a
+    corrupt file, one still being written and one with nothing to merge it with) and polls
+    until every job is done. Then a file with a name that was already used is dropped again.
+    """
+    for folder, names in (("a", ["one.pdf", "two.pdf"]), ("b", ["secret.pdf"]), ("c", ["part1.pdf", "part2.pdf"]),
+                          ("d", ["lonely.pdf"])):
+        os.makedirs(tmp_path / folder)
+        for name in names:
+            create_test_pdf(str(tmp_path / folder / name))
+    with open(tmp_path / "a" / "corrupt.pdf", "wb") as corrupt:
+        corrupt.write(b"%PDF-1.4 this is not really a pdf")
+    rules = [
+        {"folder": str(tmp_path / "a"), "operation": "add_watermark", "output_dir": str(tmp_path / "out_a"), "watermark_text": "Scanned"},
+        {"folder": str(tmp_path / "b"), "operation": "encrypt_pdf", "output_dir": str(tmp_path / "out_b"), "password": "secret"},
+        {"folder": str(tmp_path / "c"), "operation": "merge", "output_dir": str(tmp_path / "out_c"), "batch_size": 2},
+        {"folder": str(tmp_path / "d"), "operation": "merge", "output_dir": str(tmp_path / "out_d"), "batch_wait": 0},
+    ]
+    status_file = str(tmp_path / "status.json")
+    watcher = PdfWatcher(rules, str(tmp_path / "dead"), status_path=status_file, workers=2, settle_seconds=0)
+
+    status = watcher.poll()
+    assert status["waiting"] == 7 and status["queue_depth"] == 0, "Files are only picked up once they settle"
+    with open(tmp_path / "b" / "secret.pdf", "ab") as growing:
+        growing.write(b"\n") # Still being written
+    status = watcher.poll()
+    assert status["waiting"] == 1 and status["queue_depth"] == 4, "Three watermark jobs and one merge"
+    for _ in range(200):
+        status = watcher.poll()
+        if status["queue_depth"] == 0 and status["waiting"] == 0:
+            break
+        time.sleep(0.05)
+    watcher.close()
+
+    assert status["succeeded"] == 4 and status["failed"] == 2
+    with open(status_file, "r", encoding="utf-8") as status_json:
+        assert json.load(status_json)["succeeded"] == 4
+    assert sorted(os.listdir(tmp_path / "out_a")) == ["one.pdf", "two.pdf"]
+    assert PdfReader(str(tmp_path / "out_b" / "secret.pdf")).is_encrypted
+    merged = os.listdir(tmp_path / "out_c")
+    assert len(merged) == 1 and len(PdfReader(str(tmp_path / "out_c" / merged[0])).pages) == 2
+    assert sorted(os.listdir(tmp_path / "a" / "processed")) == ["one.pdf", "two.pdf"]
+    assert sorted(os.listdir(tmp_path / "dead" / "a")) == ["corrupt.pdf", "corrupt.pdf.error.json"]
+    assert [name for name in os.listdir(tmp_path / "a") if name.endswith(".pdf")] == []
+    assert sorted(os.listdir(tmp_path / "dead" / "d")) == ["lonely.pdf", "lonely.pdf.error.json"]
+
+    create_test_pdf(str(tmp_path / "a" / "one.pdf")) # Same name as a file already done
+    for _ in range(200):
+        status = watcher.poll()
+        if status["succeeded"] == 5:
+            break
+        time.sleep(0.05)
+    watcher.close()
+    assert sorted(os.listdir(tmp_path / "out_a")) == ["one.pdf", "one_1.pdf", "two.pdf"], "Earlier output overwritten"
+    assert sorted(os.listdir(tmp_path / "a" / "processed")) == ["one.pdf", "one_1.pdf", "two.pdf"]
+
+
+# Test for the benchmark suite's regression check
+def test_benchmark_compare_results():
+    """
+    Test the percentile interpolation and the regression rules the benchmark baseline check uses.
+    """
+    from benchmark import compare_results, percentile, run_suite
+
+    assert percentile([], 0.95) == 0.0
+    assert percentile([5.0], 0.5) == 5.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 0.5) == 2.5, "Values should be sorted and interpolated"
+    assert percentile([1.0, 2.0, 3.0], 1.0) == 3.0
+
+    def operation(pages_per_sec, p95, peak_rss):
+        return {"pages_per_sec": pages_per_sec, "latency": {"p95": p95}, "peak_rss": peak_rss}
+    baseline = {"operations": {"merge": operation(100, 0.5, 100 * 2**20), "split": operation(100, 0.5, None)}}
+    within = {"operations": {"merge": operation(91, 0.54, 109 * 2**20), "split": operation(100, 0.5, 500 * 2**20),
+                             "optimize": operation(1, 10, None)}}
+    assert compare_results(within, baseline) == [], "Changes within tolerance, or without a baseline, aren't regressions"
+    regressed = compare_results({"operations": {"merge": operation(80, 0.6, 120 * 2**20)}}, baseline)
+    assert len(regressed) == 3 and all(message.startswith("merge: ") for message in regressed)
+    assert compare_results({"operations": {"merge": operation(80, 0.5, None)}}, baseline, tolerance=0.25) == []
+
+    with pytest.raises(ValueError):
+        run_suite(files=1)
+
+
+# Test for the result cache
+def test_result_cache(pdf_setupteardown, tmp_path):
+    """
+    Test that repeating an operation takes its output from the result cache without parsing,
+    that changed parameters or passwords miss, that passwords aren't stored, and that the
+    cache stays under its size limit.
+    """
+    test_file1, test_file2 = pdf_setupteardown
+    events = []
+    cache_dir = str(tmp_path / "cache")
+    pdf_edit = PdfEdit(metrics_sink=events.append, result_cache=ResultCache(cache_dir))
+
+    pdf_edit.add_watermark(test_file1, "Nightly", str(tmp_path / "first.pdf"))
+    del events[:]
+    pdf_edit.add_watermark(test_file1, "Nightly", str(tmp_path / "second.pdf"))
+    assert [event["cache_hit"] for event in events if event["phase"] == "cache"] == [True]
+    assert not any(event["phase"] == "parse" for event in events), "A hit shouldn't parse anything"
+    with open(tmp_path / "first.pdf", "rb") as first, open(tmp_path / "second.pdf", "rb") as second:
+        assert first.read() == second.read()
+    assert pdf_edit.add_watermark(test_file1, "Nightly", None)[:4] == b"%PDF"
+    pdf_edit.add_watermark(test_file1, "Weekly", str(tmp_path / "third.pdf"))
+
+    pdf_edit.encrypt_pdf(test_file2, "hunter2", str(tmp_path / "encrypted.pdf"))
+    pdf_edit.encrypt_pdf(test_file2, "hunter2", str(tmp_path / "encrypted.pdf"))
+    pdf_edit.encrypt_pdf(test_file2, "other", str(tmp_path / "other.pdf"))
+    assert PdfReader(str(tmp_path / "encrypted.pdf")).decrypt("hunter2")
+    with open(os.path.join(cache_dir, "index.json"), "r", encoding="utf-8") as index:
+        assert "hunter2" not in index.read()
+    stats = pdf_edit.result_cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 4 and stats["hit_rate"] == 3 / 7
+    with open(os.path.join(cache_dir, "index.json"), "r", encoding="utf-8") as index:
+        saved = index.read()
+    pdf_edit.add_watermark(test_file1, "Nightly", None)
+    with open(os.path.join(cache_dir, "index.json"), "r", encoding="utf-8") as index:
+        assert index.read() == saved, "A hit shouldn't rewrite the index"
+    stats = pdf_edit.result_cache.stats()
+
+    with open(test_file1, "rb") as source:
+        content = source.read()
+    for name in ("c.pdf", "d.pdf", "e.pdf", "f.pdf"): # Four copies of the same file
+        (tmp_path / name).write_bytes(content)
+    pdf_edit.merge([str(tmp_path / "c.pdf"), str(tmp_path / "d.pdf")], None, True, duplicates="report")
+    report = pdf_edit.merge([str(tmp_path / "e.pdf"), str(tmp_path / "f.pdf")], None, True, duplicates="report")
+    assert pdf_edit.result_cache.stats()["hits"] == 5, "Same content should hit whatever the file names"
+    assert report["duplicates"][0]["file"] == str(tmp_path / "f.pdf"), "Cached report should name the current inputs"
+    assert report["duplicates"][0]["duplicate_of"]["file"] == str(tmp_path / "e.pdf")
+
+    pdf_edit.result_cache.flush()
+    reopened = ResultCache(cache_dir, max_bytes=stats["current_bytes"] // 2)
+    assert PdfEdit(result_cache=reopened).split(test_file1, "1", None)[:4] == b"%PDF"
+    assert reopened.stats()["evictions"] > 0 and reopened.current_bytes <= reopened.max_bytes
+
+
+# Test for the command line interface
+def test_cli(pdf_setupteardown, tmp_path, capsys):
+    """
+    Test that the command line runs operations without the GUI, reports failures with a
+    non-zero status, and that importing the module doesn't import tkinter or reportlab.
+    """
+    test_file1, test_file2 = pdf_setupteardown
+    merged_file = str(tmp_path / "merged.pdf")
+    assert main(["merge", test_file1, test_file2, "-o", merged_file]) == 0
+    assert main(["split", merged_file, "2", "-o", str(tmp_path / "split.pdf")]) == 0
+    assert len(PdfReader(str(tmp_path / "split.pdf")).pages) == 1
+    assert main(["encrypt", test_file1, "-o", str(tmp_path / "encrypted.pdf"), "--password", "secret"]) == 0
+    assert PdfReader(str(tmp_path / "encrypted.pdf")).is_encrypted
+
+    capsys.readouterr()
+    assert main(["probe", merged_file]) == 0
+    assert '"pages": 2' in capsys.readouterr().out
+    assert main(["merge", test_file1, test_file2, "-o", merged_file]) == 1, "Should refuse to overwrite without --force"
+    assert "already exists" in capsys.readouterr().err
+
+    imported = subprocess.run([sys.executable, "-c", "import sys, project; print(sorted(m for m in ('tkinter', 'reportlab') if m in sys.modules))"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    assert imported.stdout.strip() == "[]"
+
+
+# Test for the metadata probe
+def test_probe(tmp_path):
+    """
+    Test that probe reads page counts, sizes and encryption, and that bulk results are cached.
+
+    This test case probes a file with two page sizes and a rotated page, an encrypted copy
+    of it without the password, and a broken file, then probes the directory twice.
+    """
+    test_file = str(tmp_path / "sizes.pdf")
+    c = canvas.Canvas(test_file, pagesize=(612, 792))
+    c.showPage()
+    c.setPageSize((842, 595))
+    c.showPage()
+    c.save()
+    pdf_writer = PdfWriter(clone_from=test_file)
+    pdf_writer.pages[0].rotate(90)
+    pdf_writer.encrypt("password")
+    pdf_writer.write(str(tmp_path / "encrypted.pdf"))
+    with open(tmp_path / "broken.pdf", "wb") as broken:
+        broken.write(b"not a pdf")
+    pdf_edit = PdfEdit()
+
+    result = pdf_edit.probe(test_file)
+    assert result["pages"] == 2 and not result["encrypted"]
+    assert result["page_sizes"] == [{"width": 612.0, "height": 792.0, "pages": 1}, {"width": 842.0, "height": 595.0, "pages": 1}]
+    result = pdf_edit.probe(str(tmp_path / "encrypted.pdf"))
+    assert result["encrypted"] and result["needs_password"]
+    assert result["pages"] == 2, "Page tree should be readable without the password"
+    assert result["page_sizes"][0] == {"width": 792.0, "height": 612.0, "pages": 1}, "Rotation should be applied"
+
+    cache_file = str(tmp_path / "probe.json")
+    report = pdf_edit.probe_directory(str(tmp_path), cache_path=cache_file)
+    assert report["files"] == 3 and report["errors"] == 1 and report["cache_hits"] == 0
+    report = pdf_edit.probe_directory(str(tmp_path), cache_path=cache_file)
+    assert report["cache_hits"] == 3
+
+
+# Test for variable stamping
+def test_stamp_pages(tmp_path, monkeypatch):
+    """
+    Test that stamp_pages numbers pages on across files, shares one form XObject and
+    font between the pages, and carries the numbering on from call to call.
+
+    This test case stamps a 3 page and a (rotated) 2 page file as one output with Bates
+    numbers and a label, then stamps the second file again starting from "next".
+    """
+    test_files = []
+    for name, pages in (("first", 3), ("second", 2)):
+        test_file = str(tmp_path / f"{name}.pdf")
+        c = canvas.Canvas(test_file)
+        for page_number in range(pages):
+            c.drawString(100, 750, f"{name} {page_number + 1}")
+            c.showPage()
+        c.save()
+        test_files.append(test_file)
+    pdf_writer = PdfWriter(clone_from=test_files[1])
+    pdf_writer.pages[0].rotate(90)
+    pdf_writer.write(test_files[1])
+    output_file = str(tmp_path / "stamped.pdf")
+
+    report = PdfEdit().stamp_pages(test_files, "ABC{number:06d} {file} {page}/{pages} of {total}", output_file,
+                                   start=41, label="CONFIDENTIAL")
+    assert report == {"files": 2, "pages": 5, "first": 41, "last": 45, "next": 46}
+    pdf_reader = PdfReader(output_file)
+    expected = ["first 1/3", "first 2/3", "first 3/3", "second 1/2", "second 2/2"]
+    for number, (page, stamp) in enumerate(zip(pdf_reader.pages, expected), start=41):
+        text = page.extract_text()
+        assert f"ABC{number:06d} {stamp} of 5" in text and "CONFIDENTIAL" in text
+        assert stamp.split("/")[0] in text, "The page's own content should be kept"
+    forms = {page["/Resources"]["/XObject"].raw_get("/Stamp").idnum for page in pdf_reader.pages}
+    assert len(forms) == 1, "Every page should draw the same form XObject"
+    file_id = pdf_reader.trailer["/ID"]
+    assert len(file_id) == 2 and file_id[0] == file_id[1] and len(file_id[0]) == 16
+    assert pdf_reader.pdf_header == "%PDF-1.3", "The header should be the inputs' version"
+
+    report = PdfEdit().stamp_pages(test_files[1:], "ABC{number:06d}", None, start=report["next"])
+    assert report["first"] == 46 and report["next"] == 48
+    assert "ABC000047" in PdfReader(io.BytesIO(report["output"])).pages[1].extract_text()
+    with pytest.raises(ValueError):
+        PdfEdit().stamp_pages(test_files, "{unknown}", output_file)
+    with pytest.raises(ValueError):
+        PdfEdit().stamp_pages(test_files, "{number}", output_file, anchor="middle")
+    # Test for a pypdf release streaming wasn't checked against: the whole document is written at once
+    monkeypatch.setattr(project, "pypdf_version", "6.99.0")
+    monkeypatch.setattr(PdfEdit, "_write_streamed", None) # Fails if the streamed path is taken
+    report = PdfEdit().stamp_pages(test_files, "ABC{number:06d}", None, start=41)
+    assert report["pages"] == 5 and report["next"] == 46
+    pdf_reader = PdfReader(io.BytesIO(report["output"]))
+    assert [page.extract_text().count("ABC0000") for page in pdf_reader.pages] == [1] * 5
+    assert "ABC000045" in pdf_reader.pages[4].extract_text()
+
+
+# Test for linearized output
+def test_linearize(tmp_path):
+    """
+    Test that linearized output lets the first page be rendered from a prefix of the file,
+    and that encryption survives linearizing.
+
+    This test case splits 20 pages out of a 30 page file with linearize set, keeps only the
+    bytes up to the end of the first page section (/E in the linearization dictionary), and
+    reads the first page from them with a page tree of its own pointing at /O.
+    """
+    pytest.importorskip("pikepdf")
+    test_file = str(tmp_path / "long.pdf")
+    c = canvas.Canvas(test_file)
+    for page_number in range(30):
+        c.drawString(100, 750, f"Page {page_number + 1}")
+        c.showPage()
+    c.save()
+    pdf_edit = PdfEdit(linearize=True)
+
+    split = pdf_edit.split(test_file, "1-20", None)
+    assert b"/Linearized" not in PdfEdit().split(test_file, "1-20", None)[:1024]
+    linearized = re.search(rb"/Linearized 1[^>]*>>", split[:1024]).group(0)
+    first_page_end = int(re.search(rb"/E (\d+)", linearized).group(1))
+    first_page = int(re.search(rb"/O (\d+)", linearized).group(1))
+    assert first_page_end < len(split) / 2, "The first page should be near the front"
+    # Only the prefix is kept, with a page tree, catalog and xref table added after it
+    prefix = bytearray(split[:first_page_end])
+    offsets = {int(match.group(1)): match.start(1) for match in re.finditer(rb"(?<![0-9])(\d+) 0 obj", prefix)}
+    size = max(offsets) + 3
+    offsets[size - 2] = len(prefix) + 1
+    prefix += f"\n{size - 2} 0 obj\n<< /Type /Pages /Kids [ {first_page} 0 R ] /Count 1 >>\nendobj\n".encode()
+    offsets[size - 1] = len(prefix)
+    prefix += f"{size - 1} 0 obj\n<< /Type /Catalog /Pages {size - 2} 0 R >>\nendobj\n".encode()
+    xref_location = len(prefix)
+    prefix += f"xref\n0 {size}\n".encode()
+    for idnum in range(size):
+        prefix += f"{offsets[idnum]:010d} 00000 n \n".encode() if idnum in offsets else b"0000000000 65535 f \n"
+    prefix += f"trailer\n<< /Root {size - 1} 0 R /Size {size} >>\nstartxref\n{xref_location}\n%%EOF\n".encode()
+    assert "Page 1" in PdfReader(io.BytesIO(bytes(prefix))).pages[0].extract_text()
+    assert len(PdfReader(io.BytesIO(split)).pages) == 20
+
+    encrypted = pdf_edit.encrypt_pdf(test_file, "secret", None)
+    assert b"/Linearized" in encrypted[:1024]
+    encrypted_reader = PdfReader(io.BytesIO(encrypted))
+    assert encrypted_reader.is_encrypted and not encrypted_reader.decrypt("wrong")
+    assert encrypted_reader.decrypt("secret")
+    assert "Page 30" in encrypted_reader.pages[29].extract_text()